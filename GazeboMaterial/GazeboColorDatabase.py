@@ -0,0 +1,214 @@
+import os
+import sys
+import mmap
+import struct
+import threading
+
+from GazeboMaterial.GazeboMaterialLibrary import GazeboMaterialLibrary
+
+# Bump on any change of the file layout
+COLOR_DB_MAGIC = b'GZCOLORS'
+COLOR_DB_FORMAT = 2
+
+# magic, format, number of files, number of records
+_HEADER = struct.Struct('<8sIII')
+# size, mtime_ns, path offset, path length
+_FILE = struct.Struct('<QqII')
+# name offset, color offset, name length, color length, file index
+_RECORD = struct.Struct('<IIIII')
+
+
+def _ambient(block):
+	"""Arguments of the first ambient of a material, as getColor() finds it"""
+	items = [block]
+	for typeName in ('technique', 'pass', 'ambient'):
+		items = [child for item in items for child in item.findAll(typeName)]
+	return items[0].args if items else None
+
+def build_color_database(filename, resource_paths=None, cache=None, backend=None, jobs=None):
+	"""
+		Resolves the ambient color of every material of the scripts in
+		<resource path>/media/materials/scripts of resource_paths (None for
+		GAZEBO_RESOURCE_PATH) and writes them to filename for
+		GazeboColorDatabase. Returns the number of colors.
+	"""
+	if resource_paths is None:
+		resource_paths = [path for path in os.getenv('GAZEBO_RESOURCE_PATH', '').split(':') if path]
+	files, records = {}, {}
+	for resource_path in resource_paths:
+		directory = os.path.join(resource_path, 'media', 'materials', 'scripts')
+		if not os.path.isdir(directory):
+			continue
+		library = GazeboMaterialLibrary(directory, cache=cache, backend=backend, jobs=jobs)
+		library.refresh()
+		for path in library.getFiles():
+			path = os.path.realpath(path)
+			if path not in files:
+				st = os.stat(path)
+				files[path] = (len(files), st.st_size, st.st_mtime_ns)
+		for path, block in library.getBlocks():
+			path = os.path.realpath(path)
+			if block.type != 'material' or block.name is None:
+				continue
+			key = (block.name.encode("utf-8"), files[path][0])
+			if key in records:
+				continue # the first one declared is found
+			args = _ambient(block)
+			if args is not None:
+				records[key] = " ".join(args).encode("utf-8")
+
+	strings, offsets = bytearray(), {}
+	def string(data):
+		if data not in offsets:
+			offsets[data] = len(strings)
+			strings.extend(data)
+		return offsets[data]
+
+	paths = sorted(files, key=lambda path: files[path][0])
+	fileTable = [(files[path][1], files[path][2], string(path.encode("utf-8")), len(path.encode("utf-8"))) for path in paths]
+	# Sorted by name then file, looked up by binary search
+	recordTable = [(string(name), string(color), len(name), len(color), index) for (name, index), color in sorted(records.items())]
+	start = _HEADER.size + _FILE.size * len(paths) + _RECORD.size * len(records)
+	# Offsets and lengths are 32 bit
+	if start + len(strings) > 0xffffffff:
+		raise Exception(f"Too many materials for a color database: {len(records)} colors, {start + len(strings)} bytes")
+	table = [_HEADER.pack(COLOR_DB_MAGIC, COLOR_DB_FORMAT, len(paths), len(records))]
+	table += [_FILE.pack(size, mtime, start + offset, length) for size, mtime, offset, length in fileTable]
+	table += [_RECORD.pack(start + name, start + color, nameLength, colorLength, index) for name, color, nameLength, colorLength, index in recordTable]
+
+	tmpname = f"{filename}.{os.getpid()}.tmp"
+	with open(tmpname, "wb") as f:
+		f.write(b"".join(table))
+		f.write(strings)
+	os.replace(tmpname, filename)
+	return len(records)
+
+
+class GazeboColorDatabase:
+	"""
+		Material colors written by build_color_database(), looked up in the
+		memory mapped file without parsing any material script. Processes
+		mapping the same file share its pages.
+
+		lookup(name, filename) answers as GazeboMaterialFile(filename) and
+		its directory's GazeboMaterialLibrary would: the color of the
+		material in filename, or else in the first script of its directory
+		declaring it. None when unknown or when the script changed since
+		the database was built, the script should be parsed then.
+	"""
+	def __init__(self, filename):
+		self._filename = filename
+		with open(filename, "rb") as f:
+			# mmap() refuses an empty file
+			if os.fstat(f.fileno()).st_size < _HEADER.size:
+				raise Exception(f"Not a color database: {filename}")
+			self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, fmt, self._nfiles, self._count = _HEADER.unpack_from(self._mm, 0)
+		if magic != COLOR_DB_MAGIC or fmt != COLOR_DB_FORMAT:
+			raise Exception(f"Not a color database of format {COLOR_DB_FORMAT}: {filename}")
+		self._records = _HEADER.size + _FILE.size * self._nfiles
+		self._paths = None   # file index -> path, read on first use
+		self._indexes = {}   # script filename -> file index or None
+		self._unchanged = {} # file index -> whether the script is as when built
+		self._lock = threading.Lock()
+
+	def getFilename(self):
+		return self._filename
+
+	def __len__(self):
+		return self._count
+
+	def getFiles(self):
+		return self._filePaths()[:]
+
+	def _filePaths(self):
+		if self._paths is None:
+			paths = []
+			for i in range(self._nfiles):
+				size, mtime, offset, length = _FILE.unpack_from(self._mm, _HEADER.size + _FILE.size * i)
+				paths.append(self._mm[offset:offset+length].decode("utf-8"))
+			self._paths = paths
+		return self._paths
+
+	def _fileIndex(self, filename):
+		index = self._indexes.get(filename, False)
+		if index is False:
+			with self._lock:
+				path = os.path.realpath(filename)
+				paths = self._filePaths()
+				index = self._indexes[filename] = paths.index(path) if path in paths else None
+		return index
+
+	def _isUnchanged(self, index):
+		unchanged = self._unchanged.get(index)
+		if unchanged is None:
+			size, mtime, offset, length = _FILE.unpack_from(self._mm, _HEADER.size + _FILE.size * index)
+			try:
+				st = os.stat(self._filePaths()[index])
+				unchanged = (st.st_size, st.st_mtime_ns) == (size, mtime)
+			except OSError:
+				unchanged = False
+			if not unchanged:
+				sys.stderr.write(f"WARN: {self._filePaths()[index]} changed since {self._filename} was built\n")
+			self._unchanged[index] = unchanged
+		return unchanged
+
+	def covers(self, filename):
+		"""Whether the colors of script filename are in the database"""
+		index = self._fileIndex(filename)
+		return index is not None and self._isUnchanged(index)
+
+	def _record(self, i):
+		return _RECORD.unpack_from(self._mm, self._records + _RECORD.size * i)
+
+	def _find(self, name):
+		"""Records (color offset, color length, file index) of name"""
+		mm, lo, hi = self._mm, 0, self._count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			offset, _, length, _, _ = self._record(mid)
+			if mm[offset:offset+length] < name:
+				lo = mid + 1
+			else:
+				hi = mid
+		found = []
+		while lo < self._count:
+			offset, color, length, colorLength, index = self._record(lo)
+			if mm[offset:offset+length] != name:
+				break
+			found.append((color, colorLength, index))
+			lo += 1
+		return found
+
+	def lookup(self, name, filename):
+		"""Arguments of the ambient color of material name of script filename, or None"""
+		index = self._fileIndex(filename)
+		if index is None or not self._isUnchanged(index):
+			return None
+		found = self._find(name.encode("utf-8"))
+		paths = self._filePaths()
+		directory = os.path.dirname(paths[index])
+		candidates = [record for record in found if record[2] == index]
+		candidates += [record for record in found if record[2] != index and os.path.dirname(paths[record[2]]) == directory]
+		for color, length, i in candidates:
+			if self._isUnchanged(i):
+				return self._mm[color:color+length].decode("utf-8").split()
+		return None
+
+	def close(self):
+		self._mm.close()
+
+
+_databases = {} # real path -> ((size, mtime_ns), GazeboColorDatabase)
+_databases_lock = threading.Lock()
+def color_database(filename):
+	"""Database of filename shared by the sessions of this process, mapped again once rebuilt"""
+	path = os.path.realpath(filename)
+	st = os.stat(path)
+	with _databases_lock:
+		opened = _databases.get(path)
+		if opened is None or opened[0] != (st.st_size, st.st_mtime_ns):
+			opened = _databases[path] = ((st.st_size, st.st_mtime_ns), GazeboColorDatabase(filename))
+		return opened[1]
+
+# vim: ts=4 sw=4 noet
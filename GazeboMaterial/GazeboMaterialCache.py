@@ -0,0 +1,135 @@
+import os
+import sys
+import pickle
+import hashlib
+
+# Bump on any change of GazeboMaterialItem layout or of the resolved
+# inheritance, old entries become stale
+CACHE_FORMAT = 4
+
+def cache_disabled():
+	return os.getenv('SDF2URDF_NO_CACHE', '') not in ('', '0')
+
+def cache_directory():
+	path = os.getenv('SDF2URDF_CACHE_DIR')
+	if path:
+		return path
+	base = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'sdf2urdf')
+
+
+class GazeboMaterialCache:
+	"""
+		Parsed and inheritance-resolved material trees stored in the user cache
+		directory. An entry is keyed by the real path of the material file,
+		its size, mtime, sha256 of the content and the parser backend, so any
+		change of the file invalidates it. Variables of gazebo's setup.sh are
+		kept alongside, keyed by its size and mtime.
+
+		Entries are pickles and loading one may run code: only the user may
+		write them. Entries and a directory owned by someone else or
+		writable by group or others are not loaded, see _isTrusted().
+	"""
+	def __init__(self, directory=None):
+		self._directory = directory if directory is not None else cache_directory()
+		self._untrusted = set() # reported paths
+
+	def getDirectory(self):
+		return self._directory
+
+	def _entryPath(self, filename, inherit=True):
+		digest = hashlib.sha1(os.path.realpath(filename).encode("utf-8")).hexdigest()
+		# Trees without resolved inheritance of GazeboMaterialLibrary are kept aside
+		return os.path.join(self._directory, f"{digest}.material.pickle" if inherit else f"{digest}.raw.material.pickle")
+
+	def _setupPath(self, filename):
+		digest = hashlib.sha1(os.path.realpath(filename).encode("utf-8")).hexdigest()
+		return os.path.join(self._directory, f"{digest}.env.pickle")
+
+	@staticmethod
+	def makeKey(filename, content, backend, inherit=True):
+		st = os.stat(filename)
+		return (CACHE_FORMAT, os.path.realpath(filename), st.st_size, st.st_mtime_ns,
+				hashlib.sha256(content.encode("utf-8")).hexdigest(), backend, inherit)
+
+	@staticmethod
+	def makeSetupKey(filename):
+		st = os.stat(filename)
+		return (CACHE_FORMAT, os.path.realpath(filename), st.st_size, st.st_mtime_ns)
+
+	def _isTrusted(self, f, path):
+		"""Whether the entry open in f and its directory are the user's and writable by the user only"""
+		if not hasattr(os, 'getuid'):
+			return True
+		for st, name in ((os.stat(self._directory), self._directory), (os.fstat(f.fileno()), path)):
+			if st.st_uid != os.getuid() or st.st_mode & 0o022:
+				if name not in self._untrusted:
+					self._untrusted.add(name)
+					sys.stderr.write(f"WARN: not loading the material cache, {name} may be written by other users\n")
+				return False
+		return True
+
+	def _load(self, path, key, what):
+		try:
+			with open(path, "rb") as f:
+				if not self._isTrusted(f, path):
+					return None
+				entry = pickle.load(f)
+		except FileNotFoundError:
+			return None
+		except Exception as e:
+			sys.stderr.write(f"WARN: broken {what} cache entry for {key[1]}: {e}\n")
+			return None
+		if type(entry) != dict or entry.get('key') != key:
+			return None
+		return entry.get('root')
+
+	def _store(self, path, key, root, what):
+		try:
+			import tempfile
+			os.makedirs(self._directory, mode=0o700, exist_ok=True)
+			fd, tmpname = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+			try:
+				with os.fdopen(fd, "wb") as f:
+					pickle.dump({'key': key, 'root': root}, f, protocol=pickle.HIGHEST_PROTOCOL)
+				os.replace(tmpname, path)
+			except BaseException:
+				# Leave no partial entries behind
+				try:
+					os.unlink(tmpname)
+				except OSError:
+					pass
+				raise
+		except (OSError, pickle.PicklingError, RecursionError) as e:
+			sys.stderr.write(f"WARN: cannot store {what} cache entry for {key[1]}: {e}\n")
+
+	def load(self, key):
+		return self._load(self._entryPath(key[1], key[6]), key, "material")
+
+	def store(self, key, root):
+		self._store(self._entryPath(key[1], key[6]), key, root, "material")
+
+	def loadSetup(self, key):
+		"""Variables of a gazebo setup.sh as [(name, unexpanded value)]"""
+		return self._load(self._setupPath(key[1]), key, "setup")
+
+	def storeSetup(self, key, values):
+		self._store(self._setupPath(key[1]), key, values, "setup")
+
+	def clear(self):
+		removed = 0
+		if not os.path.isdir(self._directory):
+			return removed
+		for name in os.listdir(self._directory):
+			if name.endswith((".material.pickle", ".env.pickle", ".tmp")):
+				os.unlink(os.path.join(self._directory, name))
+				removed += 1
+		return removed
+
+
+def default_cache():
+	if cache_disabled():
+		return None
+	return GazeboMaterialCache()
+
+# vim: ts=4 sw=4 noet
@@ -1,11 +1,34 @@
 import os
+import re
 import sys
-# gazebo's material syntax parsing
-import pyparsing as gz
+import threading
 
 from GazeboMaterial.GazeboMaterialItem import *
+from GazeboMaterial.GazeboMaterialCache import GazeboMaterialCache, default_cache
+from GazeboMaterial.GazeboMaterialLexer import scan_material
+
+# pyparsing is the reference implementation
+BACKENDS = ('pyparsing', 'lexer')
+
+def default_backend():
+	backend = os.getenv('SDF2URDF_MATERIAL_BACKEND') or BACKENDS[0]
+	if backend not in BACKENDS:
+		raise Exception(f"Unknown material parser backend {backend}, expected one of {BACKENDS}")
+	return backend
+
+def _build_tokenizer(longest_match=False):
+	"""
+		Nested blocks are always longer than a one line option starting with
+		the same words, so the first match alternation gives the same tree as
+		the longest match (`^`) one without parsing every block twice.
+		`|` is not `^` in general: a block item is now the first of the
+		alternatives that matches, not the longest one.
+		longest_match=True builds the original grammar, kept as a reference
+		for benchmarks and tests/test_material_backends.py.
+	"""
+	# gazebo's material syntax parsing, imported only when a file is parsed
+	import pyparsing as gz
 
-def _build_tokenizer():
 	gz.ParserElement.setDefaultWhitespaceChars(' \t')
 	singleline_comment = "//" + gz.restOfLine
 	multiline_comment  = gz.cStyleComment
@@ -43,15 +66,20 @@ def _build_tokenizer():
 				gz.Group(gz.Optional(gz.OneOrMore(item_type))).setResultsName('arguments') + \
 				gz.Group(gz.Optional(blockinherit)).setResultsName('inheritance')
 
+	def blockitem(inner):
+		if longest_match:
+			return inner ^ gz.Group(blockoption)
+		return inner | gz.Group(blockoption)
+
 	blockinner = gz.Forward()
 	blockinner << gz.Group(item_type.setResultsName('itemtype') + gz.Optional(blockname).setResultsName('blockname') + gz.ZeroOrMore(blockname).setResultsName('arguments') + oplineend + \
 				blockstart + oplineend + \
-				gz.ZeroOrMore(blockinner ^ gz.Group(blockoption)).setResultsName('blockbody') + \
+				gz.ZeroOrMore(blockitem(blockinner)).setResultsName('blockbody') + \
 				oplineend + blockend) + oplineend
 
 	block = gz.Group(blockheader + oplineend + \
 				blockstart + oplineend + \
-				gz.ZeroOrMore(blockinner ^ gz.Group(blockoption)).setResultsName('blockbody') + \
+				gz.ZeroOrMore(blockitem(blockinner)).setResultsName('blockbody') + \
 				oplineend + blockend) + oplineend
 
 	allitems = gz.ZeroOrMore(gz.Group(importheader) + lineend) + gz.ZeroOrMore(block) + oplineend
@@ -59,6 +87,107 @@ def _build_tokenizer():
 
 	return allitems
 
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+def _get_tokenizer():
+	"""
+		The grammar is built once per process and shared by all material files,
+		this also changes pyparsing's default whitespaces only once.
+		SDF2URDF_PACKRAT=1 additionally enables pyparsing's packrat memoization,
+		it does not pay off for gazebo's materials with pyparsing 3.
+	"""
+	global _tokenizer
+	with _tokenizer_lock:
+		if _tokenizer is None:
+			if os.getenv('SDF2URDF_PACKRAT', '') not in ('', '0'):
+				import pyparsing
+				pyparsing.ParserElement.enablePackrat()
+			_tokenizer = _build_tokenizer()
+	return _tokenizer
+
+_scan_lock = threading.RLock()
+_MAX_QUERIES = 4096
+
+_PRESCAN  = re.compile(r'//[^\n]*|/\*(?:[^*]|\*(?!/))*\*/|[{}]')
+_COMMENTS = re.compile(r'//[^\n]*|/\*(?:[^*]|\*(?!/))*\*/')
+_IMPORT   = re.compile(r'^[ \t]*import[ \t]+(\*|[A-Za-z_]+(?:,[A-Za-z_]+)*)[ \t]+from[ \t]+("[^"\n]*"|[A-Za-z]+)', re.M)
+
+def _blockkeys(node):
+	"""
+		Children of node by (type, name, occurrence): like ogre, unnamed
+		blocks and options of a type are matched in their order.
+	"""
+	blocks, seen = {}, {}
+	for child in node._children:
+		key = (child._type, child._name)
+		n = seen[key] = seen.get(key, -1) + 1
+		blocks[key + (n,)] = child
+	return blocks
+
+def _own(node, index):
+	"""Child index of node, copied first when it is shared with the block it was inherited from"""
+	child = node._children[index]
+	if child._parent is not node:
+		child = node._children[index] = child._copy(node)
+	return child
+
+def _inherit(nodeto, nodefrom):
+	"""
+		Merges nodefrom into nodeto: its blocks and options that nodeto does
+		not override are shared, blocks of both are merged recursively.
+	"""
+	blocks = _blockkeys(nodeto)
+	positions = {id(child): i for i, child in enumerate(nodeto._children)}
+	for key, fchild in _blockkeys(nodefrom).items():
+		tchild = blocks.get(key)
+		if tchild is None:
+			nodeto._addChild(fchild)
+		elif fchild._children:
+			_inherit(_own(nodeto, positions[id(tchild)]), fchild)
+
+def _resolved(block):
+	return not block._inheritance or type(block._inheritance[0]) != str
+
+def _resolve_inheritance(blocks, lookup):
+	"""
+		Merges the parents of top level blocks into them in one pass, parents
+		first: the effective tree of a block is computed once and shared
+		copy on write by the blocks inheriting from it. lookup(block, name)
+		returns the block declared by the parent name of block, or None.
+	"""
+	def parents(block):
+		found = []
+		for name in block._inheritance:
+			parent = lookup(block, name)
+			if parent is None:
+				raise Exception(f"{block.name} type {block.type} inherits from undeclared {name}")
+			found.append(parent)
+		return found
+
+	for block in blocks:
+		if _resolved(block):
+			continue
+		# Depth first along the parents, without recursion for deep chains
+		stack, visiting = [(block, parents(block), 0)], {id(block)}
+		while stack:
+			child, inheritance, i = stack[-1]
+			if i < len(inheritance):
+				stack[-1] = (child, inheritance, i + 1)
+				parent = inheritance[i]
+				if id(parent) in visiting:
+					cycle = [item.name for item, _, _ in stack[[id(item) for item, _, _ in stack].index(id(parent)):]]
+					raise Exception(f"{child.type} inheritance cycle {' : '.join(cycle + [parent.name])}")
+				if not _resolved(parent):
+					visiting.add(id(parent))
+					stack.append((parent, parents(parent), 0))
+				continue
+			stack.pop()
+			visiting.discard(id(child))
+			child._inheritance = inheritance
+			for parent in inheritance:
+				parent._inherits_link[child] = None
+				_inherit(child, parent)
+
 def _parse_query(query):
 	# FIXME: parse query with pyparsing aka local `gz`
 	level = 0
@@ -83,24 +212,81 @@ def _parse_query(query):
 
 
 class GazeboMaterialFile:
-	def __init__(self, filename):
+	def __init__(self, filename, cache=None, backend=None, lazy=None, inherit=True):
+		"""
+			cache: GazeboMaterialCache instance, None for the default user cache
+			       (disabled by SDF2URDF_NO_CACHE=1), False to never use it.
+			backend: 'pyparsing' or 'lexer', None for SDF2URDF_MATERIAL_BACKEND
+			       or pyparsing.
+			lazy:  parse top level blocks (and their parents) only when they
+			       are looked up by name, None for SDF2URDF_LAZY_MATERIALS=1.
+			       Used only when the file is not in the cache.
+			inherit: resolve inheritance within the file once parsed, False
+			       keeps the parent names for GazeboMaterialLibrary which
+			       resolves them along the imported files.
+		"""
 		self._filename = filename
-		self._imports = [] # TODO
+		self._inherit = inherit
 		self._parsed = False
 		self._root = GazeboMaterialItem(None)
-		self._tokenizer = _build_tokenizer()
+		self._backend = backend or default_backend()
+		if self._backend not in BACKENDS:
+			raise Exception(f"Unknown material parser backend {self._backend}, expected one of {BACKENDS}")
+		self._tokenizer = None # pyparsing grammar, built on first scan
+		self._index = {}   # (type, name) -> [top level items]
+		self._queries = {} # query -> compiled path
+		self._results = {} # query -> found items
+		self._cache = default_cache() if cache is None else (cache or None)
+		self._lazy = inherit and (lazy if lazy is not None else os.getenv('SDF2URDF_LAZY_MATERIALS', '') not in ('', '0'))
+		self._content = None # lazy mode: not parsed content
+		self._blocks = {}    # lazy mode: (type, name) -> [(start, end)]
+		self._loaded = set()
+		self._fromCache = False
+		self._lock = threading.RLock()
 
 	def getFilename(self):
 		return self._filename
 
-	def _parse(self, content):
+	def getBackend(self):
+		return self._backend
+
+	def isFromCache(self):
+		"""Whether the parsed tree was loaded from the cache"""
+		return self._fromCache
+
+	def getImports(self):
+		"""(filename, [imported names or '*']) of the import headers"""
+		self.parse()
+		if self._content is not None:
+			return [(m.group(2).strip('"'), m.group(1).split(','))
+					for m in _IMPORT.finditer(_COMMENTS.sub('', self._content))]
+		return [(item.name, item.args) for item in self._root._children if item.type == 'import']
+
+	def getRoot(self):
+		self.parse()
+		return self._root
+
+	def _buildIndex(self):
+		self._index, self._results = {}, {}
+		for child in self._root._children:
+			self._index.setdefault((child.type, child.name), []).append(child)
+
+	def _scan(self, content):
+		if self._backend == 'lexer':
+			yield from scan_material(content)
+			return
+
 		def makeBlock(token, level=0):
 			tkeys = list(token.keys())
 			if 'itemtype' in tkeys:
 				item = GazeboMaterialItem(token['itemtype'])
 			else:
-				raise Exception(f"Cannot found itemtype in {oken}")
+				raise Exception(f"Cannot found itemtype in {token}")
 
+			if 'from' in tkeys: # import header
+				item._setName(token['from'].strip('"'))
+				for xarg in token['imports'].split(','):
+					item.addArgument(xarg)
 			if 'blockname' in tkeys:
 				item._setName(token['blockname'])
 				#item.addArgument(token['blockname'])
@@ -120,97 +306,165 @@ class GazeboMaterialFile:
 
 			return item
 
-		for tokens,start,end in self._tokenizer.scanString(content):
-			for t in tokens:
-				self._root.addChild(makeBlock(t))
+		if self._tokenizer is None:
+			self._tokenizer = _get_tokenizer()
+		# The grammar is shared by all files and threads
+		with _scan_lock:
+			for tokens,start,end in self._tokenizer.scanString(content):
+				for t in tokens:
+					yield makeBlock(t)
+
+	def _adopt(self, items):
+		"""Uses top level items parsed elsewhere (GazeboMaterialLibrary) as the parsed tree"""
+		self._root._children = list(items)
+		self._parsed = True
+		self._buildIndex()
+
+	def _parse(self, content):
+		for item in self._scan(content):
+			self._root.addChild(item)
 		self._parsed = True
+		self._buildIndex()
 
 	def _do_inherit(self):
 		if not self._parsed:
 			raise Exception("Inheritance processing should be run after parser complete")
+		self._results = {}
+		# Parents are the last top level block declared with their type and name
+		_resolve_inheritance(self._root._children, lambda block, name: self._index.get((block.type, name), [None])[-1])
 
-		def makechildmap(node):
-			childmap = {}
-			for child in node._children:
-				if child.name is None:
-					continue
-				if child.type not in childmap:
-					childmap[child.type] = {}
-				childmap[child.type][child.name] = child
-			return childmap
-		childmap = makechildmap(self._root)
-
-		def makeblocks(node):
-			blocks = {}
-			for child in node._children:
-				bid = child.type
-				if child.name is not None:
-					bid += ":"+child.name
-				if bid in blocks:
-					raise Exception(f"Item is exists {bid}")
-				blocks[bid] = child
-			return blocks
-
-		def inherit(nodeto, nodefrom, copy=False):
-			# TODO: make copy of inherited properties
-			bt, bf = makeblocks(nodeto), makeblocks(nodefrom)
-			for bid, fchild in bf.items():
-				if bid not in bt: # Item full inheritance
-					nodeto._addChild(fchild)
-				else: # Partial interitance
-					fchildren = nodefrom.findAll(f'{fchild.type}')
-					tchildren = nodeto.findAll(f'{fchild.type}')
-					tchk = {}
-					for tf in tchildren:
-						tchk[f"{tf.type}:{tf.name}"] = tf
-					for fc in fchildren:
-						uid = f"{fc.type}:{fc.name}"
-						if uid in tchk:
-							inherit(tchk[uid], fc)
-							continue
-						else:
-							nodeto._addChild(fchild)
-
-		for typeName, cm in childmap.items():
-			for name, child in cm.items():
-				inheritance = []
-				if not child._inheritance:
+	def _prescan(self, content):
+		"""
+			Offsets of top level blocks by (type, name) without parsing them.
+			The chunk of a block starts right after the previous top level
+			block, so its comments and import headers are parsed along.
+		"""
+		blocks, depth, start, header = {}, 0, 0, 0
+		for m in _PRESCAN.finditer(content):
+			token = m.group()
+			if token == '{':
+				if depth == 0:
+					header = m.start()
+				depth += 1
+			elif token == '}' and depth > 0:
+				depth -= 1
+				if depth == 0:
+					lines = [l for l in _COMMENTS.sub('', content[start:header]).split('\n') if l.strip()]
+					words = lines[-1].split(':', 1)[0].split() if lines else []
+					if words:
+						key = (words[0], words[1] if len(words) > 1 else None)
+						blocks.setdefault(key, []).append((start, m.end()))
+					start = m.end()
+		return blocks
+
+	def _loadItems(self, typeName, name):
+		"""Parses the top level blocks of type and name on the first use (lazy mode)"""
+		key = (typeName, name)
+		if key in self._loaded:
+			return self._index.get(key, [])
+		self._loaded.add(key)
+		for start, end in self._blocks.get(key, []):
+			for item in self._scan(self._content[start:end]):
+				if (item.type, item.name) != key:
 					continue
-				child._inheritance[:]
-				for inh in child._inheritance[:]:
-					if cm.get(inh) is not None:
-						childinh = cm.get(inh)
-						inheritance.append(cm.get(inh))
-					else:
-						raise Exception("{name} type {typeName} inherits from undeclared {inh}")
-				child._inheritance = inheritance
-				for inh in inheritance:
-					if child not in inh._inherits_link:
-						inh._inherits_link.append(child)
-					inherit(child, inh)
+				self._root.addChild(item)
+				self._index.setdefault(key, []).append(item)
+		return self._index.get(key, [])
+
+	def _loadBlock(self, typeName, name):
+		"""Parses the top level blocks and their parents on the first use (lazy mode)"""
+		def lookup(block, parent):
+			parents = self._loadItems(block.type, parent)
+			return parents[-1] if parents else None
+		items = self._loadItems(typeName, name)
+		_resolve_inheritance(items, lookup)
+		return items
 
 	def parse(self, filename=None):
 		if filename is None:
 			return self.parse(self._filename)
-		else:
-			if filename == self._filename and self._parsed:
-				return
+		with self._lock:
+			self._parseFile(filename)
+
+	def parseCached(self):
+		"""Loads the parsed tree from the cache only, returns whether it was there"""
+		with self._lock:
+			if not self._parsed and self._cache is not None:
+				with open(self._filename, "r") as f:
+					self._loadCached(self._filename, f.read())
+			return self._parsed
+
+	def _loadCached(self, filename, content):
+		key = GazeboMaterialCache.makeKey(filename, content, self._backend, self._inherit)
+		root = self._cache.load(key)
+		if root is not None:
+			self._root = root
+			self._parsed = self._fromCache = True
+			self._buildIndex()
+		return key
+
+	def _parseFile(self, filename):
+		if filename == self._filename and (self._parsed or self._content is not None):
+			return
 		self._filename = filename
 		with open(filename, "r") as f:
 			content = f.read()
+		if self._cache is not None:
+			key = self._loadCached(filename, content)
+			if self._parsed:
+				return
+		if self._lazy:
+			self._content, self._blocks, self._loaded = content, self._prescan(content), set()
+			return
+		self._parse(content)
+		if self._inherit:
+			self._do_inherit()
+		if self._cache is not None:
+			self._cache.store(key, self._root)
+
+	def _parseAll(self):
+		# Queries without a name need the whole file
+		content = self._content
+		self._content, self._blocks, self._loaded = None, {}, set()
+		self._root = GazeboMaterialItem(None)
 		self._parse(content)
 		self._do_inherit()
 
+	def _compileQuery(self, query):
+		path = self._queries.get(query)
+		if path is None:
+			path = self._queries[query] = [compile_filter(p) for p in _parse_query(query)]
+		return path
+
 	def find(self, query):
+		# Shared by the documents converted in several threads
+		with self._lock:
+			return self._find(query)
+
+	def _find(self, query):
 		self.parse()
-		path = _parse_query(query)
-		items = self._root.findAll(path.pop(0))
-		while len(path):
-			buf, p = [], path.pop(0)
+		items = self._results.get(query)
+		if items is not None:
+			return items[:]
+		if len(self._results) >= _MAX_QUERIES:
+			self._queries, self._results = {}, {}
+		path = self._compileQuery(query)
+		typeName, opts = path[0]
+		if len(opts) == 1 and opts[0][0] == 'name' and opts[0][1] is not True:
+			if self._content is not None:
+				self._loadBlock(typeName, opts[0][1])
+			items = self._index.get((typeName, opts[0][1]), [])
+		else:
+			if self._content is not None:
+				self._parseAll()
+			items = self._root.findAllCompiled(typeName, opts)
+		for typeName, opts in path[1:]:
+			buf = []
 			for it in items:
-				buf += it.findAll(p)
+				buf += it.findAllCompiled(typeName, opts)
 			items = buf
-		return items
+		self._results[query] = items
+		return items[:]
 
 	def getColor(self, name):
 		return self.find('material[name={0}].technique.pass.ambient'.format(name))
@@ -1,6 +1,34 @@
 import sys
 
+_compiled_filters = {}
+def compile_filter(typeName):
+	"""
+		'type[opt,key=value]' into ('type', (('opt', True), ('key', 'value'))),
+		compiled filters are memoized.
+	"""
+	compiled = _compiled_filters.get(typeName)
+	if compiled is not None:
+		return compiled
+	if len(_compiled_filters) >= 4096:
+		_compiled_filters.clear()
+	opts = {}
+	name = typeName
+	if '[' in typeName:
+		name, vargs = typeName[:typeName.index('[')], typeName[typeName.index('[')+1:typeName.rindex(']')]
+		for o in vargs.split(','): # multiple opts
+			varg = o.split('=',1)
+			if len(varg)==1:
+				opts[varg[0]] = True
+			elif len(varg)==2:
+				opts[varg[0]] = varg[1]
+	compiled = _compiled_filters[typeName] = (name, tuple(opts.items()))
+	return compiled
+
+
 class GazeboMaterialItem(object):
+	__slots__ = ('_type', '_name', '_level', '_parent', '_arguments', '_children',
+			'__has_inheritance', '_inherits_link', '_inheritance')
+
 	def __init__(self, typeName):
 		self._type = typeName
 		self._name = None
@@ -9,7 +37,7 @@ class GazeboMaterialItem(object):
 		self._arguments = []
 		self._children = []
 		self.__has_inheritance = False
-		self._inherits_link = []
+		self._inherits_link = {} # ordered set of inheriting blocks
 		self._inheritance = []
 
 	@property
@@ -56,6 +84,16 @@ class GazeboMaterialItem(object):
 		self._addChild(item)
 		return item
 
+	def _copy(self, parent):
+		"""Copy owned by parent, its children are still shared"""
+		item = GazeboMaterialItem(self._type)
+		item._name = self._name
+		item._level = self._level
+		item._parent = parent
+		item._arguments = self._arguments
+		item._children = self._children[:]
+		return item
+
 	def addArgument(self, arg):
 		self._arguments.append(arg)
 
@@ -64,18 +102,12 @@ class GazeboMaterialItem(object):
 		self._inheritance.append(classname)
 
 	def findAll(self, typeName):
-		opts = {}
-		if '[' in typeName:
-			typeName, vargs = typeName[:typeName.index('[')], typeName[typeName.index('[')+1:typeName.rindex(']')]
-			buf = {}
-			for o in vargs.split(','): # multiple opts
-				varg = o.split('=',1)
-				if len(varg)==1:
-					opts[varg[0]] = True
-				elif len(varg)==2:
-					opts[varg[0]] = varg[1]
+		typeName, opts = compile_filter(typeName)
+		return self.findAllCompiled(typeName, opts)
+
+	def findAllCompiled(self, typeName, opts):
 		def checkOpts(child):
-			for k, v in opts.items():
+			for k, v in opts:
 				if not hasattr(child, k):
 					return False
 				attr = getattr(child, k)
@@ -87,8 +119,8 @@ class GazeboMaterialItem(object):
 						return False
 			return True
 		out = []
-		for child in self._children[:]:
-			if child.type == typeName and checkOpts(child):
+		for child in self._children:
+			if child._type == typeName and (not opts or checkOpts(child)):
 				out.append(child)
 		return out
 
@@ -0,0 +1,291 @@
+"""
+	Hand written backend for gazebo's (OGRE) material scripts.
+
+	The lexer matches tokens on demand at the parser's position and the parser
+	follows brace depth by recursion, both reproduce the pyparsing grammar of
+	GazeboMaterialFile exactly: newlines are significant, spaces, tabs and
+	comments are skipped before every token, and a top level chunk that does
+	not parse is retried one character later (as pyparsing's scanString does),
+	so even malformed scripts produce the same tree as the reference backend.
+"""
+import re
+
+from GazeboMaterial.GazeboMaterialItem import GazeboMaterialItem
+
+
+_SKIP     = re.compile(r'(?:[ \t]+|//[^\n]*|/\*(?:[^*]|\*(?!/))*\*/)*')
+_ALPHA    = re.compile(r'[A-Za-z_]+')
+_ALNUM    = re.compile(r'[A-Za-z0-9_]+')
+_ALNUMDOT = re.compile(r'[A-Za-z0-9_.]+')
+_DIGITS   = re.compile(r'[0-9]+')
+_WORDS    = re.compile(r'[A-Za-z]+')
+_STRING   = re.compile(r'"(?:[^"\n\r\\]|""|\\(?:[^x]|x[0-9a-fA-F]+))*"')
+_EXTENSIONS = ("frag", "glsl", "jpeg", "jpg", "png", "vert")
+
+
+class _Lexer:
+	def __init__(self, content):
+		self.s = content
+		self.n = len(content)
+
+	def skip(self, p):
+		if p >= self.n:
+			return p
+		return _SKIP.match(self.s, p).end()
+
+	def literal(self, p, text):
+		p = self.skip(p)
+		if self.s.startswith(text, p):
+			return p + len(text)
+		return -1
+
+	def regex(self, p, regex):
+		# Returns (end, text) of the token after skipped spaces/comments
+		p = self.skip(p)
+		if p >= self.n:
+			return -1, None
+		m = regex.match(self.s, p)
+		if m is None:
+			return -1, None
+		return m.end(), m.group()
+
+	def itemtype(self, p):
+		return self.regex(p, _ALPHA)
+
+	def blockname(self, p):
+		# [alpha_/]alnum_, the namespace part is not backtracked
+		p = self.skip(p)
+		if p >= self.n:
+			return -1, None
+		s = self.s
+		m = _ALPHA.match(s, p)
+		if m is not None and s.startswith('/', m.end()):
+			m = _ALNUM.match(s, m.end()+1)
+		else:
+			m = _ALNUM.match(s, p)
+		if m is None:
+			return -1, None
+		return m.end(), s[p:m.end()]
+
+	def _fileany(self, p):
+		s = self.s
+		q = p+1 if s.startswith('/', p) else p
+		while True:
+			m = _ALNUMDOT.match(s, q)
+			if m is None or not s.startswith('/', m.end()):
+				break
+			q = m.end()+1
+		m = _ALNUM.match(s, q)
+		if m is None or not s.startswith('.', m.end()):
+			return -1
+		q = m.end()+1
+		for ext in _EXTENSIONS:
+			if s.startswith(ext, q):
+				return q+len(ext)
+		return -1
+
+	def _number(self, p):
+		s = self.s
+		q = p+1 if p < self.n and s[p] in '+-' else p
+		m = _DIGITS.match(s, q)
+		r = m.end() if m is not None else q
+		if s.startswith('.', r):
+			m = _DIGITS.match(s, r+1)
+			if m is not None:
+				return m.end() # real
+		m = _DIGITS.match(s, q)
+		return m.end() if m is not None else -1
+
+	def argument(self, p):
+		# fileany | nums | item_type
+		p = self.skip(p)
+		if p >= self.n:
+			return -1, None
+		for match in (self._fileany, self._number):
+			e = match(p)
+			if e >= 0:
+				return e, self.s[p:e]
+		m = _ALPHA.match(self.s, p)
+		if m is None:
+			return -1, None
+		return m.end(), m.group()
+
+	def lineend(self, p):
+		# OneOrMore(LineEnd()), end of content matches once
+		e = self._lineend(p)
+		if e < 0:
+			return -1
+		while True:
+			p, e = e, self._lineend(e)
+			if e < 0:
+				return p
+
+	def _lineend(self, p):
+		if p > self.n:
+			return -1
+		p = self.skip(p)
+		if p == self.n:
+			return p+1
+		return p+1 if self.s[p] == '\n' else -1
+
+	def oplineend(self, p):
+		e = self.lineend(p)
+		return p if e < 0 else e
+
+
+class _Parser:
+	def __init__(self, content):
+		self.lex = _Lexer(content)
+
+	def importheader(self, p):
+		lex = self.lex
+		p = lex.literal(p, "import")
+		if p < 0:
+			return -1, None
+		q = lex.literal(p, "*")
+		if q < 0:
+			q = lex.skip(p)
+			m = _ALPHA.match(lex.s, q) if q < lex.n else None
+			if m is None:
+				return -1, None
+			start, q = q, m.end()
+			while lex.s.startswith(',', q):
+				m = _ALPHA.match(lex.s, q+1)
+				if m is None:
+					break
+				q = m.end()
+			imports = lex.s[start:q].split(',')
+		else:
+			imports = ['*']
+		p = lex.literal(q, "from")
+		if p < 0:
+			return -1, None
+		e, source = lex.regex(p, _STRING)
+		if e < 0:
+			e, source = lex.regex(p, _WORDS)
+		if e < 0:
+			return -1, None
+		e = lex.lineend(e)
+		if e < 0:
+			return -1, None
+		# import <names> from <file>: named by the file, the names as arguments
+		item = GazeboMaterialItem('import')
+		item._setName(source.strip('"'))
+		for name in imports:
+			item.addArgument(name)
+		return e, item
+
+	def body(self, p, item):
+		# ZeroOrMore(blockinner | Group(blockoption))
+		while True:
+			e, child = self.innerblock(p)
+			if e < 0:
+				e, child = self.option(p)
+				if e < 0:
+					return p
+			item.addChild(child)
+			p = e
+
+	def _braces(self, p, item):
+		lex = self.lex
+		p = lex.literal(lex.oplineend(p), "{")
+		if p < 0:
+			return -1
+		p = self.body(lex.oplineend(p), item)
+		p = lex.literal(lex.oplineend(p), "}")
+		if p < 0:
+			return -1
+		return lex.oplineend(p)
+
+	def block(self, p):
+		lex = self.lex
+		p, itemtype = lex.itemtype(p)
+		if p < 0:
+			return -1, None
+		item = GazeboMaterialItem(itemtype)
+		e, name = lex.blockname(p)
+		if e >= 0:
+			item._setName(name)
+			p = e
+		while True:
+			e, arg = lex.itemtype(p)
+			if e < 0:
+				break
+			item.addArgument(arg)
+			p = e
+		e = lex.literal(p, ":")
+		if e >= 0:
+			e, parent = lex.blockname(e)
+			if e >= 0:
+				item.addInheritance(parent)
+				p = e
+		return self._braces(p, item), item
+
+	def innerblock(self, p):
+		lex = self.lex
+		p, itemtype = lex.itemtype(p)
+		if p < 0:
+			return -1, None
+		item = GazeboMaterialItem(itemtype)
+		e, name = lex.blockname(p)
+		if e >= 0:
+			item._setName(name)
+			p = e
+		while True:
+			e, arg = lex.blockname(p)
+			if e < 0:
+				break
+			item.addArgument(arg)
+			p = e
+		return self._braces(p, item), item
+
+	def option(self, p):
+		lex = self.lex
+		p, itemtype = lex.itemtype(p)
+		if p < 0:
+			return -1, None
+		item = GazeboMaterialItem(itemtype)
+		e, arg = lex.argument(p)
+		if e < 0:
+			return -1, None
+		while e >= 0:
+			item.addArgument(arg)
+			p = e
+			e, arg = lex.argument(p)
+		return lex.lineend(p), item
+
+	def allitems(self, p):
+		items = []
+		while True:
+			e, item = self.importheader(p)
+			if e < 0:
+				break
+			items.append(item)
+			p = e
+		while True:
+			e, item = self.block(p)
+			if e < 0:
+				break
+			items.append(item)
+			p = e
+		return self.lex.oplineend(p), items
+
+	def scan(self):
+		lex = self.lex
+		loc = 0
+		while loc <= lex.n:
+			preloc = lex.skip(loc)
+			e, items = self.allitems(preloc)
+			if e > loc:
+				for item in items:
+					yield item
+				loc = e
+			else:
+				loc = preloc+1
+
+
+def scan_material(content):
+	"""Yields top level GazeboMaterialItem blocks of the material script content"""
+	return _Parser(content).scan()
+
+# vim: ts=4 sw=4 noet
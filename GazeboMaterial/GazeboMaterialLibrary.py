@@ -0,0 +1,291 @@
+import os
+import sys
+import pickle
+import threading
+
+from GazeboMaterial.GazeboMaterialFile import GazeboMaterialFile, default_backend, _resolve_inheritance
+from GazeboMaterial.GazeboMaterialCache import default_cache
+
+EXTENSIONS = ('.material',)
+
+
+def _pickled(gzMaterial):
+	return pickle.dumps(gzMaterial.getRoot(), protocol=pickle.HIGHEST_PROTOCOL), gzMaterial.getImports()
+
+def _parse_raw(task):
+	"""Pool worker: pickled tree of a material file, its inheritance not resolved, and its imports"""
+	filename, backend, cache = task
+	try:
+		gzMaterial = GazeboMaterialFile(filename, cache=cache, backend=backend, inherit=False)
+		return (filename,) + _pickled(gzMaterial) + (None,)
+	except Exception as e:
+		return filename, None, [], f"{e.__class__.__name__}: {e}"
+
+
+class GazeboMaterialLibrary:
+	"""
+		The material scripts of directories (gazebo's media/materials/scripts)
+		and the scripts they import, merged into one index of top level
+		blocks: find() and getColor() as GazeboMaterialFile's.
+
+		Files are parsed by a pool of jobs processes (in this process when
+		it would fork with other threads running), each file's tree is
+		cached (in memory and in the GazeboMaterialCache) without resolved
+		inheritance. A parent is looked up in the file of the block, then
+		in the files it imports and at last in the whole library (the
+		first file declaring it). refresh() parses added and changed files
+		only and resolves the inheritance of them again, with the files
+		that import them, inherit from their blocks or look up names they
+		declare in the whole library.
+	"""
+	def __init__(self, directories, cache=None, backend=None, jobs=None, extensions=EXTENSIONS):
+		self._directories = [directories] if isinstance(directories, str) else list(directories)
+		self._cache = default_cache() if cache is None else (cache or None)
+		self._backend = backend or default_backend()
+		self._jobs = jobs or os.cpu_count() or 1
+		self._extensions = extensions
+		self._files = {}    # path -> ((size, mtime_ns), pickled tree or None if broken, imports)
+		self._merged = None # GazeboMaterialFile of the top level blocks of all files
+		self._blocks = []   # (path, top level block) of all files
+		self._roots = {}    # path -> root of the file, inheritance resolved
+		self._imported = {} # path -> [(path or None if missing, names)] imports
+		self._depends = {}  # path -> paths of the blocks its blocks inherit from
+		self._fallbacks = {} # path -> (type, name) its blocks looked up in the library
+		self._missing = set()
+		self._unpickled = {}
+		self._lock = threading.RLock()
+		self.parsed = 0
+		self.reused = 0
+		self.rebuilt = 0
+
+	def getDirectories(self):
+		return self._directories[:]
+
+	def getFilename(self):
+		return os.pathsep.join(self._directories)
+
+	def getFiles(self):
+		"""Paths of the loaded files, the imported ones outside of the directories last"""
+		with self._lock:
+			return list(self._files)
+
+	def _listing(self):
+		paths = []
+		for directory in self._directories:
+			try:
+				names = sorted(os.listdir(directory))
+			except OSError:
+				continue
+			paths += [os.path.abspath(os.path.join(directory, name)) for name in names if name.endswith(self._extensions)]
+		return paths
+
+	def _importPath(self, importer, filename):
+		for directory in [os.path.dirname(importer)] + self._directories:
+			path = os.path.abspath(os.path.join(directory, filename))
+			if os.path.isfile(path):
+				return path
+		if (importer, filename) not in self._missing:
+			self._missing.add((importer, filename))
+			sys.stderr.write(f"WARN: {importer} imports missing {filename}\n")
+		return None
+
+	def _parse(self, paths):
+		"""path -> (pickled tree or None if broken, imports) of paths, the not cached ones parsed by the pool"""
+		trees, tasks = {}, []
+		for path in paths:
+			gzMaterial = GazeboMaterialFile(path, cache=self._cache or False, backend=self._backend, inherit=False)
+			if self._cache is not None and gzMaterial.parseCached():
+				trees[path] = _pickled(gzMaterial)
+			else:
+				tasks.append((path, self._backend, self._cache or False))
+		import multiprocessing
+		# Workers of a pool (daemons) cannot start their own, a fork would
+		# copy the locks other threads (sessions, a server) may hold
+		forking = 'fork' in multiprocessing.get_all_start_methods()
+		if len(tasks) > 1 and self._jobs > 1 and not multiprocessing.current_process().daemon \
+				and (not forking or threading.active_count() == 1):
+			context = multiprocessing.get_context('fork' if forking else None)
+			with context.Pool(processes=min(self._jobs, len(tasks))) as pool:
+				results = list(pool.imap_unordered(_parse_raw, tasks))
+		else:
+			results = [_parse_raw(task) for task in tasks]
+		for path, tree, imports, error in results:
+			if error is not None:
+				sys.stderr.write(f"WARN: cannot parse material file {path}: {error}\n")
+			trees[path] = (tree, imports)
+		self.parsed += len(tasks)
+		return trees
+
+	def refresh(self):
+		"""Loads added and changed files and the files they import, returns whether anything changed"""
+		with self._lock:
+			return self._refresh()
+
+	def _refresh(self):
+		files, imported, pending = {}, {}, self._listing()
+		while pending:
+			pending = [path for path in dict.fromkeys(pending) if path not in files]
+			entries, stale = {}, {}
+			for path in pending:
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				stamp = (st.st_size, st.st_mtime_ns)
+				entry = self._files.get(path)
+				if entry is not None and entry[0] == stamp:
+					entries[path] = entry
+					self.reused += 1
+				else:
+					stale[path] = stamp
+			for path, (tree, imports) in self._parse(list(stale)).items():
+				entries[path] = (stale[path], tree, imports)
+			# In the order of the listing, the first file declaring a name wins
+			files.update((path, entries[path]) for path in pending if path in entries)
+			loaded, pending = [path for path in pending if path in files], []
+			for path in loaded:
+				imported[path] = [(self._importPath(path, filename), names) for filename, names in files[path][2]]
+				pending += [filename for filename, names in imported[path] if filename is not None]
+		changed = {path for path, entry in files.items() if self._files.get(path) is not entry}
+		changed.update(path for path in self._files if path not in files)
+		if self._merged is not None and not changed:
+			return False
+		self._files = files
+		self._merged = self._build(imported, changed)
+		return True
+
+	def _stale(self, imported, changed):
+		"""Paths of the files to resolve again when the changed paths were added, removed or changed"""
+		keys = set()
+		for path in changed:
+			for root in (self._roots.get(path), self._unpickled.get(path)):
+				if root is not None:
+					keys.update((block.type, block.name) for block in root._children)
+
+		def imports(path):
+			# Imports of the imported files are followed as well
+			queue, seen = list(imported[path]), {path}
+			while queue:
+				filename, names = queue.pop(0)
+				if filename is None or filename in seen:
+					continue
+				seen.add(filename)
+				yield filename
+				queue += imported.get(filename, [])
+
+		stale = {path for path in self._files if path in changed or imported[path] != self._imported.get(path)
+				or not self._fallbacks.get(path, set()).isdisjoint(keys)
+				or any(filename in changed for filename in imports(path))}
+		# Blocks inheriting from resolved again ones share their old trees
+		while True:
+			more = {path for path in self._files if path not in stale
+					and not self._depends.get(path, set()).isdisjoint(stale | changed)}
+			if not more:
+				return stale
+			stale |= more
+
+	def _build(self, imported, changed):
+		"""
+			Resolves the inheritance of the stale files (see _stale()),
+			imported is the [(path or None if missing, names)] imports of
+			all files. Returns their merged GazeboMaterialFile.
+		"""
+		self._unpickled = {path: pickle.loads(self._files[path][1]) for path in changed
+				if path in self._files and self._files[path][1] is not None}
+		stale = self._stale(imported, changed)
+		roots = {}
+		for path, (stamp, tree, imports) in self._files.items():
+			if tree is None:
+				continue
+			if path not in stale:
+				roots[path] = self._roots[path]
+				continue
+			old = self._roots.get(path)
+			if old is not None:
+				# The old blocks are dropped, their parents forget them
+				for block in old._children:
+					for parent in block._inheritance:
+						if type(parent) != str:
+							parent._inherits_link.pop(block, None)
+			roots[path] = self._unpickled[path] if path in self._unpickled else pickle.loads(tree)
+		self._unpickled = {}
+		indexes, owners, library = {}, {}, {}
+		for path, root in roots.items():
+			index = indexes[path] = {}
+			for block in root._children:
+				index[(block.type, block.name)] = block
+				library.setdefault((block.type, block.name), block)
+				owners[id(block)] = path
+		for path in stale:
+			self._depends[path], self._fallbacks[path] = set(), set()
+
+		def visible(path):
+			# Imports of the imported files are followed as well
+			queue, seen = list(imported[path]), {path}
+			while queue:
+				filename, names = queue.pop(0)
+				if filename is None or filename in seen or filename not in indexes:
+					continue
+				seen.add(filename)
+				yield filename, names
+				queue += imported[filename]
+
+		def lookup(block, name):
+			path = owners.get(id(block))
+			key = (block.type, name)
+			if path is not None:
+				if key in indexes[path]:
+					return indexes[path][key]
+				for filename, names in visible(path):
+					if key in indexes[filename] and ('*' in names or name in names):
+						self._depends[path].add(filename)
+						return indexes[filename][key]
+				self._fallbacks[path].add(key)
+			found = library.get(key)
+			if path is not None and found is not None:
+				self._depends[path].add(owners[id(found)])
+			return found
+
+		blocks = []
+		for path, root in roots.items():
+			if path in stale:
+				for block in root._children:
+					if block._inheritance and type(block._inheritance[0]) == str:
+						try:
+							_resolve_inheritance([block], lookup)
+						except Exception as e:
+							sys.stderr.write(f"WARN: {path}: {e}\n")
+			blocks += [(path, block) for block in root._children]
+		for path in list(self._depends):
+			if path not in roots:
+				self._depends.pop(path)
+				self._fallbacks.pop(path, None)
+		self.rebuilt += len([path for path in stale if path in roots])
+		self._roots, self._imported, self._blocks = roots, imported, blocks
+		merged = GazeboMaterialFile(self.getFilename(), cache=False, backend=self._backend)
+		merged._adopt([block for path, block in blocks])
+		return merged
+
+	def _library(self):
+		with self._lock:
+			if self._merged is None:
+				self.refresh()
+			return self._merged
+
+	def getBlocks(self):
+		"""(path, top level block) of the files, inheritance resolved"""
+		self._library()
+		with self._lock:
+			return self._blocks[:]
+
+	def find(self, query):
+		return self._library().find(query)
+
+	def getColor(self, name):
+		return self._library().getColor(name)
+
+	def getStats(self):
+		with self._lock:
+			return {'files': len(self._files), 'parsed': self.parsed, 'reused': self.reused, 'rebuilt': self.rebuilt}
+
+# vim: ts=4 sw=4 noet
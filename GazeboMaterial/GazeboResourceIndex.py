@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import threading
+
+# Bump on any change of the saved listings layout
+INDEX_FORMAT = 2
+
+class GazeboResourceIndex:
+	"""
+		Listings of the directories on the way to gazebo resources, each
+		directory is read once instead of a stat per uri and search path.
+		exists(root, parts) answers as os.path.exists(os.path.join(root, *parts)).
+
+		With a filename the listings are saved as json and reused by later
+		runs, a saved listing is valid while the directory mtime is unchanged.
+		A name missing from a listing makes the directory stat again, it
+		is read again once its mtime changed (files added since then).
+		Above maxDirectories listings the index starts over. Safe to use
+		from several threads.
+	"""
+	def __init__(self, filename=None, maxDirectories=100000):
+		self._filename = filename
+		self._maxDirectories = maxDirectories
+		self._listings = {} # directory -> {name: is_symlink} or None if not a directory
+		self._mtimes = {}
+		self._saved = {}
+		self._dirty = False
+		self._lock = threading.RLock()
+		self.scanned = 0
+		self.reused = 0
+		self.probes = 0 # stat and listing calls
+		if filename is not None:
+			self._load()
+
+	def getFilename(self):
+		return self._filename
+
+	def _load(self):
+		try:
+			self._saved = _read_listings(self._filename)
+		except FileNotFoundError:
+			return
+		except Exception as e:
+			sys.stderr.write(f"WARN: broken resource index {self._filename}: {e}\n")
+
+	def _mtime(self, directory):
+		self.probes += 1
+		try:
+			return os.stat(directory).st_mtime_ns
+		except OSError:
+			return None
+
+	def _scan(self, directory):
+		mtime = self._mtime(directory)
+		saved = self._saved.get(directory)
+		if saved is not None and saved[0] == mtime:
+			self.reused += 1
+			return mtime, saved[1]
+		listing = None
+		if mtime is not None:
+			self.probes += 1
+			try:
+				with os.scandir(directory) as entries:
+					listing = {entry.name: entry.is_symlink() for entry in entries}
+			except OSError:
+				listing = None
+		self.scanned += 1
+		self._dirty = True
+		return mtime, listing
+
+	def listing(self, directory):
+		with self._lock:
+			if directory not in self._listings:
+				if len(self._listings) >= self._maxDirectories:
+					self.clear()
+				self._mtimes[directory], self._listings[directory] = self._scan(directory)
+			return self._listings[directory]
+
+	def _rescan(self, directory):
+		"""Reads directory again when its mtime changed, returns whether it did"""
+		if self._mtime(directory) == self._mtimes.get(directory):
+			return False
+		self._saved.pop(directory, None)
+		self._mtimes[directory], self._listings[directory] = self._scan(directory)
+		return True
+
+	def exists(self, root, parts):
+		path = os.path.join(root, *parts)
+		# Relative roots and '.', '..', '' components are left to the filesystem
+		if not root or not parts or any(part in ('', '.', '..') for part in parts):
+			with self._lock:
+				self.probes += 1
+			return os.path.exists(path)
+		with self._lock:
+			directory = root
+			for part in parts:
+				listing = self.listing(directory)
+				if listing is None or part not in listing:
+					# Added since the directory was listed
+					if not self._rescan(directory):
+						return False
+					listing = self._listings[directory]
+					if listing is None or part not in listing:
+						return False
+				directory = os.path.join(directory, part)
+			# Only a symlink can be dangling
+			if not listing[parts[-1]]:
+				return True
+			self.probes += 1
+		return os.path.exists(path)
+
+	def clear(self):
+		with self._lock:
+			self._listings, self._mtimes = {}, {}
+
+	def save(self):
+		if self._filename is None or not self._dirty:
+			return
+		listings = {}
+		try: # merge with runs saved in between
+			listings.update(_read_listings(self._filename))
+		except Exception:
+			pass
+		with self._lock:
+			listings.update((d, (self._mtimes[d], listing)) for d, listing in self._listings.items())
+		try:
+			import tempfile
+			directory = os.path.dirname(os.path.abspath(self._filename))
+			os.makedirs(directory, exist_ok=True)
+			fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+			with os.fdopen(fd, "w") as f:
+				json.dump({'format': INDEX_FORMAT, 'listings': listings}, f, separators=(',', ':'))
+			os.replace(tmpname, self._filename)
+			with self._lock:
+				self._saved, self._dirty = listings, False
+		except OSError as e:
+			sys.stderr.write(f"WARN: cannot save resource index {self._filename}: {e}\n")
+
+
+def _read_listings(filename):
+	"""Saved listings of filename, {directory: (mtime, {name: is_symlink} or None)}"""
+	with open(filename, "r") as f:
+		entry = json.load(f)
+	if type(entry) != dict or entry.get('format') != INDEX_FORMAT:
+		return {}
+	listings = {}
+	for directory, (mtime, listing) in entry['listings'].items():
+		if not (mtime is None or type(mtime) == int) or not (listing is None or type(listing) == dict):
+			raise ValueError(f"unexpected listing of {directory}")
+		listings[directory] = (mtime, listing)
+	return listings
+
+_resource_index = None
+def resource_index(filename=None):
+	"""Index of this process, saved to filename when given"""
+	global _resource_index
+	if _resource_index is None or _resource_index.getFilename() != filename:
+		_resource_index = GazeboResourceIndex(filename)
+	return _resource_index
+
+# vim: ts=4 sw=4 noet
@@ -1,5 +1,13 @@
+import os
+import re
+import collections
+
 from GazeboMaterial.GazeboMaterialFile import *
+from GazeboMaterial.GazeboMaterialLibrary import *
+from GazeboMaterial.GazeboColorDatabase import *
 from GazeboMaterial.GazeboMaterialItem import *
+from GazeboMaterial.GazeboMaterialCache import *
+from GazeboMaterial.GazeboResourceIndex import *
 
 
 # Example content
@@ -88,13 +96,41 @@ material Gazebo/Gray : Gazebo/Grey
 """
 
 
-def load_gazebo_setup():
-	from dotenv import load_dotenv
-	from pathlib import Path
-	from os.path import join as joinp, dirname, abspath
-
-	dotenv_path = Path('/usr/share/gazebo/setup.sh')
-	load_dotenv(dotenv_path)
+GAZEBO_SETUP = '/usr/share/gazebo/setup.sh'
+
+# ${NAME} and ${NAME:-default} as expanded by python-dotenv
+_VARIABLE = re.compile(r'\$\{(?P<name>[^\}:]*)(?::-(?P<default>[^\}]*))?\}')
+
+def _setup_values(filename, cache):
+	"""Unexpanded variables of the setup file, cached until it changes"""
+	try:
+		key = GazeboMaterialCache.makeSetupKey(filename)
+	except OSError:
+		return []
+	cache = default_cache() if cache is None else (cache or None)
+	values = cache.loadSetup(key) if cache is not None else None
+	if values is None:
+		from dotenv import dotenv_values
+		values = list(dotenv_values(filename, interpolate=False).items())
+		if cache is not None:
+			cache.storeSetup(key, values)
+	return values
+
+def load_gazebo_setup(filename=GAZEBO_SETUP, cache=None):
+	"""
+		Same as python-dotenv's load_dotenv(filename): variables not set
+		yet are added to the environment, ${NAME} expanded from it. cache
+		as for GazeboMaterialFile.
+	"""
+	resolved = {}
+	environ = collections.ChainMap(os.environ, resolved)
+	for name, value in _setup_values(filename, cache):
+		if value is not None:
+			value = _VARIABLE.sub(lambda m: environ.get(m.group('name'), m.group('default') or '') or '', value)
+		resolved[name] = value
+	for name, value in resolved.items():
+		if name not in os.environ and value is not None:
+			os.environ[name] = value
 
 def gazebo_material_test():
 	gazebo_resource_path = os.getenv('GAZEBO_RESOURCE_PATH').split(':')
@@ -121,12 +157,79 @@ def gazebo_material_test():
 def gazebo_tree_test():
 	pass
 
+def _tree_signature(item):
+	inheritance = tuple(inh if type(inh) == str else (inh.type, inh.name) for inh in item._inheritance)
+	return (item.type, item.name, tuple(item.args), inheritance, item.level,
+			tuple(_tree_signature(c) for c in item._children))
+
+def _mutatedContent(content, count, seed=0):
+	# Broken scripts should be recovered the same way by every backend
+	import random
+	rnd = random.Random(seed)
+	alphabet = list(' \t\n{}:/.*"_,+-') + ['//', '/*', '*/', 'a', '1', 'glsl', '.png', 'import', 'from']
+	for idx in range(count):
+		chars = list(content)
+		for _ in range(rnd.randint(1, 6)):
+			op, pos = rnd.random(), rnd.randrange(len(chars))
+			if op < 0.4:
+				del chars[pos:pos+rnd.randint(1, 5)]
+			elif op < 0.8:
+				chars.insert(pos, rnd.choice(alphabet))
+			else:
+				chars[pos] = rnd.choice(alphabet)
+		yield f'<mutated test content #{idx}>', "".join(chars)
+
+def _backend_trees(filename, content):
+	"""Backend -> signatures of the tree parsed from content, before and after inheritance"""
+	from GazeboMaterial.GazeboMaterialFile import BACKENDS
+
+	trees = {}
+	for backend in BACKENDS:
+		gzMaterial = GazeboMaterialFile(filename, cache=False, backend=backend)
+		gzMaterial._parse(content)
+		parsed = _tree_signature(gzMaterial._root)
+		try:
+			gzMaterial._do_inherit()
+			inherited = _tree_signature(gzMaterial._root)
+		except Exception as e:
+			inherited = repr(e)
+		trees[backend] = (parsed, inherited)
+	return trees
+
+def gazebo_backends_test(filenames, mutations=50):
+	"""
+		Differential test: every parser backend should build the same tree as
+		the pyparsing reference, before and after inheritance processing.
+	"""
+	from GazeboMaterial.GazeboMaterialFile import BACKENDS
+
+	sources = [('<test content>', _getTestContent())]
+	sources += list(_mutatedContent(_getTestContent(), mutations))
+	for filename in filenames:
+		with open(filename, "r") as f:
+			sources.append((filename, f.read()))
+
+	failed = 0
+	for filename, content in sources:
+		trees = _backend_trees(filename, content)
+		reference = trees[BACKENDS[0]]
+		for backend, tree in trees.items():
+			if tree != reference:
+				failed += 1
+				print(f"FAIL: {filename}: {backend} tree differs from {BACKENDS[0]}")
+		if not filename.startswith('<mutated'):
+			print(f"{filename}: {len(reference[0][5])} blocks")
+	print(f"{len(sources)} sources compared")
+	assert not failed, f"{failed} backend trees differ"
+
 def parse_args():
 	import argparse
 
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--test-inheritance', action='store_true')
 	parser.add_argument('--test-dumptree', action='store_true')
+	parser.add_argument('--test-backends', nargs='*', metavar='FILE.material',
+			help="compare parser backends on the test content and given material files")
 	return parser.parse_args()
 
 if __name__ == "__main__":
@@ -135,7 +238,9 @@ if __name__ == "__main__":
 		gazebo_material_test()
 	elif args.test_dumptree:
 		pass
+	elif args.test_backends is not None:
+		gazebo_backends_test(args.test_backends)
 
-__all__ = ['GazeboMaterialItem', 'GazeboMaterialFile', 'load_gazebo_setup']
+__all__ = ['GazeboMaterialItem', 'GazeboMaterialFile', 'GazeboMaterialLibrary', 'GazeboColorDatabase', 'build_color_database', 'color_database', 'GazeboMaterialCache', 'GazeboResourceIndex', 'resource_index', 'load_gazebo_setup']
 
 # vim: ts=4 sw=4 noet
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+	Asset export benchmark: sdf2urdf_assets exporting generated meshes
+	(a collada file and its texture each, some of them duplicates) into an
+	empty directory, then again into the same directory where the hashes
+	and objects of the first export are reused, against copying every
+	mesh and texture one after the other.
+
+	python3 -m benchmarks.assets [--meshes 200] [--size 1024] [--duplicates 4] [--jobs N]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf_assets
+
+DAE = """<?xml version="1.0"?>
+<COLLADA xmlns="http://www.collada.org/2005/11/COLLADASchema" version="1.4.1">
+<library_images><image id="texture"><init_from>../textures/{name}.png</init_from></image></library_images>
+<!-- {padding} -->
+</COLLADA>
+"""
+
+def write_meshes(directory, count, size, duplicates):
+	"""count meshes of size KiB, every duplicates-th with the content of the previous one"""
+	os.makedirs(os.path.join(directory, 'meshes'))
+	os.makedirs(os.path.join(directory, 'textures'))
+	meshes = []
+	for m in range(count):
+		seed = m - 1 if duplicates and m % duplicates == duplicates - 1 else m
+		name = f"part{m}"
+		with open(os.path.join(directory, 'meshes', f"{name}.dae"), "w") as f:
+			f.write(DAE.format(name=name, padding=f"{seed:08d}" * (size * 128)))
+		with open(os.path.join(directory, 'textures', f"{name}.png"), "wb") as f:
+			f.write(seed.to_bytes(4, 'little') * (size * 256))
+		meshes.append(os.path.join(directory, 'meshes', f"{name}.dae"))
+	return meshes
+
+def export(meshes, directory, jobs):
+	exporter = sdf2urdf_assets.AssetExporter(directory, jobs=jobs)
+	exporter.prefetch(meshes)
+	for mesh in meshes:
+		exporter.add(mesh)
+	exporter.finish()
+	return exporter.getStats()
+
+def copy(meshes, directory):
+	for mesh in meshes:
+		for path in [mesh] + sdf2urdf_assets.mesh_references(mesh):
+			path = os.path.normpath(os.path.join(os.path.dirname(mesh), path))
+			destination = os.path.join(directory, os.path.relpath(path, os.path.dirname(os.path.dirname(mesh))))
+			os.makedirs(os.path.dirname(destination), exist_ok=True)
+			shutil.copyfile(path, destination)
+
+def timed(function, *args):
+	started = time.perf_counter()
+	result = function(*args)
+	return time.perf_counter() - started, result
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--meshes', type=int, default=200)
+	parser.add_argument('--size', type=int, default=1024, help="KiB of each mesh and texture")
+	parser.add_argument('--duplicates', type=int, default=4, help="every Nth mesh is a copy of the previous one")
+	parser.add_argument('--jobs', type=int, default=None, help="threads of the exporter")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		meshes = write_meshes(os.path.join(tmpdir, 'model'), args.meshes, args.size, args.duplicates)
+		total = 2 * args.meshes * args.size / 1024
+		seconds, _ = timed(copy, meshes, os.path.join(tmpdir, 'copy'))
+		print(f"{'serial copy':20s} {seconds*1000:10.1f} ms {total/seconds:8.0f} MiB/s")
+		package = os.path.join(tmpdir, 'package')
+		for name in ('export', 'export again'):
+			seconds, stats = timed(export, meshes, package, args.jobs)
+			print(f"{name:20s} {seconds*1000:10.1f} ms {total/seconds:8.0f} MiB/s"
+					f"  {stats['hashed']} hashed, {stats['copied']} copied, {stats['present']} present")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+	Color database benchmark: the ambient colors of materials of generated
+	scripts (a media/materials/scripts directory of several files) looked
+	up the way a fresh converter process does, by parsing the script of
+	each <uri> (without and with a warm GazeboMaterialCache) against
+	opening the database written by build_color_database() and looking
+	them up there. Every way should find the same colors.
+
+	python3 -m benchmarks.color_db [--files 8] [--blocks 500] [--depth 4] [--backend lexer]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from GazeboMaterial import GazeboMaterialFile, GazeboMaterialCache, GazeboColorDatabase, build_color_database
+from benchmarks import generators
+
+
+def write_scripts(directory, files, blocks, depth):
+	"""(script, material name) to look up in the written files"""
+	lookups = []
+	for f in range(files):
+		path = os.path.join(directory, f"file{f}.material")
+		with open(path, "w") as out:
+			out.write(generators.material_file(blocks, depth).replace("Gazebo/Bench", f"Gazebo/File{f}_"))
+		lookups += [(path, name.replace("Gazebo/Bench", f"Gazebo/File{f}_")) for name in generators.material_names(blocks, depth)[:10]]
+	return lookups
+
+def parsed_colors(lookups, cache, backend):
+	colors, files = [], {}
+	for path, name in lookups:
+		if path not in files:
+			files[path] = GazeboMaterialFile(path, cache=cache, backend=backend)
+		colors.append(files[path].getColor(name)[0].args)
+	return colors
+
+def database_colors(lookups, filename):
+	database = GazeboColorDatabase(filename)
+	colors = [database.lookup(name, path) for path, name in lookups]
+	database.close()
+	return colors
+
+def timed(function, *args):
+	started = time.perf_counter()
+	result = function(*args)
+	return time.perf_counter() - started, result
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--files', type=int, default=8)
+	parser.add_argument('--blocks', type=int, default=500, help="materials per file")
+	parser.add_argument('--depth', type=int, default=4, help="inheritance depth within a file")
+	parser.add_argument('--backend', default='lexer', choices=('pyparsing', 'lexer'))
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		scripts = os.path.join(tmpdir, 'resources', 'media', 'materials', 'scripts')
+		os.makedirs(scripts)
+		lookups = write_scripts(scripts, args.files, args.blocks, args.depth)
+		print(f"{args.files} files of {args.blocks} materials, {len(lookups)} lookups, {args.backend} backend")
+
+		parsed, reference = timed(parsed_colors, lookups, False, args.backend)
+		print(f"  parse:                {parsed*1000:10.1f} ms")
+		cache = GazeboMaterialCache(os.path.join(tmpdir, 'cache'))
+		parsed_colors(lookups, cache, args.backend)
+		seconds, colors = timed(parsed_colors, lookups, cache, args.backend)
+		if colors != reference:
+			raise Exception("The cached files have other colors")
+		print(f"  warm cache:           {seconds*1000:10.1f} ms  x{parsed/seconds:.1f}")
+
+		filename = os.path.join(tmpdir, 'colors.db')
+		seconds, count = timed(build_color_database, filename, [os.path.join(tmpdir, 'resources')], False, args.backend, None)
+		print(f"  build database:       {seconds*1000:10.1f} ms  {count} colors, {os.path.getsize(filename)} bytes")
+		seconds, colors = timed(database_colors, lookups, filename)
+		if colors != reference:
+			raise Exception("The database has other colors")
+		print(f"  database lookups:     {seconds*1000:10.1f} ms  x{parsed/seconds:.1f}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+	Conversion engine benchmark: nodes visited by the conversion (the
+	nodes_visited counter of a profiled session) against the size of the
+	tree, and the conversion time per link, on synthetic models of growing
+	link count with both tree backends. Visits per element stay flat when
+	every node is converted once.
+
+	python3 -m benchmarks.convert_engine [--sizes 250,1000,4000] [--repeat N] [model.sdf]
+"""
+import os
+import sys
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf
+from benchmarks.generators import EXAMPLE, synthetic_model
+
+
+def profiled(inputfile, tree_backend, repeat):
+	"""Best convert phase seconds, counters and output of repeat conversions"""
+	best, counters, output = None, None, None
+	for _ in range(repeat):
+		session = sdf2urdf.ConversionSession(tree_backend=tree_backend, profile=True)
+		output = session.convertFile(inputfile)
+		stats = session.getProfileStats()
+		seconds = stats['phases']['convert']['seconds']
+		best = seconds if best is None else min(best, seconds)
+		counters = stats['counters']
+	return best, counters, output
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--sizes', default='250,1000,4000', help="comma separated number of links")
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('template', nargs='?', default=EXAMPLE)
+	args = parser.parse_args()
+
+	sdf2urdf.load_gazebo_setup()
+	print(f"{'links':>8} {'backend':>8} {'elements':>9} {'visits':>8} {'visits/el':>10} {'convert ms':>11} {'us/link':>8}")
+	with tempfile.TemporaryDirectory() as tmpdir:
+		for links in [int(size) for size in args.sizes.split(',')]:
+			inputfile = os.path.join(tmpdir, f"model{links}.sdf")
+			with open(inputfile, "w") as f:
+				f.write(synthetic_model(args.template, links))
+			size = sum(1 for _ in ElementTree.parse(inputfile).getroot().iter())
+			outputs = []
+			for backend in ('minidom', 'etree'):
+				seconds, counters, output = profiled(inputfile, backend, args.repeat)
+				outputs.append(output)
+				visits = counters['nodes_visited']
+				print(f"{links:8d} {backend:>8} {size:9d} {visits:8d} {visits/size:10.3f} {seconds*1000:11.1f} {seconds*1e6/links:8.1f}")
+			if outputs[0] != outputs[1]:
+				raise Exception(f"Backends differ for {links} links")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
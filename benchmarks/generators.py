@@ -0,0 +1,200 @@
+"""
+	Synthetic inputs for the benchmarks: sdf models with N links, joints,
+	visuals, materials, nested inertias and meshes, and gazebo .material
+	files with M blocks in inheritance chains of a given depth (and width
+	of the blocks overridden along the chains).
+
+	Generated models reference the generated materials and meshes with
+	file:// and model:// uris, write_resources() lays them out in a
+	directory to add to GAZEBO_RESOURCE_PATH and GAZEBO_MODEL_PATH.
+"""
+import os
+import copy
+import xml.etree.ElementTree as ElementTree
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'examples', 'example001.sdf')
+MATERIAL_URI = 'file://media/materials/scripts/bench.material'
+MODEL_NAME = 'bench_model'
+
+
+def joint(name, parent, child):
+	elem = ElementTree.Element('joint', name=name, type='revolute')
+	ElementTree.SubElement(elem, 'pose').text = '0 0 0.1 0 0 0'
+	ElementTree.SubElement(elem, 'parent').text = parent
+	ElementTree.SubElement(elem, 'child').text = child
+	axis = ElementTree.SubElement(elem, 'axis')
+	ElementTree.SubElement(axis, 'xyz').text = '0 0 1'
+	limit = ElementTree.SubElement(axis, 'limit')
+	for tag, value in (('lower', '-1.57'), ('upper', '1.57'), ('effort', '10'), ('velocity', '1')):
+		ElementTree.SubElement(limit, tag).text = value
+	ElementTree.SubElement(ElementTree.SubElement(axis, 'dynamics'), 'damping').text = '0.1'
+	return elem
+
+def synthetic_model(template, links):
+	"""Model with children of template replicated up to the number of links"""
+	root = ElementTree.parse(template).getroot()
+	model = root.find('model')
+	children = list(model)
+	for ch in children:
+		model.remove(ch)
+	previous, count = None, 0
+	while count < links:
+		for ch in children:
+			ch = copy.deepcopy(ch)
+			if ch.tag == 'link':
+				if count == links:
+					continue
+				name = f"{ch.get('name')}_{count}"
+				ch.set('name', name)
+				count += 1
+				model.append(ch)
+				if previous is not None:
+					model.append(joint(f"joint_{count}", previous, name))
+				previous = name
+			elif ch.tag != 'joint':
+				model.append(ch)
+	ElementTree.indent(root)
+	return ElementTree.tostring(root, encoding="unicode")
+
+
+def material_name(chain, depth):
+	return f"Gazebo/Bench{chain}_{depth}"
+
+def material_names(blocks, depth):
+	"""Materials of material_file(blocks, depth), the most derived first"""
+	chains = (blocks + depth - 1) // depth
+	names = []
+	for d in range(depth-1, -1, -1):
+		names += [material_name(c, d) for c in range(chains) if c*depth + d < blocks]
+	return names
+
+def material_file(blocks, depth=1):
+	"""
+		Content of a .material file with blocks materials, chains of depth
+		materials each inherit the ambient color of the chain's first one.
+	"""
+	out = []
+	for i in range(blocks):
+		chain, d = divmod(i, depth)
+		c = (chain % 10) / 10.0
+		if d == 0:
+			out.append(f"material {material_name(chain, d)}\n")
+			color = f"ambient {c:.1f} 0.5 {1-c:.1f} 1.0\n      diffuse {c:.1f} 0.5 {1-c:.1f} 1.0\n"
+		else:
+			out.append(f"material {material_name(chain, d)} : {material_name(chain, d-1)}\n")
+			color = f"specular 0.{d % 10} 0.1 0.1 1.0 {d}\n"
+		out.append("{\n  technique\n  {\n    pass\n    {\n")
+		out.append(f"      {color}")
+		if d % 3 == 2:
+			out.append(f"\n      texture_unit\n      {{\n        texture bench{i}.png\n        filtering trilinear\n      }}\n")
+		out.append("    }\n  }\n}\n\n")
+	return "".join(out)
+
+def _option_name(i):
+	letters = ""
+	while True:
+		i, r = divmod(i, 26)
+		letters += chr(ord('a') + r)
+		if not i:
+			return f"option_{letters}"
+
+def inheritance_file(chains, depth, width, parents_last=False):
+	"""
+		Content of a .material file with chains of depth materials, each
+		inheriting from the previous one of its chain, with width options
+		in a pass and a texture unit: every level overrides every other
+		option and the texture. parents_last declares the most derived
+		materials first.
+	"""
+	blocks = []
+	for chain in range(chains):
+		for d in range(depth):
+			out = [f"material {material_name(chain, d)}"]
+			out.append(f" : {material_name(chain, d-1)}\n" if d else "\n")
+			out.append("{\n  technique\n  {\n    pass\n    {\n")
+			for option in range(d % 2, width, 2 if d else 1):
+				out.append(f"      {_option_name(option)} {chain} {d} {option}\n")
+			out.append(f"      texture_unit\n      {{\n        texture bench{chain}_{d}.png\n")
+			if not d:
+				out.append("        filtering trilinear\n        tex_address_mode clamp\n")
+			out.append("      }\n    }\n  }\n}\n\n")
+			blocks.append("".join(out))
+	if parents_last:
+		blocks.reverse()
+	return "".join(blocks)
+
+def _sub(parent, tag, text=None, **attrib):
+	elem = ElementTree.SubElement(parent, tag, attrib)
+	if text is not None:
+		elem.text = text
+	return elem
+
+def _inertial(link, i):
+	inertial = _sub(link, 'inertial')
+	_sub(inertial, 'mass', f"{1 + i % 7}.5")
+	inertia = _sub(inertial, 'inertia')
+	for tag, value in (('ixx', '0.1'), ('ixy', '0'), ('ixz', '0'), ('iyy', '0.1'), ('iyz', '0'), ('izz', '0.1')):
+		_sub(inertia, tag, value)
+	_sub(inertial, 'pose', '0 0 0.05 0 -0 0', frame='')
+
+def _geometry(parent, i, meshes):
+	geometry = _sub(parent, 'geometry')
+	if meshes and i % 2:
+		mesh = _sub(geometry, 'mesh')
+		_sub(mesh, 'uri', f"model://{MODEL_NAME}/meshes/part{i % meshes}.dae")
+		_sub(mesh, 'scale', '1 1 1')
+	else:
+		_sub(_sub(geometry, 'box'), 'size', '0.1 0.1 0.1')
+
+def sdf_model(links, visuals=1, materials=(), meshes=0):
+	"""
+		Sdf with links chained by revolute joints, each link with an
+		inertia, a collision and visuals using materials in turn, every
+		other geometry is one of meshes model:// meshes.
+	"""
+	root = ElementTree.Element('sdf', version='1.6')
+	model = _sub(root, 'model', name=MODEL_NAME)
+	count = 0
+	for i in range(links):
+		name = f"link_{i}"
+		link = _sub(model, 'link', name=name)
+		_sub(link, 'pose', f"{i * 0.1:.1f} 0 0 0 -0 0", frame='')
+		_inertial(link, i)
+		for v in range(visuals):
+			visual = _sub(link, 'visual', name=f"visual_{v}")
+			_sub(visual, 'pose', '0 0 0 0 -0 0', frame='')
+			_geometry(visual, i + v, meshes)
+			if materials:
+				material = _sub(visual, 'material')
+				script = _sub(material, 'script')
+				_sub(script, 'name', materials[count % len(materials)])
+				_sub(script, 'uri', MATERIAL_URI)
+				_sub(material, 'shader', type='pixel')
+				count += 1
+		collision = _sub(link, 'collision', name='collision')
+		_sub(collision, 'max_contacts', '10')
+		_geometry(collision, i, meshes)
+		if i:
+			model.append(joint(f"joint_{i}", f"link_{i-1}", name))
+	_sub(model, 'static', '0')
+	ElementTree.indent(root)
+	return ElementTree.tostring(root, encoding="unicode")
+
+
+def write_resources(directory, blocks, depth=1, meshes=0):
+	"""
+		Writes the generated material file and meshes under directory,
+		returns (resource path, model path) to search for them.
+	"""
+	resources = os.path.join(directory, 'resources')
+	scripts = os.path.join(resources, 'media', 'materials', 'scripts')
+	os.makedirs(scripts, exist_ok=True)
+	with open(os.path.join(scripts, os.path.basename(MATERIAL_URI)), "w") as f:
+		f.write(material_file(blocks, depth))
+	models = os.path.join(directory, 'models')
+	os.makedirs(os.path.join(models, MODEL_NAME, 'meshes'), exist_ok=True)
+	for m in range(meshes):
+		open(os.path.join(models, MODEL_NAME, 'meshes', f"part{m}.dae"), "w").close()
+	return resources, models
+
+# vim: ts=4 sw=4 noet
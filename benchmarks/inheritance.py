@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+	Material inheritance benchmark: the previous resolution (per type maps
+	in declaration order, recursive findAll merging of every parent/child
+	pair) against the topologically ordered copy on write one, on generated
+	material files with deep chains and wide overridden blocks. Both should
+	give the same trees when parents are declared first, the previous one
+	misses the grandparents of blocks declared before their parent.
+
+	python3 -m benchmarks.inheritance [--chains 20] [--depths 5,50,200] [--widths 2,16] [--repeat N]
+"""
+import os
+import sys
+import copy
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from GazeboMaterial import GazeboMaterialFile
+from GazeboMaterial.GazeboMaterialItem import GazeboMaterialItem
+from benchmarks import generators
+
+
+def _makeblocks(node):
+	blocks = {}
+	for child in node._children:
+		bid = child.type
+		if child.name is not None:
+			bid += ":"+child.name
+		if bid in blocks:
+			raise Exception(f"Item is exists {bid}")
+		blocks[bid] = child
+	return blocks
+
+def _legacy_inherit(nodeto, nodefrom):
+	bt, bf = _makeblocks(nodeto), _makeblocks(nodefrom)
+	for bid, fchild in bf.items():
+		if bid not in bt:
+			nodeto._addChild(fchild)
+		else:
+			fchildren = nodefrom.findAll(f'{fchild.type}')
+			tchildren = nodeto.findAll(f'{fchild.type}')
+			tchk = {}
+			for tf in tchildren:
+				tchk[f"{tf.type}:{tf.name}"] = tf
+			for fc in fchildren:
+				uid = f"{fc.type}:{fc.name}"
+				if uid in tchk:
+					_legacy_inherit(tchk[uid], fc)
+					continue
+				else:
+					nodeto._addChild(fchild)
+
+def legacy_inherit(root):
+	"""The resolution replaced by GazeboMaterialFile._do_inherit()"""
+	childmap = {}
+	for child in root._children:
+		if child.name is not None:
+			childmap.setdefault(child.type, {})[child.name] = child
+	for cm in childmap.values():
+		for child in cm.values():
+			inheritance = [cm[name] for name in child._inheritance]
+			child._inheritance = inheritance
+			for parent in inheritance:
+				parent._inherits_link[child] = None
+				_legacy_inherit(child, parent)
+
+def current_inherit(root):
+	gzMaterial = GazeboMaterialFile('<generated>', cache=False, backend='lexer')
+	gzMaterial._root = root
+	gzMaterial._parsed = True
+	gzMaterial._buildIndex()
+	gzMaterial._do_inherit()
+
+def tree_signature(item):
+	return (item.type, item.name, tuple(item.args), tuple(tree_signature(c) for c in item._children))
+
+def measure(resolve, parsed, repeat):
+	best, root = None, None
+	for _ in range(repeat):
+		root = copy.deepcopy(parsed)
+		started = time.perf_counter()
+		resolve(root)
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	return best, root
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--chains', type=int, default=20)
+	parser.add_argument('--depths', default='5,50,200', help="comma separated inheritance depths")
+	parser.add_argument('--widths', default='4,64', help="comma separated options per pass")
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000)) # deepcopy of deep trees
+	print(f"{'chains':>6} {'depth':>6} {'width':>6} {'before ms':>10} {'after ms':>10} {'parents last ms':>16}")
+	for depth in [int(d) for d in args.depths.split(',')]:
+		for width in [int(w) for w in args.widths.split(',')]:
+			gzMaterial = GazeboMaterialFile('<generated>', cache=False, backend='lexer')
+			gzMaterial._parse(generators.inheritance_file(args.chains, depth, width))
+			before, ref = measure(legacy_inherit, gzMaterial._root, args.repeat)
+			after, res = measure(current_inherit, gzMaterial._root, args.repeat)
+			if tree_signature(ref) != tree_signature(res):
+				raise Exception(f"Resolved trees differ for depth {depth} width {width}")
+			gzMaterial._root = GazeboMaterialItem(None)
+			gzMaterial._parse(generators.inheritance_file(args.chains, depth, width, parents_last=True))
+			reversed_, rev = measure(current_inherit, gzMaterial._root, args.repeat)
+			if sorted(map(tree_signature, rev._children)) != sorted(map(tree_signature, res._children)):
+				raise Exception(f"Resolved trees depend on the declaration order for depth {depth} width {width}")
+			print(f"{args.chains:6d} {depth:6d} {width:6d} {before*1000:10.1f} {after*1000:10.1f} {reversed_*1000:16.1f}  x{before/after:.1f}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+	Item tree scaling benchmark: time and memory of building the Item tree
+	and converting it for synthetic models of growing link count, per link
+	figures stay flat when child bookkeeping is linear. Times are measured
+	with the collector disabled: a generation 2 collection walks every
+	object of the process and its count grows with the tree, the time the
+	collector takes during an ordinary run is reported apart (gc ms). The
+	lazy tree is measured as well, with the number of Items wrapped by both.
+
+	python3 -m benchmarks.item_tree [--sizes 250,1000,4000] [--repeat N] [model.sdf]
+"""
+import gc
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from xml.dom import minidom
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf
+from benchmarks.generators import EXAMPLE, synthetic_model
+
+
+def build_and_convert(inputfile, lazy=False):
+	"""Build and convert seconds, Items wrapped"""
+	document = minidom.parse(inputfile)
+	session = sdf2urdf.ConversionSession(profile=True, lazyItems=lazy)
+	with session._document():
+		started = time.perf_counter()
+		doc = sdf2urdf.Item(document, lazy=lazy)
+		built = time.perf_counter()
+		doc.convert()
+	return built - started, time.perf_counter() - built, session.getProfileStats()['counters']['items_wrapped']
+
+def timed(function, collect, *args):
+	"""Result of function with the collector disabled, or enabled and the seconds it took"""
+	spent, started = [0.0], [None]
+	def callback(phase, info):
+		if phase == 'start':
+			started[0] = time.perf_counter()
+		else:
+			spent[0] += time.perf_counter() - started[0]
+	gc.collect()
+	if collect:
+		gc.callbacks.append(callback)
+	else:
+		gc.disable()
+	try:
+		result = function(*args)
+	finally:
+		if collect:
+			gc.callbacks.remove(callback)
+		else:
+			gc.enable()
+	return result, spent[0]
+
+def count_items(item):
+	return 1 + sum(count_items(c) for c in item._children)
+
+def tree_memory(inputfile):
+	"""Bytes allocated by the Item wrappers alone (the DOM is parsed before)"""
+	document = minidom.parse(inputfile)
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	doc = sdf2urdf.Item(document)
+	size = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	return size, count_items(doc)
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--sizes', default='250,1000,4000', help="comma separated number of links")
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('template', nargs='?', default=EXAMPLE)
+	args = parser.parse_args()
+
+	sdf2urdf.load_gazebo_setup()
+	print(f"{'links':>8} {'tree':>5} {'build ms':>10} {'convert ms':>11} {'us/link':>9} {'gc ms':>8} {'items':>8} {'B/item':>7} {'wrapped':>8}")
+	with tempfile.TemporaryDirectory() as tmpdir:
+		for links in [int(size) for size in args.sizes.split(',')]:
+			inputfile = os.path.join(tmpdir, f"model{links}.sdf")
+			with open(inputfile, "w") as f:
+				f.write(synthetic_model(args.template, links))
+			size, items = tree_memory(inputfile)
+			for lazy in (False, True):
+				build, convert = None, None
+				for _ in range(args.repeat):
+					(b, c, wrapped), _ = timed(build_and_convert, False, inputfile, lazy)
+					build = b if build is None else min(build, b)
+					convert = c if convert is None else min(convert, c)
+				_, collecting = timed(build_and_convert, True, inputfile, lazy)
+				print(f"{links:8d} {'lazy' if lazy else 'eager':>5} {build*1000:10.1f} {convert*1000:11.1f} {(build+convert)*1e6/links:9.1f} "
+						f"{collecting*1000:8.1f} {items:8d} {size/items:7.0f} {wrapped:8d}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
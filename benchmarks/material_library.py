@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+	Material library benchmark: GazeboMaterialLibrary loading a generated
+	scripts directory (files importing the previous one, with materials
+	inheriting across files) by one process and by a pool, refreshing it
+	after one file changed (resolving it and the files importing it
+	again), and loading it again from a warm cache. Every
+	load should find the same colors.
+
+	python3 -m benchmarks.material_library [--files 16] [--blocks 200] [--depth 4] [--jobs N] [--backend pyparsing]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from GazeboMaterial import GazeboMaterialLibrary, GazeboMaterialCache
+from benchmarks import generators
+
+
+def write_scripts(directory, files, blocks, depth):
+	"""Material names to look up in the written files"""
+	names = []
+	for f in range(files):
+		prefix = f"Gazebo/File{f}_"
+		content = generators.material_file(blocks, depth).replace("Gazebo/Bench", prefix)
+		if f:
+			# The first material of the previous file, through the import
+			content = f'import * from "file{f-1}.material"\n\n' + content + \
+					f"material {prefix}Cross : Gazebo/File{f-1}_0_0\n{{\n  technique\n  {{\n    pass\n    {{\n" \
+					f"      diffuse 0.5 0.5 0.5 1.0\n    }}\n  }}\n}}\n"
+			names.append(f"{prefix}Cross")
+		with open(os.path.join(directory, f"file{f}.material"), "w") as out:
+			out.write(content)
+		names += [name.replace("Gazebo/Bench", prefix) for name in generators.material_names(blocks, depth)[:10]]
+	return names
+
+def colors(library, names):
+	return [tuple(item.args for item in library.getColor(name)) for name in names]
+
+def timed(function):
+	started = time.perf_counter()
+	result = function()
+	return time.perf_counter() - started, result
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--files', type=int, default=16)
+	parser.add_argument('--blocks', type=int, default=200, help="materials per file")
+	parser.add_argument('--depth', type=int, default=4, help="inheritance depth within a file")
+	parser.add_argument('--jobs', type=int, default=None, help="processes of the pool")
+	parser.add_argument('--backend', default='pyparsing', choices=('pyparsing', 'lexer'))
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmpdir:
+		scripts = os.path.join(tmpdir, 'scripts')
+		os.makedirs(scripts)
+		names = write_scripts(scripts, args.files, args.blocks, args.depth)
+		print(f"{args.files} files of {args.blocks} materials, {args.backend} backend")
+
+		def load(jobs, cache=False):
+			library = GazeboMaterialLibrary(scripts, cache=cache, backend=args.backend, jobs=jobs)
+			library.refresh()
+			return library
+
+		serial, library = timed(lambda: load(1))
+		reference = colors(library, names)
+		if not all(reference):
+			raise Exception("Materials missing from the library")
+		print(f"  one process:            {serial*1000:10.1f} ms")
+		pooled, library = timed(lambda: load(args.jobs))
+		if colors(library, names) != reference:
+			raise Exception("The pool loaded other colors")
+		print(f"  pool:                   {pooled*1000:10.1f} ms  x{serial/pooled:.1f}")
+
+		changed = os.path.join(scripts, f"file{args.files // 2}.material")
+		with open(changed, "a") as out:
+			out.write("\n")
+		parsed, rebuilt = library.parsed, library.rebuilt
+		seconds, _ = timed(library.refresh)
+		if colors(library, names) != reference:
+			raise Exception("The refreshed library has other colors")
+		print(f"  refresh, 1 file changed:{seconds*1000:10.1f} ms  {library.parsed - parsed} parsed, {library.rebuilt - rebuilt} resolved again")
+
+		cache = GazeboMaterialCache(os.path.join(tmpdir, 'cache'))
+		load(args.jobs, cache)
+		seconds, library = timed(lambda: load(args.jobs, cache))
+		if colors(library, names) != reference or library.parsed:
+			raise Exception("The cached library differs")
+		print(f"  warm cache:             {seconds*1000:10.1f} ms  x{serial/seconds:.1f}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
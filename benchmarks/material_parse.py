@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+	Material parsing benchmark: the original per-file longest match grammar
+	against the shared first match grammar (optionally with packrat) and
+	the hand written lexer backend.
+
+	python3 -m benchmarks.material_parse [--repeat N] [--packrat] [file.material ...]
+
+	Without files the stock gazebo.material is used, bundled test content
+	replicated to a few hundred blocks otherwise.
+"""
+import os
+import sys
+import glob
+import time
+import warnings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import pyparsing as gz
+from GazeboMaterial import GazeboMaterialFile, _getTestContent
+from GazeboMaterial.GazeboMaterialFile import _build_tokenizer, _get_tokenizer
+
+
+def stock_materials():
+	return sorted(glob.glob('/usr/share/gazebo-*/media/materials/scripts/gazebo.material'))[-1:]
+
+def replicated_content(copies=50):
+	body = _getTestContent().split('\n', 2)[2] # without import header
+	return "\n".join(body.replace('Gazebo/', f'Gazebo/N{i}') for i in range(copies))
+
+def tree_signature(item):
+	return (item.type, item.name, tuple(item.args), tuple(tree_signature(c) for c in item._children))
+
+def parse_with(tokenizer, filename, content):
+	if tokenizer is None:
+		gzMaterial = GazeboMaterialFile(filename, cache=False, backend='lexer')
+	else:
+		gzMaterial = GazeboMaterialFile(filename, cache=False, backend='pyparsing')
+		gzMaterial._tokenizer = tokenizer() if callable(tokenizer) else tokenizer
+	gzMaterial._parse(content)
+	gzMaterial._do_inherit()
+	return gzMaterial
+
+def measure(tokenizer, filename, content, repeat):
+	best, gzMaterial = None, None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		gzMaterial = parse_with(tokenizer, filename, content)
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	return best, gzMaterial
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--packrat', action='store_true', help="also measure with packrat enabled")
+	parser.add_argument('files', nargs='*')
+	args = parser.parse_args()
+	warnings.simplefilter('ignore') # pyparsing 3 camelCase names
+
+	sources = [(fn, open(fn).read()) for fn in (args.files or stock_materials())]
+	if not sources:
+		sources = [('<replicated test content>', replicated_content())]
+
+	for filename, content in sources:
+		before, ref = measure(lambda: _build_tokenizer(longest_match=True), filename, content, args.repeat)
+		after, res = measure(_get_tokenizer(), filename, content, args.repeat)
+		if tree_signature(ref._root) != tree_signature(res._root):
+			raise Exception(f"Parsed trees differ for {filename}")
+		print(f"{filename}: {len(content)} bytes, {len(res._root._children)} blocks")
+		print(f"  before (grammar per file, longest match): {before*1000:10.1f} ms")
+		print(f"  after  (shared grammar, first match):     {after*1000:10.1f} ms  x{before/after:.1f}")
+		lexer, res = measure(None, filename, content, args.repeat)
+		if tree_signature(ref._root) != tree_signature(res._root):
+			raise Exception(f"Lexer backend tree differs for {filename}")
+		print(f"  lexer backend:                            {lexer*1000:10.1f} ms  x{before/lexer:.1f}")
+		if args.packrat:
+			gz.ParserElement.enablePackrat()
+			packrat, res = measure(_get_tokenizer(), filename, content, args.repeat)
+			print(f"  after + packrat:                          {packrat*1000:10.1f} ms  x{before/packrat:.1f}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+	Pose resolution benchmark: sdf2urdf_poses with the plain python and the
+	NumPy (when installed) transforms on generated models with thousands of
+	frames (links, joints, visuals, collisions and inertials), and the whole
+	conversion with and without --resolve-poses. Both transform backends
+	are checked to write the same poses.
+
+	python3 -m benchmarks.poses [--links 500,2000,8000] [--visuals 2] [--repeat N]
+"""
+import gc
+import os
+import sys
+import time
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf
+import sdf2urdf_poses
+from benchmarks import generators
+
+
+def backends():
+	yield sdf2urdf_poses.PythonMath()
+	if sdf2urdf_poses.numpy is not None:
+		yield sdf2urdf_poses.NumpyMath()
+
+def measure(prepare, run, repeat):
+	best, result = None, None
+	for _ in range(repeat):
+		arg = prepare()
+		gc.collect()
+		started = time.perf_counter()
+		run(arg)
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+		result = arg
+	return best, result
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--links', default='500,2000,8000', help="comma separated number of links")
+	parser.add_argument('--visuals', type=int, default=2, help="visuals per link")
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	sdf2urdf.load_gazebo_setup()
+	if sdf2urdf_poses.numpy is None:
+		print("NumPy is not installed, only the python transforms are measured")
+	with tempfile.TemporaryDirectory() as tmpdir:
+		for links in [int(size) for size in args.links.split(',')]:
+			inputfile = os.path.join(tmpdir, f"model{links}.sdf")
+			with open(inputfile, "w") as f:
+				f.write(generators.sdf_model(links, args.visuals))
+			frames = sum(1 for elem in ElementTree.parse(inputfile).iter() if elem.find('pose') is not None)
+			print(f"{links} links, {frames} posed frames:")
+			reference = None
+			for backend in backends():
+				seconds, root = measure(lambda: ElementTree.parse(inputfile).getroot(),
+						lambda root: sdf2urdf_poses.resolve_poses(root, backend), args.repeat)
+				poses = [elem.text for elem in root.iter('pose')]
+				if reference is not None and poses != reference:
+					raise Exception(f"{backend.name} poses differ from the python ones")
+				reference = poses
+				print(f"  resolve/{backend.name:8s} {seconds*1000:10.1f} ms {frames/seconds:12.0f} frames/s")
+			for resolve in (False, True):
+				session = sdf2urdf.ConversionSession(tree_backend='etree', resolvePoses=resolve)
+				seconds, _ = measure(lambda: inputfile, session.convertFile, args.repeat)
+				print(f"  convert{' --resolve-poses' if resolve else '':17s} {seconds*1000:10.1f} ms")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+	Benchmark runner: converts generated models of growing link count and
+	parses the generated material file, reports per phase the best wall
+	time, throughput in elements per second and peak traced memory.
+
+	python3 -m benchmarks.runner [--links 100,1000,5000] [--visuals 2] [--materials 200]
+		[--depth 4] [--meshes 8] [--repeat 3] [--phases sdf_parse,convert,...]
+		[--output results.json] [--compare baseline.json]
+
+	Phases:
+		material_parse/<backend>  GazeboMaterialFile.parse, elements are blocks
+		sdf_parse                 minidom parse of the sdf, elements are xml elements
+		item_build                Item tree of the parsed document
+		convert                   Item.convert of the built tree
+		serialize                 pretty printing of the converted document
+		convert_file/<backend>    whole conversion with a tree backend
+		stream/<backend>          stream conversion with a tree backend
+
+	--output writes the results with the commit they were measured at,
+	--compare prints time and memory ratios against such a file.
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import xml.etree.ElementTree as ElementTree
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf
+from GazeboMaterial import GazeboMaterialFile, BACKENDS as MATERIAL_BACKENDS
+from benchmarks import generators
+
+RESULTS_FORMAT = 1
+
+
+def _parsed(inputfile):
+	return lambda: sdf2urdf.parse(None, inputfile)
+
+def _built(inputfile):
+	def prepare():
+		return sdf2urdf.Item(sdf2urdf.parse(None, inputfile))
+	return prepare
+
+def _converted(session, inputfile):
+	def prepare():
+		doc = sdf2urdf.Item(sdf2urdf.parse(None, inputfile))
+		with session._document():
+			doc.convert()
+		return doc
+	return prepare
+
+def _converting(session):
+	def run(doc):
+		with session._document():
+			doc.convert()
+	return run
+
+def _streaming(session, backend):
+	def run(inputfile):
+		session.streamConvertFile(inputfile, io.StringIO(), backend)
+	return run
+
+def material_phases(materialfile, blocks):
+	"""(name, elements, prepare, run) of the material file phases"""
+	for backend in MATERIAL_BACKENDS:
+		yield (f"material_parse/{backend}", blocks, lambda: materialfile,
+				lambda fn, backend=backend: GazeboMaterialFile(fn, cache=False, backend=backend).parse())
+
+def model_phases(session, inputfile):
+	"""(name, elements, prepare, run) of the sdf model phases"""
+	elements = sum(1 for _ in ElementTree.parse(inputfile).iter())
+	# Material files are loaded once per session, material_parse measures that
+	session.convertFile(inputfile, 'etree')
+	yield "sdf_parse", elements, lambda: inputfile, lambda fn: sdf2urdf.parse(None, fn)
+	yield "item_build", elements, _parsed(inputfile), sdf2urdf.Item
+	yield "convert", elements, _built(inputfile), _converting(session)
+	yield "serialize", elements, _converted(session, inputfile), lambda doc: doc.toxml()
+	for backend in sdf2urdf.TREE_BACKENDS:
+		yield (f"convert_file/{backend}", elements, lambda: inputfile,
+				lambda fn, backend=backend: session.convertFile(fn, backend))
+	for backend in sdf2urdf.TREE_BACKENDS:
+		yield f"stream/{backend}", elements, lambda: inputfile, _streaming(session, backend)
+
+def measure(prepare, run, repeat):
+	"""Best wall time of repeat runs and peak memory traced during one more run"""
+	best = None
+	for _ in range(repeat):
+		arg = prepare()
+		started = time.perf_counter()
+		run(arg)
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	arg = prepare()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	run(arg)
+	peak = tracemalloc.get_traced_memory()[1] - before
+	tracemalloc.stop()
+	return best, peak
+
+def git_revision():
+	directory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+	try:
+		commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=directory,
+				capture_output=True, text=True, check=True).stdout.strip()
+		dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD'], cwd=directory).returncode != 0
+	except (OSError, subprocess.CalledProcessError):
+		return None, None
+	return commit, dirty
+
+def report(result, baseline=None):
+	line = (f"{result['phase']:24s} {result['size']:7d} {result['elements']:8d} "
+			f"{result['seconds']*1000:10.1f} {result['per_second']:12.0f} {result['peak_bytes']/1024:10.0f}")
+	if baseline is not None:
+		line += (f"  x{baseline['seconds']/result['seconds']:.2f}"
+				f" mem x{baseline['peak_bytes']/max(result['peak_bytes'], 1):.2f}")
+	print(line)
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Measures conversion phases on generated models.")
+	parser.add_argument('--links', default='100,1000,5000', help="comma separated number of links")
+	parser.add_argument('--visuals', type=int, default=2, help="visuals per link")
+	parser.add_argument('--materials', type=int, default=200, help="blocks of the material file")
+	parser.add_argument('--depth', type=int, default=4, help="inheritance chain length of materials")
+	parser.add_argument('--meshes', type=int, default=8, help="distinct meshes, 0 for boxes only")
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--phases', default=None, help="comma separated phase name prefixes")
+	parser.add_argument('--output', default=None, help="write results as JSON")
+	parser.add_argument('--compare', default=None, help="JSON results to compare with")
+	args = parser.parse_args()
+
+	selected = args.phases.split(',') if args.phases else None
+	baseline = {}
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = {(r['phase'], r['size']): r for r in json.load(f)['results']}
+	commit, dirty = git_revision()
+
+	# Results should not depend on the state of the material cache
+	os.environ['SDF2URDF_NO_CACHE'] = '1'
+	results = []
+	with tempfile.TemporaryDirectory() as tmpdir:
+		resources, models = generators.write_resources(tmpdir, args.materials, args.depth, args.meshes)
+		for envvar, path in (('GAZEBO_RESOURCE_PATH', resources), ('GAZEBO_MODEL_PATH', models)):
+			os.environ[envvar] = ':'.join(filter(None, (path, os.getenv(envvar))))
+		sdf2urdf.load_gazebo_setup()
+		materialfile = os.path.join(resources, generators.MATERIAL_URI[len('file://'):])
+		names = generators.material_names(args.materials, args.depth)
+
+		print(f"commit {commit or 'unknown'}{' (modified)' if dirty else ''}, python {platform.python_version()}, "
+				f"etree backend: {sdf2urdf.etree_module().__name__}")
+		print(f"{'phase':24s} {'size':>7s} {'elements':>8s} {'best ms':>10s} {'elements/s':>12s} {'peak KiB':>10s}")
+
+		def run(size, phases):
+			for name, elements, prepare, function in phases:
+				if selected and not any(name.startswith(s) for s in selected):
+					continue
+				seconds, peak = measure(prepare, function, args.repeat)
+				result = {'phase': name, 'size': size, 'elements': elements, 'seconds': seconds,
+						'per_second': elements / seconds if seconds else 0.0, 'peak_bytes': peak}
+				results.append(result)
+				report(result, baseline.get((name, size)))
+
+		run(args.materials, material_phases(materialfile, args.materials))
+		for links in [int(size) for size in args.links.split(',')]:
+			inputfile = os.path.join(tmpdir, f"model{links}.sdf")
+			with open(inputfile, "w") as f:
+				f.write(generators.sdf_model(links, args.visuals, names, args.meshes))
+			run(links, model_phases(sdf2urdf.ConversionSession(), inputfile))
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump({
+				'format': RESULTS_FORMAT,
+				'commit': commit,
+				'modified': dirty,
+				'python': platform.python_version(),
+				'etree': sdf2urdf.etree_module().__name__,
+				'parameters': {name: getattr(args, name) for name in ('links', 'visuals', 'materials', 'depth', 'meshes', 'repeat')},
+				'results': results,
+			}, f, indent=2)
+			f.write("\n")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
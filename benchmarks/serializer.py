@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+	Serializer benchmark: minidom's toprettyxml() (patched by xacro) and
+	writing its result against XmlWriter streaming the converted document
+	to the output file, on generated models of growing link count. Both
+	outputs are checked to be byte-identical.
+
+	python3 -m benchmarks.serializer [--links 1000,5000,20000] [--repeat N]
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf
+from benchmarks import generators
+
+
+def prettyxml(doc, outputfile):
+	with open(outputfile, "w") as f:
+		f.write(doc._node.toprettyxml(indent="  "))
+
+def xmlwriter(doc, outputfile):
+	with open(outputfile, "w") as f:
+		doc.writexml(f)
+
+def measure(serialize, doc, outputfile, repeat):
+	best = None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		serialize(doc, outputfile)
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	tracemalloc.start()
+	serialize(doc, outputfile)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	with open(outputfile) as f:
+		return best, peak, f.read()
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--links', default='1000,5000,20000', help="comma separated number of links")
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	print(f"{'links':>8} {'bytes':>10} {'toprettyxml ms':>15} {'peak KiB':>9} {'XmlWriter ms':>13} {'peak KiB':>9}")
+	with tempfile.TemporaryDirectory() as tmpdir:
+		outputfile = os.path.join(tmpdir, "model.urdf")
+		for links in [int(size) for size in args.links.split(',')]:
+			inputfile = os.path.join(tmpdir, f"model{links}.sdf")
+			with open(inputfile, "w") as f:
+				f.write(generators.sdf_model(links, visuals=2))
+			doc = sdf2urdf.Item(sdf2urdf.parse(None, inputfile))
+			with sdf2urdf.default_session()._document():
+				doc.convert()
+			before, beforePeak, ref = measure(prettyxml, doc, outputfile, args.repeat)
+			after, afterPeak, res = measure(xmlwriter, doc, outputfile, args.repeat)
+			if ref != res:
+				raise Exception(f"Serialized outputs differ for {links} links")
+			print(f"{links:8d} {len(res):10d} {before*1000:15.1f} {beforePeak/1024:9.0f} "
+					f"{after*1000:13.1f} {afterPeak/1024:9.0f}  x{before/after:.1f}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+	Startup benchmark: wall time of fresh interpreters importing sdf2urdf,
+	running `sdf2urdf.py --help` and converting a small model, and the
+	slowest imports of `import sdf2urdf` as reported by -X importtime.
+
+	python3 -m benchmarks.startup [--repeat N] [--top N] [model.sdf]
+"""
+import os
+import sys
+import time
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from benchmarks import generators
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SCRIPT = os.path.join(ROOT, 'sdf2urdf.py')
+# Loaded only by the phases needing them
+HEAVY_MODULES = ('xacro', 'pyparsing', 'dotenv', 'multiprocessing', 'lxml')
+
+
+def measure(command, repeat):
+	best = None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def loaded_modules():
+	code = f"import sys, sdf2urdf; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+	return subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout.split()
+
+def slowest_imports(top):
+	"""(cumulative us, module) of the top slowest imports"""
+	stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import sdf2urdf'],
+			cwd=ROOT, capture_output=True, text=True, check=True).stderr
+	imports = []
+	for line in stderr.splitlines():
+		fields = line.split('|')
+		if len(fields) == 3 and fields[1].strip().isdigit():
+			imports.append((int(fields[1]), fields[2].rstrip()))
+	return sorted(imports, reverse=True)[:top]
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--repeat', type=int, default=10)
+	parser.add_argument('--top', type=int, default=10, help="number of slowest imports to list")
+	parser.add_argument('input', nargs='?', default=generators.EXAMPLE)
+	args = parser.parse_args()
+
+	commands = (
+		("python -c pass", [sys.executable, '-c', 'pass']),
+		("import sdf2urdf", [sys.executable, '-c', 'import sdf2urdf']),
+		("sdf2urdf.py --help", [sys.executable, SCRIPT, '--help']),
+		(f"sdf2urdf.py {os.path.basename(args.input)}", [sys.executable, SCRIPT, args.input]),
+	)
+	for name, command in commands:
+		print(f"{name:32s} {measure(command, args.repeat)*1000:8.1f} ms")
+	print(f"loaded by import: {' '.join(loaded_modules()) or 'none of ' + ' '.join(HEAVY_MODULES)}")
+	print("slowest imports (cumulative):")
+	for us, module in slowest_imports(args.top):
+		print(f"  {us/1000:8.1f} ms {module}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
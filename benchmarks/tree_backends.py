@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+	Tree backend benchmark: minidom with Item wrappers against the etree
+	backend (lxml when installed) on synthetic models of growing size,
+	outputs of both backends are checked to be byte-identical.
+
+	python3 -m benchmarks.tree_backends [--sizes 100,1000,5000] [--repeat N] [--stream] [model.sdf]
+
+	Synthetic models replicate the children of model.sdf (the example by
+	default) with renamed links, chained by revolute joints.
+"""
+import os
+import io
+import sys
+import time
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf
+from benchmarks.generators import EXAMPLE, synthetic_model
+
+
+def measure(convert, inputfile, repeat):
+	best, result = None, None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		result = convert(inputfile)
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	return best, result
+
+def streamed(tree_backend):
+	def convert(inputfile):
+		output = io.StringIO()
+		sdf2urdf.stream_convert_file(inputfile, output, tree_backend=tree_backend)
+		return output.getvalue()
+	return convert
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--sizes', default='100,1000,5000', help="comma separated number of links")
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--stream', action='store_true', help="also measure stream conversion")
+	parser.add_argument('template', nargs='?', default=EXAMPLE)
+	args = parser.parse_args()
+
+	sdf2urdf.load_gazebo_setup()
+	etree = sdf2urdf.etree_module()
+	print(f"etree backend: {etree.__name__}")
+	with tempfile.TemporaryDirectory() as tmpdir:
+		for links in [int(size) for size in args.sizes.split(',')]:
+			inputfile = os.path.join(tmpdir, f"model{links}.sdf")
+			with open(inputfile, "w") as f:
+				f.write(synthetic_model(args.template, links))
+
+			before, ref = measure(lambda fn: sdf2urdf.convert_file(fn, tree_backend='minidom'), inputfile, args.repeat)
+			after, res = measure(lambda fn: sdf2urdf.convert_file(fn, tree_backend='etree'), inputfile, args.repeat)
+			if ref != res:
+				raise Exception(f"Outputs of tree backends differ for {links} links")
+			print(f"{links} links, {os.path.getsize(inputfile)} bytes")
+			print(f"  minidom + Item: {before*1000:10.1f} ms")
+			print(f"  etree:          {after*1000:10.1f} ms  x{before/after:.1f}")
+			if args.stream:
+				for backend in sdf2urdf.TREE_BACKENDS:
+					elapsed, res = measure(streamed(backend), inputfile, args.repeat)
+					if ref != res:
+						raise Exception(f"Stream output of {backend} backend differs for {links} links")
+					print(f"  stream {backend + ':':8s}{elapsed*1000:10.1f} ms  x{before/elapsed:.1f}")
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -1,57 +1,211 @@
 #!/usr/bin/env python3
 
+import gc
+import io
 import os
+import re
 import sys
+import glob
+import time
+import threading
+import contextlib
+import collections
+import xml.dom.minidom
 
 # GazeboMaterial
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from GazeboMaterial import *
 
-# xml operations
-from xacro import parse
-from xacro.xmlutils import *
-
 
 rospack = None
 
+def parse(inp, filename=None):
+	"""xacro's parse, xacro (which patches minidom's writexml) is imported on first use"""
+	from xacro import parse
+	return parse(inp, filename)
+
+class ItemChildren:
+	"""
+		Ordered children of Item as a doubly linked list, membership, append,
+		removal and replacement take constant time. Iteration is live: items
+		appended while iterating are visited, removed ones are skipped.
+		Indexing builds a list of the children once, until they change.
+	"""
+	__slots__ = ('_first', '_last', '_count', '_index')
+
+	def __init__(self, items=()):
+		self._first, self._last, self._count = None, None, 0
+		self._index = None
+		for item in items:
+			self.append(item)
+
+	def __len__(self):
+		return self._count
+
+	def __contains__(self, item):
+		return item._owner is self
+
+	def __iter__(self):
+		item = self._first
+		while item is not None:
+			if item._owner is self:
+				yield item
+			item = item._next
+
+	def __getitem__(self, index):
+		if index == 0 and self._first is not None:
+			return self._first
+		if index == -1 and self._last is not None:
+			return self._last
+		if self._index is None:
+			self._index = list(self)
+		return self._index[index]
+
+	def __repr__(self):
+		return repr(list(self))
+
+	def _link(self, item, prev, next):
+		self._index = None
+		item._owner, item._prev, item._next = self, prev, next
+		if prev is None:
+			self._first = item
+		else:
+			prev._next = item
+		if next is None:
+			self._last = item
+		else:
+			next._prev = item
+
+	def append(self, item):
+		# An item belongs to one list at most
+		if item._owner is not None:
+			item._owner.remove(item)
+		self._link(item, self._last, None)
+		self._count += 1
+
+	def remove(self, item):
+		if item._owner is not self:
+			raise ValueError(f"{item} is not a child")
+		self._index = None
+		prev, next = item._prev, item._next
+		if prev is None:
+			self._first = next
+		else:
+			prev._next = next
+		if next is None:
+			self._last = prev
+		else:
+			next._prev = prev
+		# _next is kept for live iterators standing on the removed item
+		item._owner, item._prev = None, None
+		self._count -= 1
+
+	def replace(self, which, replace):
+		if replace._owner is not None:
+			replace._owner.remove(replace)
+		self._link(replace, which._prev, which._next)
+		which._owner, which._prev = None, None
+
+
+def _remove_whitespace(node):
+	"""Removes the whitespace text children of node in one pass, minidom's removeChild scans the child list"""
+	children = node.childNodes
+	kept = [n for n in children if n.nodeName != '#text' or n.data.strip()]
+	if len(kept) == len(children):
+		return
+	# Leaves the nodes as removeChild() would: removed ones detached
+	# (no parentNode nor siblings), previousSibling / nextSibling of the
+	# kept ones chained in childNodes order
+	for n in children:
+		if n.nodeName == '#text' and not n.data.strip():
+			n.parentNode, n.previousSibling, n.nextSibling = None, None, None
+	prev = None
+	for n in kept:
+		n.previousSibling = prev
+		if prev is not None:
+			prev.nextSibling = n
+		prev = n
+	if prev is not None:
+		prev.nextSibling = None
+	children[:] = kept
+
+def _live_iter(children):
+	"""
+		Iterates the list children while the loop removes from it, as the
+		rules once iterated minidom's live childNodes: removing the visited
+		child or an earlier one shifts the list and the next child is
+		skipped. Both backends keep this quirk, the urdf depends on it.
+	"""
+	i = 0
+	while i < len(children):
+		yield children[i]
+		i += 1
+
+def _strip_whitespace(node, deep=True):
+	"""Removes the whitespace text between the elements under node, as wrapping them in Items does"""
+	children = node.childNodes
+	if len(children) == 1 and children[0].nodeName == '#text':
+		return
+	_remove_whitespace(node)
+	if deep:
+		for n in children:
+			_strip_whitespace(n)
+
 class Item:
 	"""
 ['ATTRIBUTE_NODE', 'CDATA_SECTION_NODE', 'COMMENT_NODE', 'DOCUMENT_FRAGMENT_NODE', 'DOCUMENT_NODE', 'DOCUMENT_TYPE_NODE', 'ELEMENT_NODE', 'ENTITY_NODE', 'ENTITY_REFERENCE_NODE', 'NOTATION_NODE', 'PROCESSING_INSTRUCTION_NODE', 'TEXT_NODE', '__doc__', '__init__', '__module__', '__nonzero__', '__repr__', '_attrs', '_attrsNS', '_call_user_data_handler', '_child_node_types', '_get_attributes', '_get_childNodes', '_get_firstChild', '_get_lastChild', '_get_localName', '_get_nodeName', '_magic_id_nodes', 'appendChild', 'attributes', 'childNodes', 'cloneNode', 'firstChild', 'getAttribute', 'getAttributeNS', 'getAttributeNode', 'getAttributeNodeNS', 'getElementsByTagName', 'getElementsByTagNameNS', 'getInterface', 'getUserData', 'hasAttribute', 'hasAttributeNS', 'hasAttributes', 'hasChildNodes', 'insertBefore', 'isSameNode', 'isSupported', 'lastChild', 'localName', 'namespaceURI', 'nextSibling', 'nodeName', 'nodeType', 'nodeValue', 'normalize', 'ownerDocument', 'parentNode', 'prefix', 'previousSibling', 'removeAttribute', 'removeAttributeNS', 'removeAttributeNode', 'removeAttributeNodeNS', 'removeChild', 'replaceChild', 'schemaType', 'setAttribute', 'setAttributeNS', 'setAttributeNode', 'setAttributeNodeNS', 'setIdAttribute', 'setIdAttributeNS', 'setIdAttributeNode', 'setUserData', 'nodeName', 'toprettyxml', 'toxml', 'unlink', 'writexml']
 	"""
-	def __init__(self, xmlnode, parent=None, document=None, level=0, root=None):
+	__slots__ = ('_document', '_root', '_node', '_parent', '_level', '_items', '_textvalue', '_lazy',
+			'_owner', '_prev', '_next')
+
+	def __init__(self, xmlnode, parent=None, document=None, level=0, root=None, lazy=False):
 		self._document = xmlnode if xmlnode.nodeName == '#document' else document
 		self._root = root if root is not None else self
 		self._node = xmlnode
 		self._parent = parent
 		self._level = level
-		self._children = []
+		self._items = None
 		self._textvalue = None
+		self._lazy = lazy
+		self._owner, self._prev, self._next = None, None, None
+		# A lazy item wraps its children once they are used
+		if not lazy:
+			self._wrap()
 
+	@property
+	def _children(self):
+		if self._items is None:
+			self._wrap()
+		return self._items
+
+	def _wrap(self):
+		self._items = ItemChildren()
 		if (len(self._node.childNodes) == 1) and (self._node.childNodes[0].nodeName == '#text'):
-			self._textvalue = Item(self._node.childNodes[0], document=self._document, parent=self, level=level+1, root=self.getRootNode())
+			self._textvalue = Item(self._node.childNodes[0], document=self._document, parent=self, level=self._level+1, root=self.getRootNode(), lazy=self._lazy)
 			return
+		# Skip pretty tabs
+		_remove_whitespace(self._node)
 		for n in self._node.childNodes[:]: 
-			if level == 0:
+			if self._level == 0:
 				self._root =  self
-			# Skip pretty tabs
-			if n.nodeName == '#text' and n.toxml().strip() == '':
-				self._node.removeChild(n)
-				continue
-			self.appendChild(Item(n, parent=self, document=self._document, level=level+1, root=self.getRootNode()))
+			self.appendChild(Item(n, parent=self, document=self._document, level=self._level+1, root=self.getRootNode(), lazy=self._lazy))
+		if _counting and self._items:
+			_count('items_wrapped', len(self._items))
 
 	def __repr__(self):
 		return f'Item<level={self._level},name={self.nodeName}>';
 
 	def appendChild(self, item):
 		if item.__class__.__name__ == 'Item':
+			children = self._children # wrapped before the node joins
 			if item._node.parentNode is not None and item._node.parentNode != self._node:
 				self._node.appendChild(item._node)
 			if item in item._parent._children:
-				del item._parent._children[item._parent._children.index(item)]
-			if item not in self._children:
-				self._children.append(item)
+				item._parent._children.remove(item)
+			if item not in children:
+				children.append(item)
 		else:
-			item = Item(item, parent=self, document=self._document, level=self._level+1, root=self.getRootNode())
+			item = Item(item, parent=self, document=self._document, level=self._level+1, root=self.getRootNode(), lazy=self._lazy)
 			self._children.append(item)
 
 	def setAttribute(self, name, value):
@@ -64,6 +218,9 @@ class Item:
 		self._node.removeAttribute(name)
 
 	def text(self):
+		if self._items is None:
+			# Whitespace before the first child goes once wrapped
+			self._wrap()
 		return self._node.childNodes[0].toxml()
 
 	@property
@@ -79,15 +236,17 @@ class Item:
 
 		#self._node.removeChild(item._node)
 		if item in self._children:
-			del self._children[self._children.index(item)]
+			self._children.remove(item)
+		if _counting:
+			_count('items_removed')
 
 	def replaceChild(self, replace, which):
 		if which in self._children:
-			self._children[self._children.index(which)] = replace
+			self._children.replace(which, replace)
 		self._node.replaceChild(replace._node, which._node)
 
 	def cloneNode(self):
-		return Item(self._node.cloneNode(True), parent=None, document=self._document, level=self._level, root=self.getRootNode())
+		return Item(self._node.cloneNode(True), parent=None, document=self._document, level=self._level, root=self.getRootNode(), lazy=self._lazy)
 
 	def createElement(self, *args, **kwargs):
 		try:
@@ -103,36 +262,11 @@ class Item:
 		return self.nodeName == 'sdf' and self._level == 1
 
 	def uriToPath(self, uri):
-		def try_encode(uri, wrap):
-			try:
-				return wrap(uri.encode("utf-8"))
-			except:
-				return wrap(uri)
-
-		parts = try_encode(uri, lambda x: x.split('/'))
-		uritype, _, parts = parts[0], None, parts[2:]
-
-		searchpath = []
-		typemap = {
-			"model:": ["GAZEBO_MODEL_PATH"],
-			"file:":  ["GAZEBO_RESOURCE_PATH"],
-		}.get(uritype)
-
-		if typemap is None:
-			return None
+		return uri_to_path(uri)
 
-		for envvar in typemap:
-			value = os.getenv(envvar)
-			if value is not None:
-				searchpath += try_encode(value, lambda x: x.strip(":").split(':'))
+	def meshFilename(self, uri):
+		return mesh_filename(uri)
 
-		for gmp in searchpath:
-			path = os.path.join(gmp, *parts)
-			if os.path.exists(path):
-				return path
-		return None
-
-	_gazeboMaterialFiles = {}
 	def _getGazeboMaterial(self, node):
 		name, gzMaterial = None, None
 
@@ -142,12 +276,7 @@ class Item:
 				if not name.startswith('Gazebo/'):
 					raise Exception("Unsupported color NS: {0}".format(name))
 			elif opt.nodeName == 'uri':
-				materialpath = self.uriToPath(opt.text())
-				if materialpath is None:
-					raise Exception(f"Cannot find material reference in GAZEBO_MODELS_PATH and GAZEBO_RESOURCE_PATH: {opt.text()}")
-				if self.__class__._gazeboMaterialFiles.get(materialpath) is None:
-					self.__class__._gazeboMaterialFiles[materialpath] = GazeboMaterialFile(materialpath)
-				gzMaterial = self.__class__._gazeboMaterialFiles[materialpath]
+				gzMaterial = gazebo_material_file(opt.text())
 			else:
 				raise Exception("Unknown material/script tag: {0}".format(opt.nodeName))
 		return name, gzMaterial
@@ -157,20 +286,20 @@ class Item:
 			return self
 		return self._root
 
-	_materialNodes = {}
 	def _getMaterialNode(self, name):
-		exists = name in self.__class__._materialNodes
+		materialNodes = _current_document().materialNodes
+		exists = name in materialNodes
 		if not exists:
 			root = self.getRootNode()
 			item = Item(self.createElement('material'), parent=root, document=self._document, level=root._level+1, root=self.getRootNode())
 			item.setAttribute('name', name)
 			root.appendChild( item )
-			self.__class__._materialNodes[name] = item
-		return self.__class__._materialNodes[name], exists
+			materialNodes[name] = item
+		return materialNodes[name], exists
 
 	def convert(self):
 		if self._level == 0:
-			for c in self._children[:]:
+			for c in self._children:
 				# Main node replacement
 				if c.isSDF():
 					"""
@@ -187,193 +316,212 @@ class Item:
 						</robot>
 					"""
 					node = Item(self.createElement('robot'), parent=self, document=self._document, level=self._level+1) # Root is None because it's a new root node
-					copy = c.cloneNode()
+					# Children of the model are moved, the sdf node is dropped
+					model = c._children[0]._node
+					if c._lazy:
+						_strip_whitespace(model, deep=False)
 					for ch in self._children:
 						self.removeChild(ch)
-					for ch in self._node.childNodes:
+					for ch in self._node.childNodes[:]:
 						self._node.removeChild(ch)
 
-					for name, attr in copy._node.childNodes[0].attributes.items():
+					for name, attr in model.attributes.items():
 						node._node.setAttribute(name, attr)
 
-					for ch in copy._node.childNodes[0].childNodes[:]:
+					for ch in model.childNodes[:]:
 						node._node.appendChild(ch)
-						item = Item(ch, parent=self, document=self._document, level=self._level+1, root=node.getRootNode())
+						item = Item(ch, parent=self, document=self._document, level=self._level+1, root=node.getRootNode(), lazy=self._lazy)
 						node.appendChild(item)
-					#self.replaceChild(node, copy)
 					self.appendChild(node)
 					break
 				else:
 					raise Exception("Unsupported file type: {0}".format(c.nodeName))
 
-		_properties = {}
-		for c in self._children[:]:
-			if c.nodeName not in _properties:
-				_properties[c.nodeName] = c
-			elif type(_properties[c.nodeName]) == list:
-				_properties[c.nodeName].append(c)
-			else:
-				_properties[c.nodeName] = [_properties[c.nodeName], c]
+		if _counting:
+			_count('nodes_visited')
+		# One pass: the rule registered for the tag of each child, then the
+		# child's conversion. Nodes appended meanwhile (moved or generated)
+		# follow the others, they are attached and converted without a rule.
+		converters, originals = self._converters, len(self._children)
+		for c in self._children:
+			if originals:
+				originals -= 1
+				converter = converters.get(c.nodeName)
+				if converter is not None:
+					item = converter(self, c)
+					if item is None:
+						if c._items is None and c in self._children:
+							# Kept as it is, without whitespace as if wrapped
+							_strip_whitespace(c._node)
+						continue
+					c = item
+			# Fix broken tree
+			if c._node.parentNode != self._node:
+				self._node.appendChild(c._node)
+				c._parent = self
+			c.convert()
 
-		for c in self._children[:]:
+	# Rules of Item._converters: converter(parent, child) converts child,
+	# returns the item to convert the children of, None when none are left
 
-			# Unused elements
-			if c.nodeName in ['plugin', 'physics', 'gravity', 'velocity_decay', 'self_collide', 'surface', 'static', 'dissipation', 'stiffness', 'sensor', '#comment']:
-				self.removeChild(c)
+	def _convertUnused(self, c):
+		self.removeChild(c)
 
-			# Inner tags into attributes, nothing else
-			elif c.nodeName in ['inertia', 'cylinder', 'sphere', 'box', 'limit', 'dynamics'] :
-				if c.nodeName == 'limit':
-					c.convert()
-				for mc in c._children[:]:
-					c.setAttribute(mc.nodeName, mc.text().strip())
-					c.removeChild(mc)
+	def _convertAttributes(self, c):
+		"""Inner tags into attributes, nothing else"""
+		if c.nodeName == 'limit':
+			c.convert()
+		for mc in c._children:
+			c.setAttribute(mc.nodeName, mc.text().strip())
+			c.removeChild(mc)
 
-			elif c.nodeName in ['visual', 'collision']:
-				if c.nodeName == 'collision' and c.nodeName in _properties:
-					self.removeChild(c)
-				else:
-					for name,attr in c._node.attributes.items():
-						c.removeAttribute(name)
-
-			elif c.nodeName == 'material':
-				"""
-					<material>
-					  <script>
-						<name>Gazebo/DarkGrey</name>
-						<uri>file://media/materials/scripts/gazebo.material</uri>
-					  </script>
-					</material>
-				---
-					<material name="DarkGrey">
-					  <color rgba="0.3 0.3 0.3 1.0"/>
-					</material>	
-				"""
-				unsupported = []
-				for child in c._children:
-					if child.nodeName == 'script' and c._level>1: 
-						name, gzMaterial = self._getGazeboMaterial(child)
-						c.removeChild(c._children[0])
-						if name:
-							c.setAttribute("name", name)
-
-						materials = gzMaterial.getColor(name)
-						material, exists = self._getMaterialNode(name)
-						if materials:
-							if not exists:
-								color = Item(self.createElement('color'), parent=c, document=self._document, level=c._level+1, root=self.getRootNode())
-								rgba = materials[0].args + ['1.0', '1.0', '1.0', '1.0']
-								color.setAttribute("rgba", " ".join(rgba[:4])) # rgba should contains 4 element, some of gazebo's material could contains 3 elements
-								material.appendChild(color)
-						else:
-							query, fn = f'material[name={name}].technique.pass.ambient', gzMaterial.getFilename()
-							raise Exception(f"Material not found ({query}) at {fn}")
-					else:
-						unsupported.append(child)
-
-				if not c._children:
-					sys.stderr.write(f"WARN: empty material: {c}\n")
-				if unsupported:
-					sys.stderr.write(f"WARN: Unsupported one of material subtag: {unsupported}\n")
-					#raise Exception()
-			elif c.nodeName == 'pose':
-				"""
-					<pose frame=''>0 0 0 0 0 -1.0471975512</pose>
-				---
-					<origin rpy="0 0 -1.0471975512" xyz="0 0 0"/>
-				"""
-				if self.nodeName == 'robot':
-					self.removeChild(c)
-				else:
-					# Pose replaced with Origin
-					origin = Item(self.createElement("origin"), parent=self, document=self._document, level=self._level+1, root=self.getRootNode())
-					text = c.text().strip().split(' ')
-					origin.setAttribute("xyz", " ".join(text[:3]))
-					origin.setAttribute("rpy", " ".join(text[3:]))
-					self.replaceChild(origin, c)
-
-			elif c.nodeName in ['parent', 'child', 'mass']:
-				"""
-					<nodeName>@text</nodeName>
-				---
-					<nodeName attr="@text"/>
-				"""
-				attr = dict(zip(
-					('parent', 'child', 'mass'),
-					('link',   'link',  'value'))).get(c.nodeName)
-				if len(c._node.childNodes):
-					c.setAttribute(attr, c.text().strip())
-					cnodes = c._node.childNodes[:]
-					for mc in cnodes:
-						c._node.removeChild(mc)
-				for mc in c._children:
-					c.removeChild(mc)
+	def _convertVisual(self, c):
+		for name,attr in c._node.attributes.items():
+			c.removeAttribute(name)
+		return c
 
-			elif c.nodeName == 'mesh':
-				mesh = c._node
-				for mc in c._children[:]:
-					if mc.nodeName == "scale":
-						mesh.setAttribute("scale", mc.text())
-					elif mc.nodeName == "uri":
-						model = mc.text().strip()
-						mesh.setAttribute("filename", "file://"+self.uriToPath(model))
-					else:
-						sys.stderr.write("Ignored tagname {0} at level {1}: {2}".format(c.nodeName, self._level, mc.nodeName))
-					c.removeChild(mc)
+	def _convertMaterial(self, c):
+		"""
+			<material>
+			  <script>
+				<name>Gazebo/DarkGrey</name>
+				<uri>file://media/materials/scripts/gazebo.material</uri>
+			  </script>
+			</material>
+		---
+			<material name="DarkGrey">
+			  <color rgba="0.3 0.3 0.3 1.0"/>
+			</material>	
+		"""
+		unsupported = []
+		children = list(c._children)
+		# The first child is removed while iterating
+		for child in _live_iter(children):
+			if child.nodeName == 'script' and c._level>1: 
+				name, gzMaterial = self._getGazeboMaterial(child)
+				c.removeChild(children.pop(0))
+				if name:
+					c.setAttribute("name", name)
 
-			elif c.nodeName == 'axis':
-				"""
-					<axis>
-					  <xyz>0 -1 0</xyz>
-					  <limit>
-						<lower>0</lower>
-						<upper>0</upper>
-						<effort>100</effort>
-						<velocity>-1</velocity>
-					  </limit>
-					  <dynamics>
-						<damping>0.1</damping>
-					  </dynamics>
-					  <use_parent_model_frame>1</use_parent_model_frame>
-					</axis>
-				---
-					<axis xyz="0 -1 0"/>
-					<limit lower="0" upper="0" effort="100" velocity="-1"/>
-				"""
-				c.convert()
-				for mc in c._children[:]:
-					if mc.nodeName == 'xyz':
-						c.setAttribute(mc.nodeName, mc._node.childNodes[0].toxml().strip())
-					c.removeChild(mc)
-					if mc.nodeName == 'limit':
-						self.appendChild(mc)
-					if mc.nodeName == 'dynamics':
-						if mc.getAttribute('damping') or mc.getAttribute('friction'):
-							self.appendChild(mc)
-						else:
-							c.removeChild(mc)
-				_props = self._node.childNodes[:]
-				for prop in _props:
-					if prop.nodeName == 'origin':
-						break
+				with _current_session()._profile.phase('material_lookup'):
+					materials = _current_session().findMaterial(gzMaterial, name)
+				material, exists = self._getMaterialNode(name)
+				if materials:
+					if not exists:
+						color = Item(self.createElement('color'), parent=c, document=self._document, level=c._level+1, root=self.getRootNode())
+						rgba = materials[0].args + ['1.0', '1.0', '1.0', '1.0']
+						color.setAttribute("rgba", " ".join(rgba[:4])) # rgba should contains 4 element, some of gazebo's material could contains 3 elements
+						material.appendChild(color)
 				else:
-					origin = Item(self.createElement("origin"), parent=self, document=self._document, level=self._level+1, root=self.getRootNode())
-					for name,value in c._node.attributes.items():
-						origin.setAttribute(name, value)
-					self.appendChild(origin)
-					#self.removeChild(c)
+					query, fn = f'material[name={name}].technique.pass.ambient', gzMaterial.getFilename()
+					raise Exception(f"Material not found ({query}) at {fn}")
+			else:
+				unsupported.append(child)
 
-		for c in self._children:
-			# Fix broken tree
-			if c._node.parentNode != self._node:
-				self._node.appendChild(c._node)
-				c._parent = self
-			if c.nodeName == 'limit':
-				c.convert()
-			c.convert()
+		if not c._children:
+			sys.stderr.write(f"WARN: empty material: {c}\n")
+		if unsupported:
+			sys.stderr.write(f"WARN: Unsupported one of material subtag: {unsupported}\n")
+			#raise Exception()
+		return c
+
+	def _convertPose(self, c):
+		"""
+			<pose frame=''>0 0 0 0 0 -1.0471975512</pose>
+		---
+			<origin rpy="0 0 -1.0471975512" xyz="0 0 0"/>
+		"""
+		if self.nodeName == 'robot':
+			self.removeChild(c)
+		else:
+			# Pose replaced with Origin
+			origin = Item(self.createElement("origin"), parent=self, document=self._document, level=self._level+1, root=self.getRootNode())
+			text = c.text().strip().split(' ')
+			origin.setAttribute("xyz", " ".join(text[:3]))
+			origin.setAttribute("rpy", " ".join(text[3:]))
+			self.replaceChild(origin, c)
+
+	def _convertValue(self, c):
+		"""
+			<nodeName>@text</nodeName>
+		---
+			<nodeName attr="@text"/>
+		"""
+		attr = VALUE_TAGS[c.nodeName]
+		if len(c._node.childNodes):
+			c.setAttribute(attr, c.text().strip())
+			cnodes = c._node.childNodes[:]
+			for mc in cnodes:
+				c._node.removeChild(mc)
+		# Removed while iterating: every other child is kept
+		children = list(c._children)
+		for mc in _live_iter(children):
+			children.remove(mc)
+			c.removeChild(mc)
+		return c
+
+	def _convertMesh(self, c):
+		mesh = c._node
+		for mc in c._children:
+			if mc.nodeName == "scale":
+				mesh.setAttribute("scale", mc.text())
+			elif mc.nodeName == "uri":
+				model = mc.text().strip()
+				mesh.setAttribute("filename", self.meshFilename(model))
+			else:
+				sys.stderr.write("Ignored tagname {0} at level {1}: {2}".format(c.nodeName, self._level, mc.nodeName))
+			c.removeChild(mc)
+
+	def _convertAxis(self, c):
+		"""
+			<axis>
+			  <xyz>0 -1 0</xyz>
+			  <limit>
+				<lower>0</lower>
+				<upper>0</upper>
+				<effort>100</effort>
+				<velocity>-1</velocity>
+			  </limit>
+			  <dynamics>
+				<damping>0.1</damping>
+			  </dynamics>
+			  <use_parent_model_frame>1</use_parent_model_frame>
+			</axis>
+		---
+			<axis xyz="0 -1 0"/>
+			<limit lower="0" upper="0" effort="100" velocity="-1"/>
+		"""
+		c.convert()
+		# Moved children are linked into the list of self
+		for mc in list(c._children):
+			if mc.nodeName == 'xyz':
+				c.setAttribute(mc.nodeName, mc._node.childNodes[0].toxml().strip())
+			c.removeChild(mc)
+			if mc.nodeName == 'limit':
+				self.appendChild(mc)
+			if mc.nodeName == 'dynamics':
+				if mc.getAttribute('damping') or mc.getAttribute('friction'):
+					self.appendChild(mc)
+				else:
+					c.removeChild(mc)
+		for prop in self._node.childNodes:
+			if prop.nodeName == 'origin':
+				break
+		else:
+			origin = Item(self.createElement("origin"), parent=self, document=self._document, level=self._level+1, root=self.getRootNode())
+			for name,value in c._node.attributes.items():
+				origin.setAttribute(name, value)
+			self.appendChild(origin)
+			#self.removeChild(c)
 
 	def toxml(self):
-		return self._node.toprettyxml(indent="  ")
+		output = io.StringIO()
+		self.writexml(output)
+		return output.getvalue()
+
+	def writexml(self, output, pretty=True):
+		"""Writes the document to output in chunks, toxml() returns the same"""
+		XmlWriter(output, *_layout(pretty)).writeDocument(self._node)
 
 	def dumptree(self):
 		sys.stderr.write("{0}{1}: {2}({3})\n".format("  "*self._level, self._level, self.nodeName, len(self._children)))
@@ -381,23 +529,1582 @@ class Item:
 			c.dumptree()
 
 
+# Elements dropped, with their inner tags turned into attributes, or with
+# their text turned into the attribute named, by both tree backends
+UNUSED_TAGS = ('plugin', 'physics', 'gravity', 'velocity_decay', 'self_collide', 'surface', 'static', 'dissipation', 'stiffness', 'sensor', '#comment', 'collision')
+ATTRIBUTE_TAGS = ('inertia', 'cylinder', 'sphere', 'box', 'limit', 'dynamics')
+VALUE_TAGS = {'parent': 'link', 'child': 'link', 'mass': 'value'}
+
+Item._converters = {
+	**dict.fromkeys(UNUSED_TAGS, Item._convertUnused),
+	**dict.fromkeys(ATTRIBUTE_TAGS, Item._convertAttributes),
+	**dict.fromkeys(VALUE_TAGS, Item._convertValue),
+	'visual': Item._convertVisual,
+	'material': Item._convertMaterial,
+	'pose': Item._convertPose,
+	'mesh': Item._convertMesh,
+	'axis': Item._convertAxis,
+}
+
+
+def _split_uri(uri):
+	def try_encode(uri, wrap):
+		try:
+			return wrap(uri.encode("utf-8"))
+		except:
+			return wrap(uri)
+
+	parts = try_encode(uri, lambda x: x.split('/'))
+	uritype, _, parts = parts[0], None, parts[2:]
+
+	typemap = {
+		"model:": ["GAZEBO_MODEL_PATH"],
+		"file:":  ["GAZEBO_RESOURCE_PATH"],
+	}.get(uritype)
+	if typemap is None:
+		return None, None
+
+	searchpath = []
+	envvalues = tuple(os.getenv(envvar) for envvar in typemap)
+	for value in envvalues:
+		if value is not None:
+			searchpath += try_encode(value, lambda x: x.strip(":").split(':'))
+	return searchpath, parts
+
+
+class ConversionProfile:
+	"""
+		Wall time of conversion phases and event counters, shared by the
+		threads of a session. Time of a phase includes the phases it runs.
+	"""
+	enabled = True
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._seconds = collections.Counter()
+		self._calls = collections.Counter()
+		self._counters = collections.Counter()
+
+	@contextlib.contextmanager
+	def phase(self, name):
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - started
+			with self._lock:
+				self._seconds[name] += elapsed
+				self._calls[name] += 1
+
+	def count(self, name, n=1):
+		with self._lock:
+			self._counters[name] += n
+
+	def merge(self, stats):
+		"""Adds getStats() of another profile, e.g. of a worker process"""
+		with self._lock:
+			for name, phase in stats['phases'].items():
+				self._seconds[name] += phase['seconds']
+				self._calls[name] += phase['calls']
+			self._counters.update(stats['counters'])
+
+	def getStats(self):
+		with self._lock:
+			return {
+				'phases': {name: {'seconds': self._seconds[name], 'calls': self._calls[name]} for name in self._seconds},
+				'counters': dict(self._counters),
+			}
+
+	def clear(self):
+		with self._lock:
+			self._seconds.clear()
+			self._calls.clear()
+			self._counters.clear()
+
+class _NullProfile:
+	# Disabled profile: phases and counters cost a call and nothing else
+	enabled = False
+	_phase = contextlib.nullcontext()
+
+	def phase(self, name):
+		return self._phase
+
+	def count(self, name, n=1):
+		pass
+
+	def merge(self, stats):
+		pass
+
+	def getStats(self):
+		return {'phases': {}, 'counters': {}}
+
+	def clear(self):
+		pass
+
+_NULL_PROFILE = _NullProfile()
+
+def format_profile(stats, fmt='table'):
+	"""ConversionProfile.getStats() as an aligned table or JSON"""
+	if fmt == 'json':
+		import json
+		return json.dumps(stats, indent=2, sort_keys=True) + "\n"
+	lines = [f"{'phase':20s} {'seconds':>10s} {'calls':>8s}"]
+	for name, phase in sorted(stats['phases'].items(), key=lambda item: -item[1]['seconds']):
+		lines.append(f"{name:20s} {phase['seconds']:10.4f} {phase['calls']:8d}")
+	lines.append(f"{'counter':20s} {'value':>10s}")
+	for name, value in sorted(stats['counters'].items()):
+		lines.append(f"{name:20s} {value:10d}")
+	return "\n".join(lines) + "\n"
+
+
+class _DocumentState:
+	# Per document state of a conversion: the session, generated <material>
+	# nodes and paths of the files resolved from uris (materials, meshes)
+	__slots__ = ('session', 'materialNodes', 'dependencies')
+
+	def __init__(self, session, dependencies=None):
+		self.session = session
+		self.materialNodes = {}
+		self.dependencies = dependencies if dependencies is not None else set()
+
+_conversion = threading.local()
+
+# Documents of profiled sessions being converted, Item bookkeeping is
+# skipped while there are none
+_counting = 0
+_counting_lock = threading.Lock()
+
+def _count(name, n=1):
+	document = getattr(_conversion, 'document', None)
+	if document is not None:
+		document.session._profile.count(name, n)
+
+def _current_document():
+	document = getattr(_conversion, 'document', None)
+	if document is None:
+		raise Exception("Item conversion outside of a ConversionSession")
+	return document
+
+
+class ConversionSettings:
+	"""
+		Options of the sessions of a conversion run, built once by main()
+		and handed to the pool workers. fromEnv() reads the SDF2URDF_*
+		variables, the settings of sessions created without any.
+	"""
+	__slots__ = ('treeBackend', 'materialBackend', 'lazyMaterials', 'lazyItems', 'noCache', 'resourceIndex',
+			'profile', 'resolvePoses', 'colorDb', 'exportAssets', 'assetUri')
+
+	def __init__(self, treeBackend='minidom', materialBackend='pyparsing', lazyMaterials=False, lazyItems=False,
+			noCache=False, resourceIndex=None, profile=False, resolvePoses=False, colorDb=None, exportAssets=None, assetUri=None):
+		if treeBackend not in TREE_BACKENDS:
+			raise Exception(f"Unknown tree backend {treeBackend}, one of: {', '.join(TREE_BACKENDS)}")
+		self.treeBackend = treeBackend
+		self.materialBackend = materialBackend
+		self.lazyMaterials = lazyMaterials
+		self.lazyItems = lazyItems
+		self.noCache = noCache
+		self.resourceIndex = resourceIndex
+		self.profile = profile
+		self.resolvePoses = resolvePoses
+		self.colorDb = colorDb
+		self.exportAssets = exportAssets
+		self.assetUri = assetUri
+
+	@classmethod
+	def fromEnv(cls):
+		"""Settings of the SDF2URDF_* variables, paths made absolute"""
+		flag = lambda name: os.getenv(name, '') not in ('', '0')
+		path = lambda name: os.path.abspath(os.getenv(name)) if os.getenv(name) else None
+		return cls(treeBackend=os.getenv('SDF2URDF_TREE_BACKEND') or 'minidom',
+				materialBackend=os.getenv('SDF2URDF_MATERIAL_BACKEND') or 'pyparsing',
+				lazyMaterials=flag('SDF2URDF_LAZY_MATERIALS'),
+				lazyItems=flag('SDF2URDF_LAZY_ITEMS'),
+				noCache=flag('SDF2URDF_NO_CACHE'),
+				resourceIndex=path('SDF2URDF_RESOURCE_INDEX'),
+				profile=flag('SDF2URDF_PROFILE'),
+				resolvePoses=flag('SDF2URDF_RESOLVE_POSES'),
+				colorDb=path('SDF2URDF_COLOR_DB'),
+				exportAssets=path('SDF2URDF_EXPORT_ASSETS'),
+				assetUri=os.getenv('SDF2URDF_ASSET_URI') or None)
+
+
+class ConversionSession:
+	"""
+		Caches shared by the documents converted with it: parsed material
+		files and resolved uris, least recently used entries are dropped
+		above the limits. Per document state (generated <material> nodes)
+		lives only while its document is converted. Safe to use from
+		several threads, each conversion runs in the calling thread.
+		Options not given are the ones of settings (a ConversionSettings,
+		None for the default ones): profile times and counts the phases
+		of conversions, see getProfileStats(). resolvePoses composes poses
+		along their frames into urdf origins first, see sdf2urdf_poses.
+		assets (an AssetExporter) exports the meshes and references them
+		in the exported package. colors (a GazeboColorDatabase) answers
+		color lookups of the scripts it was built from without parsing
+		them. lazyItems wraps the children of a node in Items when
+		converted only, the dropped subtrees are never wrapped.
+		Materials missing from the script of their <uri> are looked up in
+		the other scripts of its directory, see GazeboMaterialLibrary.
+	"""
+	def __init__(self, tree_backend=None, maxMaterialFiles=64, maxUris=65536, resourceIndex=None, profile=None, resolvePoses=None, assets=None, colors=None, lazyItems=None, settings=None):
+		settings = settings or default_settings()
+		self._settings = settings
+		if profile is None:
+			profile = settings.profile
+		self._resolvePoses = settings.resolvePoses if resolvePoses is None else resolvePoses
+		self._lazyItems = settings.lazyItems if lazyItems is None else lazyItems
+		if assets is None and settings.exportAssets:
+			from sdf2urdf_assets import AssetExporter
+			assets = AssetExporter(settings.exportAssets, settings.assetUri)
+		self._assets = assets
+		if colors is None and settings.colorDb:
+			colors = color_database(settings.colorDb)
+		self._colors = colors
+		self._materialCache = False if settings.noCache else GazeboMaterialCache()
+		self._profile = ConversionProfile() if profile else _NULL_PROFILE
+		self._treeBackend = tree_backend or settings.treeBackend
+		self._maxMaterialFiles = maxMaterialFiles
+		self._maxUris = maxUris
+		self._resourceIndex = resourceIndex
+		self._lock = threading.RLock()
+		self._materialFiles = collections.OrderedDict() # path -> (mtime, GazeboMaterialFile)
+		self._materialLibraries = {}                     # scripts directory -> GazeboMaterialLibrary
+		self._uriPaths = collections.OrderedDict()      # (uri, search path) -> path
+		self._stats = collections.Counter()
+
+	def getStats(self):
+		with self._lock:
+			return dict(self._stats)
+
+	def getProfile(self):
+		return self._profile
+
+	def getProfileStats(self):
+		"""Phase timers and counters of the profile along with the cache counters"""
+		stats = self._profile.getStats()
+		stats['counters'].update(self.getStats())
+		return stats
+
+	def getSettings(self):
+		return self._settings
+
+	def getAssets(self):
+		return self._assets
+
+	def getColorDatabase(self):
+		return self._colors
+
+	def getResourceIndex(self):
+		return self._resourceIndex if self._resourceIndex is not None else resource_index(self._settings.resourceIndex)
+
+	def clear(self):
+		with self._lock:
+			self._materialFiles.clear()
+			self._materialLibraries.clear()
+			self._uriPaths.clear()
+
+	def clearPaths(self):
+		"""Forgets resolved uris and directory listings, parsed material files are kept"""
+		with self._lock:
+			self._uriPaths.clear()
+			self.getResourceIndex().clear()
+
+	def _remember(self, cache, key, value, limit):
+		cache[key] = value
+		cache.move_to_end(key)
+		while len(cache) > limit:
+			cache.popitem(last=False)
+
+	def uriToPath(self, uri):
+		searchpath, parts = _split_uri(uri)
+		if searchpath is None:
+			return None
+		key = (uri, tuple(searchpath))
+		with self._lock:
+			hit = key in self._uriPaths
+			if hit:
+				self._stats['uri_hits'] += 1
+				self._uriPaths.move_to_end(key)
+				path = self._uriPaths[key]
+			else:
+				self._stats['uri_misses'] += 1
+		if not hit:
+			path = self._resolve(key, searchpath, parts)
+		document = getattr(_conversion, 'document', None)
+		if document is not None and path is not None:
+			document.dependencies.add(path)
+		return path
+
+	def _resolve(self, key, searchpath, parts):
+		# First match in the search path order, directories listed once
+		index, path = self.getResourceIndex(), None
+		probes = index.probes
+		with self._profile.phase('uri_resolve'):
+			for gmp in searchpath:
+				if index.exists(gmp, parts):
+					path = os.path.join(gmp, *parts)
+					break
+		self._profile.count('fs_probes', index.probes - probes)
+		# Misses are looked up again, the file may be added meanwhile
+		if path is not None:
+			with self._lock:
+				self._remember(self._uriPaths, key, path, self._maxUris)
+		return path
+
+	def meshFilename(self, uri):
+		"""Urdf filename of a mesh uri: file:// path, or its exported asset"""
+		path = self.uriToPath(uri)
+		if self._assets is None or path is None:
+			return "file://" + path
+		with self._profile.phase('assets'):
+			return self._assets.add(path)
+
+	def _prefetchMeshes(self, document):
+		if self._assets is None:
+			return
+		if hasattr(document, 'getElementsByTagName'):
+			uris = [uri for mesh in document.getElementsByTagName('mesh') for uri in mesh.getElementsByTagName('uri')]
+			uris = ["".join(c.data for c in uri.childNodes if c.nodeType == c.TEXT_NODE) for uri in uris]
+		else:
+			uris = [uri.text or '' for mesh in document.iter('mesh') for uri in mesh.iter('uri')]
+		paths = [self.uriToPath(uri.strip()) for uri in uris]
+		self._assets.prefetch([path for path in paths if path is not None])
+
+	def finishAssets(self):
+		"""Waits for the exported meshes to be copied, saves their manifest"""
+		if self._assets is not None:
+			with self._profile.phase('assets'):
+				self._assets.finish()
+
+	def materialFile(self, uri):
+		"""Parsed material file of <script><uri>, shared by all documents of the session"""
+		materialpath = self.uriToPath(uri)
+		if materialpath is None:
+			raise Exception(f"Cannot find material reference in GAZEBO_MODELS_PATH and GAZEBO_RESOURCE_PATH: {uri}")
+		# A long running session picks up edited material files
+		mtime = os.stat(materialpath).st_mtime_ns
+		with self._lock:
+			loaded = self._materialFiles.get(materialpath)
+			load = loaded is None or loaded[0] != mtime
+			if load:
+				self._stats['material_file_loads'] += 1
+				loaded = (mtime, GazeboMaterialFile(materialpath, cache=self._materialCache,
+						backend=self._settings.materialBackend, lazy=self._settings.lazyMaterials))
+			else:
+				self._stats['material_file_hits'] += 1
+			self._remember(self._materialFiles, materialpath, loaded, self._maxMaterialFiles)
+		if load and self._profile.enabled and not (self._colors is not None and self._colors.covers(materialpath)):
+			# Parsed on the first lookup otherwise, the same once per file
+			with self._profile.phase('material_parse'):
+				loaded[1].parse()
+			self._profile.count('material_cache_hits' if loaded[1].isFromCache() else 'material_cache_misses')
+		return loaded[1]
+
+	def materialLibrary(self, directory):
+		"""Material scripts of directory and their imports, reloaded when changed"""
+		with self._lock:
+			library = self._materialLibraries.get(directory)
+			if library is None:
+				library = self._materialLibraries[directory] = GazeboMaterialLibrary(directory,
+						cache=self._materialCache, backend=self._settings.materialBackend)
+		if library.refresh():
+			with self._lock:
+				self._stats['material_library_loads'] += 1
+		return library
+
+	def findMaterial(self, gzMaterial, name):
+		"""Colors of material name in gzMaterial, or else in the other scripts of its directory"""
+		if self._colors is not None:
+			args = self._colors.lookup(name, gzMaterial.getFilename())
+			if args is not None:
+				with self._lock:
+					self._stats['color_db_hits'] += 1
+				ambient = GazeboMaterialItem('ambient')
+				for arg in args:
+					ambient.addArgument(arg)
+				return [ambient]
+		materials = gzMaterial.getColor(name)
+		if not materials:
+			materials = self.materialLibrary(os.path.dirname(gzMaterial.getFilename())).getColor(name)
+		return materials
+
+	@contextlib.contextmanager
+	def _document(self, dependencies=None):
+		global _counting
+		previous = getattr(_conversion, 'document', None)
+		_conversion.document = document = _DocumentState(self, dependencies)
+		counting = self._profile.enabled
+		if counting:
+			with _counting_lock:
+				_counting += 1
+		try:
+			yield document
+		finally:
+			_conversion.document = previous
+			if counting:
+				with _counting_lock:
+					_counting -= 1
+
+	def _backend(self, tree_backend):
+		return tree_backend or self._treeBackend
+
+	def _convertDocument(self, document):
+		profile = self._profile
+		with profile.phase('build'):
+			doc = Item(document, lazy=self._lazyItems)
+		with profile.phase('convert'):
+			doc.convert()
+		return doc.writexml
+
+	def _convertTree(self, converter, root):
+		profile = self._profile
+		if profile.enabled:
+			profile.count('elements_parsed', sum(1 for _ in root.iter()))
+		with profile.phase('convert'):
+			robot = converter.convert(root)
+		return lambda output, pretty: converter.writexml(output, robot, pretty)
+
+	def _composePoses(self, document):
+		if self._resolvePoses:
+			from sdf2urdf_poses import resolve_poses
+			with self._profile.phase('poses'):
+				resolve_poses(document)
+
+	def _convert(self, inputfile, content, tree_backend):
+		"""Converts inputfile or content, returns write(output, pretty) of the urdf"""
+		profile = self._profile
+		profile.count('documents')
+		if self._backend(tree_backend) == 'etree':
+			converter = EtreeConverter()
+			with profile.phase('parse'):
+				root = converter.parse(inputfile) if content is None else converter.parseString(content)
+			self._composePoses(root)
+			self._prefetchMeshes(root)
+			return self._convertTree(converter, root)
+		with profile.phase('parse'):
+			document = parse(content, inputfile)
+		self._composePoses(document)
+		self._prefetchMeshes(document)
+		return self._convertDocument(document)
+
+	def _write(self, write, output, pretty):
+		with self._profile.phase('serialize'):
+			if isinstance(output, str):
+				with open(output, "w") as f:
+					write(f, pretty)
+			else:
+				write(output, pretty)
+
+	def convertFileTo(self, inputfile, output, tree_backend=None, pretty=True, dependencies=None):
+		"""
+			Writes urdf of inputfile to output, a stream or a filename opened
+			once the conversion succeeded. Paths of the material and mesh
+			files the conversion resolved are added to the dependencies set.
+		"""
+		with self._document(dependencies):
+			write = self._convert(inputfile, None, tree_backend)
+		self._write(write, output, pretty)
+
+	def convertFile(self, inputfile, tree_backend=None, dependencies=None):
+		"""Urdf of inputfile as a string, see convertFileTo()"""
+		output = io.StringIO()
+		self.convertFileTo(inputfile, output, tree_backend, dependencies=dependencies)
+		return output.getvalue()
+
+	def convertStringTo(self, content, output, tree_backend=None, pretty=True, dependencies=None):
+		"""Same as convertFileTo() for sdf given as a string"""
+		with self._document(dependencies):
+			write = self._convert(None, content, tree_backend)
+		self._write(write, output, pretty)
+
+	def convertString(self, content, tree_backend=None):
+		"""Same as convertFile() for sdf given as a string"""
+		output = io.StringIO()
+		self.convertStringTo(content, output, tree_backend)
+		return output.getvalue()
+
+	def streamConvertFile(self, inputfile, output, tree_backend=None, dependencies=None, pretty=True):
+		if self._resolvePoses:
+			raise Exception("Pose resolution needs the whole model, it cannot be used with stream conversion")
+		self._profile.count('documents')
+		with self._profile.phase('stream'):
+			_stream_convert(self, inputfile, output, self._backend(tree_backend), dependencies, pretty)
+
+
+_default_session = None
+_default_settings = None
+_default_session_lock = threading.Lock()
+def default_session():
+	"""Session of the module level functions, lives as long as the process"""
+	global _default_session
+	settings = default_settings()
+	with _default_session_lock:
+		if _default_session is None:
+			_default_session = ConversionSession(settings=settings)
+		return _default_session
+
+def default_settings():
+	"""Settings of set_default_settings(), or else of the SDF2URDF_* variables"""
+	global _default_settings
+	with _default_session_lock:
+		if _default_settings is None:
+			_default_settings = ConversionSettings.fromEnv()
+		return _default_settings
+
+def set_default_settings(settings):
+	"""Settings of the sessions created without any, set before the default session is used"""
+	global _default_settings
+	with _default_session_lock:
+		_default_settings = settings
+
+def _current_session():
+	document = getattr(_conversion, 'document', None)
+	return document.session if document is not None else default_session()
+
+def uri_to_path(uri):
+	return _current_session().uriToPath(uri)
+
+def mesh_filename(uri):
+	return _current_session().meshFilename(uri)
+
+def gazebo_material_file(uri):
+	return _current_session().materialFile(uri)
+
+
+# Escaping of xacro's writer (minidom's before python 3.13): the same
+# four characters in text and attribute values
+_NEEDS_ESCAPE = re.compile('[&<>"]')
+_ELEMENT_NODE, _TEXT_NODE, _COMMENT_NODE = xml.dom.Node.ELEMENT_NODE, xml.dom.Node.TEXT_NODE, xml.dom.Node.COMMENT_NODE
+
+def _escape(data):
+	# Most of the values have nothing to escape
+	if not _NEEDS_ESCAPE.search(data):
+		return data
+	return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+class XmlWriter:
+	"""
+		Serializer of converted trees, minidom nodes or etree elements,
+		written to output in chunks of about chunkSize characters. With
+		the default addindent and newl the output is the same as of
+		toprettyxml() patched by xacro: attributes sorted by name, a lone
+		text child inline, whitespace-only text skipped. XmlWriter(output,
+		"", "") writes compact xml.
+	"""
+	def __init__(self, output, addindent="  ", newl="\n", chunkSize=65536):
+		self._output = output
+		self._addindent = addindent
+		self._newl = newl
+		self._chunkSize = chunkSize
+		self._chunks = []
+		self._size = 0
+
+	def write(self, text):
+		self._chunks.append(text)
+		self._size += len(text)
+		if self._size >= self._chunkSize:
+			self.flush()
+
+	def flush(self):
+		if self._chunks:
+			self._output.write("".join(self._chunks))
+			self._chunks, self._size = [], 0
+
+	def writeHeader(self):
+		self.write('<?xml version="1.0" ?>' + self._newl)
+
+	def writeDocument(self, node):
+		"""Writes node as toprettyxml() does, a document with the xml header"""
+		if getattr(node, 'nodeType', None) == xml.dom.Node.DOCUMENT_NODE:
+			self.writeHeader()
+			for child in node.childNodes:
+				self.writeNode(child)
+		else:
+			self.writeNode(node)
+		self.flush()
+
+	def writeNode(self, node, indent=""):
+		if hasattr(node, 'nodeType'):
+			self._writeDom(node, indent)
+		else:
+			self._writeElement(node, indent)
+
+	def _attributes(self, items):
+		return "".join(f' {name}="{_escape(value)}"' for name, value in sorted(items))
+
+	def startTag(self, tag, attributes, indent=""):
+		self.write(f"{indent}<{tag}{self._attributes(attributes.items())}>{self._newl}")
+
+	def endTag(self, tag, indent=""):
+		self.write(f"{indent}</{tag}>{self._newl}")
+
+	def emptyTag(self, tag, attributes, indent=""):
+		self.write(f"{indent}<{tag}{self._attributes(attributes.items())}/>{self._newl}")
+
+	def _writeDom(self, node, indent):
+		nodeType = node.nodeType
+		if nodeType == _ELEMENT_NODE:
+			self._writeDomElement(node, indent)
+		elif nodeType == _TEXT_NODE:
+			self.write(_escape(indent + node.data + self._newl))
+		elif nodeType == _COMMENT_NODE:
+			if "--" in node.data:
+				raise ValueError("'--' is not allowed in a comment node")
+			self.write(f"{indent}<!--{node.data}-->{self._newl}")
+		else:
+			node.writexml(self, indent, self._addindent, self._newl)
+
+	def _writeDomElement(self, node, indent):
+		# Per node work of the whole output, a tag is one chunk
+		newl, tag = self._newl, node.tagName
+		start = indent + "<" + tag
+		if node.hasAttributes():
+			for name, value in sorted(node.attributes.items()):
+				start += ' ' + name + '="' + _escape(value) + '"'
+		children = node.childNodes
+		if not children:
+			self.write(start + "/>" + newl)
+		elif len(children) == 1 and children[0].nodeType == _TEXT_NODE:
+			self.write(start + ">" + _escape(children[0].data) + "</" + tag + ">" + newl)
+		else:
+			self.write(start + ">" + newl)
+			inner = indent + self._addindent
+			for child in children:
+				nodeType = child.nodeType
+				if nodeType == _ELEMENT_NODE:
+					self._writeDomElement(child, inner)
+				elif nodeType != _TEXT_NODE or (child.data and not child.data.isspace()):
+					self._writeDom(child, inner)
+			self.write(indent + "</" + tag + ">" + newl)
+
+	def _writeElement(self, elem, indent):
+		newl = self._newl
+		# Comment (and processing instruction) tags are factory functions
+		if callable(elem.tag):
+			if "--" in elem.text:
+				raise ValueError("'--' is not allowed in a comment node")
+			self.write(f"{indent}<!--{elem.text}-->{newl}")
+			return
+		tag = elem.tag
+		start = indent + "<" + tag
+		attrib = elem.attrib
+		if attrib:
+			for name in sorted(attrib):
+				start += ' ' + name + '="' + _escape(attrib[name]) + '"'
+		if len(elem):
+			self.write(start + ">" + newl)
+			inner = indent + self._addindent
+			for c in elem:
+				self._writeElement(c, inner)
+			self.write(indent + "</" + tag + ">" + newl)
+		elif elem.text:
+			self.write(start + ">" + _escape(elem.text) + "</" + tag + ">" + newl)
+		else:
+			self.write(start + "/>" + newl)
+
+def _layout(pretty):
+	# addindent and newl of XmlWriter
+	return ("  ", "\n") if pretty else ("", "")
+
+
+TREE_BACKENDS = ('minidom', 'etree')
+
+def etree_module():
+	try:
+		from lxml import etree
+	except ImportError:
+		import xml.etree.ElementTree as etree
+	return etree
+
+# Xml declaration, then the first node of the document when it is a
+# comment or processing instruction
+_PROLOG = re.compile(r'\ufeff?\s*(?:<\?xml\s.*?\?>\s*)?(?:(<!--)|<\?([^\s?]*))?', re.S)
+
+def _check_prolog(source, isContent=False):
+	"""
+		Refuses a comment or processing instruction before <sdf> as Item
+		does (the first node of the document is converted), ElementTree
+		and iterparse() drop them. source is a filename, a seekable file
+		or the content itself with isContent.
+	"""
+	if isContent:
+		head = source[:4096]
+	elif isinstance(source, str):
+		with open(source, "rb") as f:
+			head = f.read(4096)
+	elif source.seekable():
+		position = source.tell()
+		head = source.read(4096)
+		source.seek(position)
+	else:
+		return
+	if isinstance(head, bytes):
+		head = head.decode("utf-8", "replace")
+	comment, target = _PROLOG.match(head).groups()
+	if comment is not None:
+		raise Exception("Unsupported file type: #comment")
+	if target is not None:
+		raise Exception("Unsupported file type: {0}".format(target))
+
+class EtreeConverter:
+	"""
+		Item.convert rules applied in place to an ElementTree (lxml.etree
+		when installed) without a shadow tree of Items. Quirks of Item are
+		kept on purpose (live lists, late attach of moved nodes, levels),
+		so both backends produce byte-identical urdf.
+	"""
+	def __init__(self, etree=None):
+		self._etree = etree if etree is not None else etree_module()
+		self._robot = None
+		self._robotChildren = None
+		self._materialNodes = {}
+
+	def parse(self, inputfile):
+		_check_prolog(inputfile)
+		etree = self._etree
+		if hasattr(etree, 'LXML_VERSION'):
+			return etree.parse(inputfile, etree.XMLParser(remove_comments=False)).getroot()
+		return etree.parse(inputfile, etree.XMLParser(target=etree.TreeBuilder(insert_comments=True))).getroot()
+
+	def parseString(self, content):
+		_check_prolog(content, isContent=True)
+		etree = self._etree
+		if hasattr(etree, 'LXML_VERSION'):
+			# lxml refuses str with an encoding declaration
+			return etree.fromstring(content.encode("utf-8"), etree.XMLParser(remove_comments=False))
+		return etree.fromstring(content, etree.XMLParser(target=etree.TreeBuilder(insert_comments=True)))
+
+	def nodeName(self, elem):
+		return '#comment' if elem.tag is self._etree.Comment else elem.tag
+
+	def _repr(self, elem, level):
+		return f'Item<level={level},name={self.nodeName(elem)}>'
+
+	def strip(self, elem):
+		"""
+			Drops whitespace between elements, as Item does for pretty
+			printed input. A single text child stays the element value.
+		"""
+		if not len(elem):
+			return
+		if elem.text is not None and elem.text.strip():
+			raise Exception(f"Mixed content is not supported by the etree backend: {elem.tag}")
+		elem.text = None
+		for c in elem:
+			if c.tail is not None and c.tail.strip():
+				raise Exception(f"Mixed content is not supported by the etree backend: {elem.tag}")
+			c.tail = None
+			if c.tag is not self._etree.Comment:
+				self.strip(c)
+
+	def text(self, elem):
+		"""Serialized first child as Item.text() returns it"""
+		writer = io.StringIO()
+		if elem.text:
+			writer.write(_escape(elem.text))
+		else:
+			self.write(writer, elem[0])
+		return writer.getvalue()
+
+	def write(self, writer, elem, indent="", addindent="", newl=""):
+		"""Writes elem as minidom's writexml patched by xacro does"""
+		xmlwriter = XmlWriter(writer, addindent, newl)
+		xmlwriter.writeNode(elem, indent)
+		xmlwriter.flush()
+
+	def writexml(self, output, robot, pretty=True):
+		"""Writes converted robot to output in chunks, toxml() returns the same"""
+		xmlwriter = XmlWriter(output, *_layout(pretty))
+		xmlwriter.writeHeader()
+		xmlwriter.writeNode(robot)
+		xmlwriter.flush()
+
+	def toxml(self, robot):
+		output = io.StringIO()
+		self.writexml(output, robot)
+		return output.getvalue()
+
+	def convert(self, root):
+		"""
+			<sdf><model name=".."> converted into <robot name="..">,
+			returns the robot element.
+		"""
+		if root.tag != 'sdf':
+			raise Exception("Unsupported file type: {0}".format(self.nodeName(root)))
+		self.strip(root)
+		model = root[0]
+		if model.tag is self._etree.Comment:
+			raise Exception("Unsupported model node: {0}".format(self.nodeName(model)))
+		robot = self._etree.Element('robot')
+		for name, value in model.attrib.items():
+			robot.set(name, value)
+		for ch in list(model):
+			model.remove(ch)
+			robot.append(ch)
+		return self.convertRobot(robot)
+
+	def convertRobot(self, robot):
+		"""Converts robot element with (stripped) sdf model children"""
+		self._robot = robot
+		self._materialNodes = {}
+		self._convert(robot, 1)
+		return robot
+
+	def convertFile(self, inputfile):
+		return self.toxml(self.convert(self.parse(inputfile)))
+
+	def _getGazeboMaterial(self, script):
+		name, gzMaterial = None, None
+
+		for opt in script:
+			if self.nodeName(opt) == 'name':
+				name = self.text(opt)
+				if not name.startswith('Gazebo/'):
+					raise Exception("Unsupported color NS: {0}".format(name))
+			elif self.nodeName(opt) == 'uri':
+				gzMaterial = gazebo_material_file(self.text(opt))
+			else:
+				raise Exception("Unknown material/script tag: {0}".format(self.nodeName(opt)))
+		return name, gzMaterial
+
+	def _getMaterialNode(self, name):
+		exists = name in self._materialNodes
+		if not exists:
+			material = self._etree.Element('material')
+			material.set('name', name)
+			# Attached to robot with the rest of the moved nodes
+			self._robotChildren.append(material)
+			self._materialNodes[name] = material
+		return self._materialNodes[name], exists
+
+	# Rules of EtreeConverter._converters: converter(self, elem, c, children,
+	# level) converts c, a child of elem of level, and appends moved or new
+	# nodes to children to be attached to elem after the others. Returns the
+	# element to convert the children of, None when none are left.
+
+	def _convertUnused(self, elem, c, children, level):
+		elem.remove(c)
+
+	def _convertAttributes(self, elem, c, children, level):
+		if c.tag == 'limit':
+			self._convert(c, level)
+		for mc in list(c):
+			c.set(self.nodeName(mc), self.text(mc).strip())
+			c.remove(mc)
+
+	def _convertVisual(self, elem, c, children, level):
+		c.attrib.clear()
+		return c
+
+	def _convertMaterial(self, elem, c, children, level):
+		unsupported = []
+		children = list(c)
+		# As Item does, the first child is removed while iterating
+		for child in _live_iter(children):
+			if self.nodeName(child) == 'script' and level > 1:
+				name, gzMaterial = self._getGazeboMaterial(child)
+				c.remove(children.pop(0))
+				if name:
+					c.set("name", name)
+
+				with _current_session()._profile.phase('material_lookup'):
+					materials = _current_session().findMaterial(gzMaterial, name)
+				material, exists = self._getMaterialNode(name)
+				if materials:
+					if not exists:
+						rgba = materials[0].args + ['1.0', '1.0', '1.0', '1.0']
+						color = self._etree.SubElement(material, 'color')
+						color.set("rgba", " ".join(rgba[:4]))
+				else:
+					query, fn = f'material[name={name}].technique.pass.ambient', gzMaterial.getFilename()
+					raise Exception(f"Material not found ({query}) at {fn}")
+			else:
+				unsupported.append(child)
+
+		if not children:
+			sys.stderr.write(f"WARN: empty material: {self._repr(c, level)}\n")
+		if unsupported:
+			unsupported = ", ".join(self._repr(u, level+1) for u in unsupported)
+			sys.stderr.write(f"WARN: Unsupported one of material subtag: [{unsupported}]\n")
+		return c
+
+	def _convertPose(self, elem, c, children, level):
+		if elem.tag == 'robot':
+			elem.remove(c)
+		else:
+			text = self.text(c).strip().split(' ')
+			origin = self._etree.Element("origin")
+			origin.set("xyz", " ".join(text[:3]))
+			origin.set("rpy", " ".join(text[3:]))
+			elem[list(elem).index(c)] = origin
+
+	def _convertValue(self, elem, c, children, level):
+		kept = list(c)
+		for mc in _live_iter(kept):
+			kept.remove(mc)
+		if c.text is not None or len(c):
+			c.set(VALUE_TAGS[c.tag], self.text(c).strip())
+			c.text = None
+			del c[:]
+		# As Item does, the children skipped while removing are attached back
+		c.extend(kept)
+		return c
+
+	def _convertMesh(self, elem, c, children, level):
+		# Item reports the level of the parent, robot's children share it
+		elemlevel = level if elem is self._robot else level - 1
+		for mc in list(c):
+			if self.nodeName(mc) == "scale":
+				c.set("scale", self.text(mc))
+			elif self.nodeName(mc) == "uri":
+				c.set("filename", mesh_filename(self.text(mc).strip()))
+			else:
+				sys.stderr.write("Ignored tagname {0} at level {1}: {2}".format(c.tag, elemlevel, self.nodeName(mc)))
+			c.remove(mc)
+
+	def _convertAxis(self, elem, c, children, level):
+		self._convert(c, level)
+		for mc in list(c):
+			if self.nodeName(mc) == 'xyz':
+				c.set('xyz', self.text(mc).strip())
+			c.remove(mc)
+			if self.nodeName(mc) == 'limit':
+				children.append(mc)
+			if self.nodeName(mc) == 'dynamics' and (mc.get('damping') or mc.get('friction')):
+				children.append(mc)
+		for prop in elem:
+			if self.nodeName(prop) == 'origin':
+				break
+		else:
+			origin = self._etree.Element("origin")
+			for attr, value in c.attrib.items():
+				origin.set(attr, value)
+			children.append(origin)
+
+	def _convert(self, elem, level):
+		if _counting:
+			_count('nodes_visited')
+		# Children of robot are on the same level as robot
+		level = level if elem is self._robot else level + 1
+		children = list(elem)
+		if elem is self._robot:
+			# Material nodes are appended to robot while its children convert
+			self._robotChildren = children
+
+		# One pass: the rule registered for the tag of each child, then the
+		# child's conversion. Nodes appended to children meanwhile (moved or
+		# generated) are attached in their order and converted without a rule.
+		converters, originals, i = self._converters, len(children), 0
+		while i < len(children):
+			c = children[i]
+			i += 1
+			if i <= originals:
+				converter = converters.get(self.nodeName(c))
+				if converter is not None:
+					c = converter(self, elem, c, children, level)
+					if c is None:
+						continue
+			else:
+				elem.append(c)
+			self._convert(c, level)
+
+EtreeConverter._converters = {
+	**dict.fromkeys(UNUSED_TAGS, EtreeConverter._convertUnused),
+	**dict.fromkeys(ATTRIBUTE_TAGS, EtreeConverter._convertAttributes),
+	**dict.fromkeys(VALUE_TAGS, EtreeConverter._convertValue),
+	'visual': EtreeConverter._convertVisual,
+	'material': EtreeConverter._convertMaterial,
+	'pose': EtreeConverter._convertPose,
+	'mesh': EtreeConverter._convertMesh,
+	'axis': EtreeConverter._convertAxis,
+}
+
+def register_converter(tag, converter=None, etree_converter=None):
+	"""
+		Registers the rules converting elements of tag, in place of the
+		built in ones: converter(parent, item) for Item (minidom backend),
+		etree_converter(converter, parent, elem, children, level) for
+		EtreeConverter, see their _converters. A rule returns the node to
+		convert the children of, None when there are none left. Returns
+		the previous (converter, etree_converter), None for no rule.
+	"""
+	previous = (Item._converters.get(tag), EtreeConverter._converters.get(tag))
+	for converters, rule in ((Item._converters, converter), (EtreeConverter._converters, etree_converter)):
+		if rule is not None:
+			converters[tag] = rule
+	return previous
+
+def convert_file(inputfile, tree_backend=None, session=None):
+	return (session or default_session()).convertFile(inputfile, tree_backend)
+
+def convert_file_to(inputfile, output, tree_backend=None, pretty=True, session=None):
+	"""Writes urdf of inputfile to output stream or filename, compact xml unless pretty"""
+	(session or default_session()).convertFileTo(inputfile, output, tree_backend, pretty)
+
+def convert_string(content, tree_backend=None, session=None):
+	"""Same as convert_file() for sdf given as a string"""
+	return (session or default_session()).convertString(content, tree_backend)
+
+def _convert_fragment(xmltext):
+	"""
+		Converts one child of <model> serialized to xmltext as it would be
+		converted inside the whole document. Returns the converted robot
+		element of the temporary document, runs in a document scope.
+	"""
+	from xml.dom import minidom
+
+	element = minidom.parseString(xmltext).documentElement
+	# Same tree as built by <sdf><model> replacement in Item.convert
+	document = minidom.Document()
+	doc = Item(document)
+	robot = Item(document.createElement('robot'), parent=doc, document=document, level=1)
+	document.appendChild(robot._node)
+	robot._node.appendChild(element)
+	robot.appendChild(Item(element, parent=doc, document=document, level=1, root=robot, lazy=_current_session()._lazyItems))
+	doc._children.append(robot)
+	robot.convert()
+	return robot._node
+
+def stream_convert_file(inputfile, output, tree_backend=None, session=None, pretty=True):
+	"""
+		Converts sdf with bounded memory: children of <model> (links, joints,
+		...) are converted and written to output one by one as soon as they
+		are read, gazebo materials are collected and written at the end.
+		Output is the same as of convert_file().
+	"""
+	(session or default_session()).streamConvertFile(inputfile, output, tree_backend, pretty=pretty)
+
+def _stream_convert(session, inputfile, output, tree_backend, dependencies=None, pretty=True):
+	from xml.etree import ElementTree
+	from xml.etree.ElementTree import iterparse, tostring, XMLParser, TreeBuilder
+
+	profile = session._profile
+	# The etree backend converts parsed elements as is, without reparsing
+	converter = None
+	if tree_backend == 'etree':
+		converter = EtreeConverter(ElementTree)
+
+	_check_prolog(inputfile)
+	writer = XmlWriter(output, *_layout(pretty))
+	indent = _layout(pretty)[0]
+	parser = XMLParser(target=TreeBuilder(insert_comments=True))
+	stack, model, robot_open, materials = [], None, False, {}
+	for event, elem in iterparse(inputfile, events=('start', 'end'), parser=parser):
+		if event == 'start':
+			stack.append(elem)
+			if len(stack) == 1 and elem.tag != 'sdf':
+				raise Exception("Unsupported file type: {0}".format(elem.tag))
+			elif len(stack) == 2 and model is None:
+				model = elem
+				writer.writeHeader()
+			continue
+
+		stack.pop()
+		if len(stack) != 2 or stack[1] is not model:
+			continue
+
+		elem.tail = None
+		model.remove(elem)
+		profile.count('fragments')
+		with session._document(dependencies) as document, profile.phase('convert'):
+			if converter is None:
+				nodes = _convert_fragment(tostring(elem, encoding="unicode")).childNodes
+				generated = {item._node: name for name, item in document.materialNodes.items()}
+			else:
+				converter.strip(elem)
+				fragment = ElementTree.Element('robot')
+				fragment.append(elem)
+				nodes = list(converter.convertRobot(fragment))
+				generated = {node: name for name, node in converter._materialNodes.items()}
+		with profile.phase('serialize'):
+			for node in nodes:
+				if node in generated:
+					materials.setdefault(generated[node], node)
+					continue
+				if not robot_open:
+					writer.startTag('robot', model.attrib)
+					robot_open = True
+				writer.writeNode(node, indent)
+
+	if model is None:
+		raise Exception(f"Nothing to convert in {inputfile}")
+	for node in materials.values():
+		if not robot_open:
+			writer.startTag('robot', model.attrib)
+			robot_open = True
+		writer.writeNode(node, indent)
+	if robot_open:
+		writer.endTag('robot')
+	else:
+		writer.emptyTag('robot', model.attrib)
+	writer.flush()
+
+
+def _batch_root(pattern):
+	if os.path.isdir(pattern):
+		return pattern
+	parts = []
+	for part in pattern.split(os.sep):
+		if glob.has_magic(part):
+			break
+		parts.append(part)
+	root = os.sep.join(parts)
+	if root == pattern: # plain filename
+		root = os.path.dirname(pattern)
+	return root or os.curdir
+
+def collect_batch_inputs(patterns, outputdir):
+	"""
+		Expand directories (recursively, *.sdf) and globs into the list of
+		(input.sdf, output.urdf) pairs, output tree mirrors the input tree.
+	"""
+	jobs, outputs = [], {}
+	for pattern in patterns:
+		if os.path.isdir(pattern):
+			found = glob.glob(os.path.join(glob.escape(pattern), "**", "*.sdf"), recursive=True)
+		else:
+			found = glob.glob(pattern, recursive=True)
+		if not found:
+			sys.stderr.write(f"WARN: nothing matches {pattern}\n")
+		root = _batch_root(pattern)
+		for inputfile in sorted(found):
+			if not os.path.isfile(inputfile):
+				continue
+			relpath = os.path.relpath(inputfile, root)
+			outputfile = os.path.join(outputdir, os.path.splitext(relpath)[0] + ".urdf")
+			realpath = os.path.realpath(outputfile)
+			if realpath in outputs:
+				if outputs[realpath] == os.path.realpath(inputfile):
+					continue # same file matched twice
+				raise Exception(f"Output collision: {outputs[realpath]} and {inputfile} both map to {outputfile}")
+			outputs[realpath] = os.path.realpath(inputfile)
+			jobs.append((inputfile, outputfile))
+	return jobs
+
+def _worker_assets():
+	"""Manifest entries of the meshes a worker exported, saved by the parent"""
+	assets = default_session().getAssets()
+	if assets is None:
+		return None
+	assets.finish(save=False)
+	# Counters of this task only, summed up by the parent
+	entries = assets.getEntries()
+	assets.clearStats()
+	return entries
+
+def _merge_assets(entries):
+	if entries is not None:
+		default_session().getAssets().merge(entries)
+
+def _save_assets():
+	"""Waits for the exported meshes, saves the manifest and reports it"""
+	assets = default_session().getAssets()
+	if assets is None:
+		return
+	assets.finish()
+	stats = assets.getStats()
+	sys.stderr.write(f"{stats['assets']} assets in {assets.getDirectory()}"
+			f" ({stats['hashed']} hashed, {stats['copied']} copied)\n")
+
+def _batch_convert(job):
+	inputfile, outputfile, stream, pretty = job
+	started, error, assets = time.monotonic(), None, None
+	try:
+		os.makedirs(os.path.dirname(outputfile) or os.curdir, exist_ok=True)
+		if stream:
+			with open(outputfile, "w") as f:
+				stream_convert_file(inputfile, f, pretty=pretty)
+		else:
+			convert_file_to(inputfile, outputfile, pretty=pretty)
+		default_session().getResourceIndex().save()
+		assets = _worker_assets()
+	except Exception as e:
+		error = f"{e.__class__.__name__}: {e}"
+	# Profile of this file only, summed up by the parent
+	profile = default_session().getProfile()
+	stats = profile.getStats()
+	profile.clear()
+	return inputfile, outputfile, time.monotonic() - started, error, stats, assets
+
+def batch_convert(patterns, outputdir, jobs=None, stream=False, profile=None, pretty=True):
+	"""
+		Convert all matched sdf files into outputdir using a pool of worker
+		processes. Every worker keeps its own material files and uri caches
+		between the files it converts. Returns the number of failed files.
+		Workers convert with default_settings() of this process, their
+		profiles (when the settings enable it) are added to profile.
+	"""
+	from multiprocessing import Pool
+
+	tasks = [(i, o, stream, pretty) for i, o in collect_batch_inputs(patterns, outputdir)]
+	jobs = min(jobs or os.cpu_count() or 1, max(len(tasks), 1))
+	failed, converted = 0, 0
+	started = time.monotonic()
+	with Pool(jobs, set_default_settings, (default_settings(),)) as pool:
+		for inputfile, outputfile, elapsed, error, stats, assets in pool.imap_unordered(_batch_convert, tasks):
+			_merge_assets(assets)
+			if profile is not None:
+				profile.merge(stats)
+			if error is None:
+				converted += 1
+				sys.stderr.write(f"[ OK ] {inputfile} -> {outputfile} ({elapsed:.3f}s)\n")
+			else:
+				failed += 1
+				sys.stderr.write(f"[FAIL] {inputfile}: {error}\n")
+	elapsed = time.monotonic() - started
+	rate = len(tasks) / elapsed if elapsed > 0 else 0.0
+	sys.stderr.write(f"{len(tasks)} files: {converted} converted, {failed} failed in {elapsed:.2f}s " \
+			f"({rate:.1f} files/s, {jobs} workers)\n")
+	return failed
+
+
+def split_world(inputfile):
+	"""
+		Models of the <world> in inputfile read one by one, yields
+		(name, pose, sdf, uris) for each <model>: sdf is a standalone
+		<sdf><model> document of it, uris the ones the model references.
+	"""
+	from xml.etree.ElementTree import Element, iterparse, tostring, XMLParser, TreeBuilder
+
+	parser = XMLParser(target=TreeBuilder(insert_comments=True))
+	stack, world = [], None
+	for event, elem in iterparse(inputfile, events=('start', 'end'), parser=parser):
+		if event == 'start':
+			stack.append(elem)
+			if len(stack) == 1 and elem.tag != 'sdf':
+				raise Exception("Unsupported file type: {0}".format(elem.tag))
+			elif len(stack) == 2 and elem.tag == 'world' and world is None:
+				world = elem
+			continue
+
+		stack.pop()
+		if len(stack) != 2 or stack[1] is not world:
+			continue
+		world.remove(elem)
+		if elem.tag == 'include':
+			sys.stderr.write(f"WARN: <include> of {elem.findtext('uri')} in world is not converted\n")
+		if elem.tag != 'model':
+			continue
+		elem.tail = "\n"
+		sdf = Element('sdf', stack[0].attrib)
+		sdf.text = "\n"
+		sdf.append(elem)
+		uris = set(uri.text.strip() for uri in elem.iter('uri') if uri.text)
+		yield elem.get('name', ''), (elem.findtext('pose') or '').strip(), tostring(sdf, encoding="unicode"), uris
+
+	if world is None:
+		raise Exception(f"No <world> in {inputfile}")
+
+def _world_filename(name, index):
+	name = name.replace(os.sep, '_').replace('/', '_').strip('.')
+	return f"{name or f'model_{index}'}.urdf"
+
+def _world_convert(task):
+	index, name, content, outputfile, pretty = task
+	started, error, assets = time.monotonic(), None, None
+	try:
+		default_session().convertStringTo(content, outputfile, pretty=pretty)
+		assets = _worker_assets()
+	except Exception as e:
+		error = f"{e.__class__.__name__}: {e}"
+	profile = default_session().getProfile()
+	stats = profile.getStats()
+	profile.clear()
+	return index, name, outputfile, time.monotonic() - started, error, stats, assets
+
+def _preload(session, uris):
+	"""Resolves uris and parses material files once, before workers are forked"""
+	for uri in sorted(uris):
+		path = session.uriToPath(uri)
+		if path is None or not path.endswith('.material'):
+			continue
+		colors = session.getColorDatabase()
+		if colors is not None and colors.covers(path):
+			continue
+		try:
+			session.materialFile(uri).parse()
+		except Exception:
+			pass # reported by the conversion of the models using it
+
+def world_convert(inputfile, outputdir, jobs=None, profile=None, pretty=True):
+	"""
+		Converts every <model> of the world in inputfile to outputdir/<name>.urdf
+		using a pool of worker processes and writes outputdir/manifest.json
+		listing the models, their pose in the world and urdf files. Uris and
+		material files of all models are resolved and parsed once by the
+		default session before the workers are forked, so they share them
+		(with the spawn start method they share the material cache instead).
+		Returns the number of failed models.
+	"""
+	import json
+	import multiprocessing
+
+	session = default_session()
+	tasks, models, outputs, uris = [], [], {}, set()
+	for index, (name, pose, content, used) in enumerate(split_world(inputfile)):
+		outputfile = os.path.join(outputdir, _world_filename(name, index))
+		if outputfile in outputs:
+			raise Exception(f"Output collision: models {outputs[outputfile]} and {name} both map to {outputfile}")
+		outputs[outputfile] = name
+		tasks.append((index, name, content, outputfile, pretty))
+		models.append({'name': name, 'pose': pose, 'urdf': os.path.basename(outputfile)})
+		uris |= used
+	os.makedirs(outputdir, exist_ok=True)
+	_preload(session, uris)
+	session.getResourceIndex().save()
+	# Workers inherit the preloaded session, its profile is counted once here
+	if profile is not None:
+		profile.merge(session.getProfile().getStats())
+	session.getProfile().clear()
+
+	methods = multiprocessing.get_all_start_methods()
+	context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+	jobs = min(jobs or os.cpu_count() or 1, max(len(tasks), 1))
+	failed = 0
+	started = time.monotonic()
+	with context.Pool(jobs, set_default_settings, (session.getSettings(),)) as pool:
+		for index, name, outputfile, elapsed, error, stats, assets in pool.imap_unordered(_world_convert, tasks):
+			_merge_assets(assets)
+			if profile is not None:
+				profile.merge(stats)
+			if error is None:
+				sys.stderr.write(f"[ OK ] {name} -> {outputfile} ({elapsed:.3f}s)\n")
+			else:
+				failed += 1
+				models[index]['error'] = error
+				del models[index]['urdf']
+				sys.stderr.write(f"[FAIL] {name}: {error}\n")
+	elapsed = time.monotonic() - started
+	with open(os.path.join(outputdir, "manifest.json"), "w") as f:
+		json.dump({'source': os.path.abspath(inputfile), 'models': models}, f, indent=2)
+		f.write("\n")
+	sys.stderr.write(f"{len(tasks)} models: {len(tasks) - failed} converted, {failed} failed in {elapsed:.2f}s " \
+			f"({jobs} workers)\n")
+	return failed
+
+def _mtimes(paths):
+	mtimes = {}
+	for path in paths:
+		try:
+			mtimes[path] = os.stat(path).st_mtime_ns
+		except OSError:
+			mtimes[path] = None
+	return mtimes
+
+def _watch_convert(session, inputfile, outputfile, stream, pretty):
+	"""Converts once, returns mtimes of the files the output depends on"""
+	dependencies = set()
+	mtimes = _mtimes([inputfile])
+	started = time.monotonic()
+	try:
+		if outputfile is not None:
+			os.makedirs(os.path.dirname(outputfile) or os.curdir, exist_ok=True)
+		if stream:
+			output = sys.stdout if outputfile is None else open(outputfile, "w")
+			try:
+				session.streamConvertFile(inputfile, output, dependencies=dependencies, pretty=pretty)
+			finally:
+				if output is not sys.stdout:
+					output.close()
+		else:
+			session.convertFileTo(inputfile, outputfile or sys.stdout, pretty=pretty, dependencies=dependencies)
+		session.finishAssets()
+		sys.stdout.flush()
+		sys.stderr.write(f"[ OK ] {inputfile} -> {outputfile or 'stdout'} ({time.monotonic() - started:.3f}s)\n")
+	except Exception as e:
+		sys.stderr.write(f"[FAIL] {inputfile}: {e.__class__.__name__}: {e}\n")
+	dependencies.discard(inputfile)
+	mtimes.update(_mtimes(dependencies))
+	return mtimes
+
+def watch_convert(jobs, stream=False, interval=0.5, session=None, pretty=True):
+	"""
+		Converts the (input.sdf, output.urdf) pairs returned by jobs() and
+		converts again an output when one of its dependencies changes: the
+		sdf, material files and meshes it uses. Parsed material files are
+		reused while unchanged. Polls every interval seconds, pairs new in
+		jobs() are converted as they appear. Runs until interrupted.
+	"""
+	session = session or default_session()
+	watched = {} # (input, output) -> {path: mtime}
+	while True:
+		current, cleared = set(), not watched
+		for inputfile, outputfile in jobs():
+			job = (inputfile, outputfile)
+			current.add(job)
+			mtimes = watched.get(job)
+			if mtimes is None or _mtimes(mtimes) != mtimes:
+				if not cleared:
+					# Meshes or materials may have been added, uris are resolved again
+					session.clearPaths()
+					cleared = True
+				watched[job] = _watch_convert(session, inputfile, outputfile, stream, pretty)
+		for job in set(watched) - current:
+			del watched[job]
+		time.sleep(interval)
+
+
+def parse_args():
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Converter gazebo's sdf to urdf. By default content is printed to stdout.")
+	parser.add_argument('input', nargs='*', help="input.sdf, or directories/globs with --batch")
+	parser.add_argument('output', nargs='?', help="output.urdf")
+	parser.add_argument('-b', '--batch', action='store_true', help="convert every matched sdf file into --output-dir")
+	parser.add_argument('--world', action='store_true',
+			help="convert every model of the input world into --output-dir, one urdf per model and manifest.json")
+	parser.add_argument('-o', '--output-dir', help="output directory for --batch and --world")
+	parser.add_argument('-j', '--jobs', type=int, default=None, help="number of --batch and --world workers (default: cpu count)")
+	parser.add_argument('--stream', action='store_true',
+			help="convert link by link with bounded memory (large models)")
+	parser.add_argument('--compact', action='store_true', help="write urdf without indentation and newlines")
+	parser.add_argument('--resolve-poses', action='store_true',
+			help="compose poses along their frames into urdf joint and link relative origins")
+	parser.add_argument('--export-assets', metavar='DIR',
+			help="copy meshes and their textures into DIR, content addressed, and reference them there")
+	parser.add_argument('--asset-uri', metavar='URI', default=None,
+			help="prefix of exported mesh filenames (default: package://<name of DIR>)")
+	parser.add_argument('-w', '--watch', action='store_true',
+			help="convert again when the sdf or the material and mesh files it uses change")
+	parser.add_argument('--watch-interval', type=float, default=0.5, metavar='SECONDS',
+			help="how often --watch checks the files (default: 0.5)")
+	parser.add_argument('--tree-backend', choices=list(TREE_BACKENDS), default=None,
+			help="xml tree used for conversion: minidom with Item wrappers (default) or etree (lxml when installed)")
+	parser.add_argument('--lazy-items', action='store_true',
+			help="wrap minidom nodes in Items only when converted, dropped subtrees are never wrapped")
+	parser.add_argument('--material-backend', choices=['pyparsing', 'lexer'], default=None,
+			help="gazebo material scripts parser (default: pyparsing)")
+	parser.add_argument('--lazy-materials', action='store_true',
+			help="parse only the referenced material blocks of not cached material files")
+	parser.add_argument('--resource-index', metavar='FILE',
+			help="keep listings of model:// and file:// search path directories in FILE for later runs")
+	parser.add_argument('--profile', action='store_const', const='table', default=None,
+			help="print time of conversion phases and counters to stderr")
+	parser.add_argument('--profile-json', dest='profile', action='store_const', const='json',
+			help="same as --profile, printed as JSON")
+	parser.add_argument('--no-cache', action='store_true', help="do not use the parsed material files cache")
+	parser.add_argument('--clear-cache', action='store_true', help="remove the parsed material files cache and exit")
+	parser.add_argument('--color-db', metavar='FILE',
+			help="look material colors up in FILE built by --build-color-db instead of parsing their scripts")
+	parser.add_argument('--build-color-db', metavar='FILE',
+			help="write the colors of all materials of GAZEBO_RESOURCE_PATH to FILE and exit")
+	args = parser.parse_args()
+
+	if args.clear_cache or args.build_color_db is not None:
+		return args
+	if not args.input:
+		parser.error("the following arguments are required: input")
+	if args.batch and args.world:
+		parser.error("--batch and --world cannot be used together")
+	if args.resolve_poses and args.stream:
+		parser.error("--resolve-poses cannot be used with --stream")
+	if args.batch:
+		if args.output is not None:
+			args.input.append(args.output)
+			args.output = None
+		if args.output_dir is None:
+			parser.error("--batch requires --output-dir")
+	elif args.world:
+		if len(args.input) == 2 and args.output is None:
+			args.input, args.output = args.input[:1], args.input[1]
+		if args.output_dir is None:
+			args.output_dir, args.output = args.output, None
+		if len(args.input) != 1 or args.output is not None or args.output_dir is None:
+			parser.error("--world requires one input world and --output-dir")
+		if args.stream or args.watch:
+			parser.error("--world cannot be used with --stream or --watch")
+		args.input = args.input[0]
+	else:
+		if len(args.input) == 2 and args.output is None:
+			args.input, args.output = args.input[:1], args.input[1]
+		if len(args.input) != 1:
+			parser.error("only one input.sdf is accepted without --batch")
+		args.input = args.input[0]
+	return args
+
+def settings_from_args(args):
+	"""Settings of the command line options, the SDF2URDF_* variables for the ones not given"""
+	settings = ConversionSettings.fromEnv()
+	settings.noCache = settings.noCache or args.no_cache
+	settings.lazyMaterials = settings.lazyMaterials or args.lazy_materials
+	settings.lazyItems = settings.lazyItems or args.lazy_items
+	settings.profile = settings.profile or args.profile is not None
+	settings.resolvePoses = settings.resolvePoses or args.resolve_poses
+	if args.material_backend is not None:
+		settings.materialBackend = args.material_backend
+	if args.tree_backend is not None:
+		settings.treeBackend = args.tree_backend
+	if args.resource_index is not None:
+		settings.resourceIndex = os.path.abspath(args.resource_index)
+	if args.color_db is not None:
+		settings.colorDb = os.path.abspath(args.color_db)
+	if args.export_assets is not None:
+		settings.exportAssets = os.path.abspath(args.export_assets)
+		if args.asset_uri is not None:
+			settings.assetUri = args.asset_uri
+	return settings
+
 def main():
-	load_gazebo_setup()
+	args = parse_args()
 
-	if len(sys.argv) == 1 or len(sys.argv) > 3 or 'help' in sys.argv or '--help' in sys.argv or '-h' in sys.argv:
-		sys.stdout.write("""usage: {0} <input.sdf> [<output.urdf>]\n\n  By default content is printed to stdout.\n\n""".format(sys.argv[0]))
-		exit(1)
-	if len(sys.argv) == 3 and os.path.realpath(sys.argv[1]) == os.path.realpath(sys.argv[2]):
-		raise Exception("Input and output filenames is the same file")
-	xml = parse(None, sys.argv[1])
-	output = sys.stdout
-	if len(sys.argv) == 3:
-		output = open(sys.argv[2], "w")
+	if args.clear_cache:
+		cache = GazeboMaterialCache()
+		removed = cache.clear()
+		sys.stderr.write(f"Removed {removed} entries from {cache.getDirectory()}\n")
+		exit(0)
+	settings = settings_from_args(args)
+	set_default_settings(settings)
+	# Before the setup is loaded, it is cached as well
+	load_gazebo_setup(cache=False if settings.noCache else None)
+	if args.build_color_db is not None:
+		count = build_color_database(args.build_color_db, cache=False if settings.noCache else None, backend=settings.materialBackend, jobs=args.jobs)
+		sys.stderr.write(f"{count} material colors written to {args.build_color_db}\n")
+		exit(0)
 
-	doc = Item(xml)
-	doc.convert()
+	if args.watch:
+		if args.batch:
+			jobs = lambda: collect_batch_inputs(args.input, args.output_dir)
+		else:
+			if args.output is not None and os.path.realpath(args.input) == os.path.realpath(args.output):
+				raise Exception("Input and output filenames is the same file")
+			jobs = lambda: [(args.input, args.output)]
+		try:
+			watch_convert(jobs, args.stream, args.watch_interval, pretty=not args.compact)
+		except KeyboardInterrupt:
+			pass
+		exit(0)
+
+	if args.batch or args.world:
+		profile = ConversionProfile() if args.profile else None
+		if args.world:
+			failed = world_convert(args.input, args.output_dir, args.jobs, profile, not args.compact)
+		else:
+			failed = batch_convert(args.input, args.output_dir, args.jobs, args.stream, profile, not args.compact)
+		_save_assets()
+		if profile is not None:
+			sys.stderr.write(format_profile(profile.getStats(), args.profile))
+		exit(1 if failed else 0)
 
-	output.write(doc.toxml())
+	if args.output is not None and os.path.realpath(args.input) == os.path.realpath(args.output):
+		raise Exception("Input and output filenames is the same file")
+	# One conversion and the process exits: collections walking the
+	# material library and Item trees as they grow free next to nothing
+	gc.disable()
+	if args.stream:
+		output = sys.stdout if args.output is None else open(args.output, "w")
+		stream_convert_file(args.input, output, pretty=not args.compact)
+		output.flush()
+	else:
+		# The output file is opened once the conversion succeeded
+		convert_file_to(args.input, args.output or sys.stdout, pretty=not args.compact)
+		sys.stdout.flush()
+	default_session().getResourceIndex().save()
+	_save_assets()
+	if args.profile is not None:
+		sys.stderr.write(format_profile(default_session().getProfileStats(), args.profile))
 
 if __name__ == '__main__':
 	main()
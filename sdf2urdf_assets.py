@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+	Content addressed export of the meshes used by converted urdf, and the
+	textures and material libraries the meshes reference, into a package
+	directory that can be shipped along with the urdf:
+
+		objects/<sha256[:2]>/<sha256>   one read-only copy of each content
+		assets/<key>/<path>             hard links to the objects: a mesh and
+		                                its textures at their relative paths
+		manifest.json                   sources, their hashes and the assets
+
+	key is a hash of the paths and contents of a mesh and its textures, the
+	mesh's relative references stay valid and identical meshes share one
+	asset directory. Hashing and copies run in a thread pool of one thread
+	per cpu (hashlib releases the GIL, a pool on a single cpu only adds
+	contention), objects are reflinked (copy on write) where the
+	filesystem supports it and copied otherwise. Hashes and references of
+	unchanged sources (size and mtime) are taken from the manifest of a
+	previous export, objects already present are skipped: work that does
+	not read the files runs in the calling thread.
+"""
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import threading
+import concurrent.futures
+from xml.sax.saxutils import unescape
+
+MANIFEST_FORMAT = 1
+# linux/fs.h, clones the extents of a file on btrfs, xfs, ...
+_FICLONE = 0x40049409
+_CHUNK = 1 << 20
+_IMAGE = re.compile(rb'<(?:[\w.-]+:)?image\b[^>]*(?<!/)>(.*?)</(?:[\w.-]+:)?image>', re.S)
+_INIT_FROM = re.compile(rb'<(?:[\w.-]+:)?init_from\b[^>]*>(.*?)</(?:[\w.-]+:)?init_from>', re.S)
+# <init_from><ref>file</ref></init_from> of collada 1.5
+_REF = re.compile(rb'\s*<(?:[\w.-]+:)?ref\b[^>]*>(.*?)</(?:[\w.-]+:)?ref>\s*', re.S)
+
+
+def _sha256(path):
+	with open(path, "rb") as f:
+		# Reads into one buffer (python 3.11)
+		if hasattr(hashlib, 'file_digest'):
+			return hashlib.file_digest(f, 'sha256').hexdigest()
+		digest = hashlib.sha256()
+		for chunk in iter(lambda: f.read(_CHUNK), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+def _clone(source, destination, reflink=True):
+	"""Reflinks source to destination when possible, copies otherwise, returns whether it reflinked"""
+	if reflink:
+		try:
+			import fcntl
+			with open(source, "rb") as src, open(destination, "wb") as dst:
+				fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+			return True
+		except (ImportError, OSError):
+			pass
+	shutil.copyfile(source, destination)
+	return False
+
+def _run(tasks):
+	"""Runs (future, function, args) tasks in this thread"""
+	for future, function, args in tasks:
+		try:
+			future.set_result(function(*args))
+		except Exception as e:
+			future.set_exception(e)
+
+def _link(source, destination):
+	try:
+		os.link(source, destination)
+	except OSError:
+		shutil.copyfile(source, destination)
+
+def _dae_references(path, data):
+	"""Image files of a collada mesh (<image><init_from>, 1.4 and 1.5)"""
+	# Meshes are mostly float arrays, scanning for the images is much
+	# cheaper than parsing them
+	references = []
+	for image in _IMAGE.finditer(data):
+		ref = _INIT_FROM.search(image.group(1))
+		if ref is not None:
+			ref = _REF.sub(rb'\1', ref.group(1)).strip()
+			if ref:
+				references.append(unescape(ref.decode("utf-8", errors="replace")))
+	return references
+
+def _obj_references(path, data):
+	"""Material libraries of a wavefront mesh and the textures they use"""
+	references = []
+	for line in data.decode("utf-8", errors="replace").splitlines():
+		if line.startswith('mtllib '):
+			references += line.split()[1:]
+	for mtl in list(references):
+		mtlpath = os.path.join(os.path.dirname(path), mtl)
+		if not os.path.isfile(mtlpath):
+			continue
+		with open(mtlpath, "r", errors="replace") as f:
+			for line in f:
+				words = line.split()
+				if words and (words[0].startswith('map_') or words[0] in ('bump', 'disp', 'decal', 'refl')):
+					references.append(os.path.join(os.path.dirname(mtl), words[-1]))
+	return references
+
+def mesh_references(path, data=None):
+	"""Paths of the files a mesh references, relative to its directory, data is its content if already read"""
+	ext = os.path.splitext(path)[1].lower()
+	if ext not in ('.dae', '.obj'):
+		return []
+	try:
+		if data is None:
+			with open(path, "rb") as f:
+				data = f.read()
+		if ext == '.dae':
+			references = _dae_references(path, data)
+		else:
+			references = _obj_references(path, data)
+	except Exception as e:
+		sys.stderr.write(f"WARN: cannot read references of {path}: {e}\n")
+		return []
+	return [ref[len('file://'):] if ref.startswith('file://') else ref for ref in references]
+
+
+class AssetExporter:
+	"""
+		Exports meshes into directory as add() is called by the conversion,
+		add() returns the urdf filename of the mesh: uri (package://<name of
+		directory> by default) followed by its path in the directory.
+		finish() waits for the copies and saves the manifest. Safe to use
+		from several threads.
+	"""
+	def __init__(self, directory, uri=None, jobs=None):
+		self._directory = os.path.abspath(directory)
+		self._uri = (uri or f"package://{os.path.basename(self._directory)}").rstrip('/')
+		self._jobs = jobs or os.cpu_count() or 1
+		self._lock = threading.Lock()
+		self._pool, self._pid = None, None
+		self._reflink = True # until the filesystem refuses a clone
+		self._created = set() # directories made by this exporter
+		self._meshes = {}    # mesh path -> future of (asset path, [(source, asset path, sha256)])
+		self._objects = {}   # sha256 -> future of the stored object
+		self._published = {} # asset path -> future of the link
+		self._sources, self._assets, self._urls = {}, {}, {}
+		self._known = {}     # source -> {size, mtime_ns, sha256} of a previous export
+		self._hashes = {}    # source -> future of its sha256, shared by the meshes using it
+		self.hashed = 0
+		self.copied = 0
+		self.present = 0
+		self._load()
+
+	def getDirectory(self):
+		return self._directory
+
+	def _manifestPath(self):
+		return os.path.join(self._directory, "manifest.json")
+
+	def _load(self):
+		try:
+			with open(self._manifestPath()) as f:
+				manifest = json.load(f)
+		except FileNotFoundError:
+			return
+		except Exception as e:
+			sys.stderr.write(f"WARN: broken asset manifest {self._manifestPath()}: {e}\n")
+			return
+		if type(manifest) == dict and manifest.get('format') == MANIFEST_FORMAT:
+			self._known = manifest.get('sources', {})
+
+	def _submit(self, function, *args):
+		# A pool of the parent is unusable in forked workers
+		if self._pool is None or self._pid != os.getpid():
+			self._pool = concurrent.futures.ThreadPoolExecutor(self._jobs, thread_name_prefix="assets")
+			self._pid = os.getpid()
+		return self._pool.submit(function, *args)
+
+	def _hash(self, path):
+		with self._lock:
+			future = self._hashes.get(path)
+			owner = future is None
+			if owner:
+				future = self._hashes[path] = concurrent.futures.Future()
+		if not owner:
+			return future.result()
+		try:
+			sha256 = self._hashSource(path)
+		except BaseException as e:
+			future.set_exception(e)
+			raise
+		future.set_result(sha256)
+		return sha256
+
+	def _unchanged(self, path, st):
+		"""Manifest entry of path in a previous export if it did not change since"""
+		known = self._known.get(path)
+		if known is not None and known.get('size') == st.st_size and known.get('mtime_ns') == st.st_mtime_ns:
+			return known
+		return None
+
+	def _isKnown(self, mesh):
+		"""Whether mesh and its references are unchanged since a previous export, preparing it reads no file"""
+		try:
+			known = self._unchanged(mesh, os.stat(mesh))
+			if known is None or 'references' not in known:
+				return False
+			for ref in known['references']:
+				path = os.path.normpath(os.path.join(os.path.dirname(mesh), ref))
+				if os.path.isfile(path) and self._unchanged(path, os.stat(path)) is None:
+					return False
+		except OSError:
+			return False
+		return True
+
+	def _hashSource(self, path):
+		st = os.stat(path)
+		known = self._unchanged(path, st)
+		if known is not None:
+			sha256 = known['sha256']
+		else:
+			sha256 = _sha256(path)
+			with self._lock:
+				self.hashed += 1
+		with self._lock:
+			self._sources[path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha256}
+		return sha256
+
+	def _scan(self, mesh, st):
+		"""References of a changed mesh, hashed from the same read"""
+		try:
+			with open(mesh, "rb") as f:
+				data = f.read()
+		except OSError:
+			return mesh_references(mesh)
+		sha256 = hashlib.sha256(data).hexdigest()
+		with self._lock:
+			if mesh not in self._hashes:
+				self._hashes[mesh] = concurrent.futures.Future()
+				self._hashes[mesh].set_result(sha256)
+				self._sources[mesh] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha256}
+				self.hashed += 1
+		return mesh_references(mesh, data)
+
+	def _prepare(self, mesh):
+		"""Asset path of mesh and the (source, asset path, sha256) files it needs"""
+		st = os.stat(mesh)
+		known = self._unchanged(mesh, st)
+		if known is not None and 'references' in known:
+			references = known['references']
+		elif os.path.splitext(mesh)[1].lower() in ('.dae', '.obj'):
+			references = self._scan(mesh, st)
+		else:
+			references = []
+		files = [mesh]
+		for ref in references:
+			path = os.path.normpath(os.path.join(os.path.dirname(mesh), ref))
+			if os.path.isfile(path):
+				files.append(path)
+			else:
+				sys.stderr.write(f"WARN: {mesh} references missing {ref}\n")
+		files = list(dict.fromkeys(files))
+		root = os.path.commonpath([os.path.dirname(path) for path in files])
+		relpaths = [os.path.relpath(path, root).replace(os.sep, '/') for path in files]
+		hashes = [self._hash(path) for path in files]
+		with self._lock:
+			self._sources[mesh]['references'] = references
+		key = hashlib.sha256("\n".join(sorted(f"{rel} {sha}" for rel, sha in zip(relpaths, hashes))).encode("utf-8")).hexdigest()[:16]
+		assets = [f"assets/{key}/{rel}" for rel in relpaths]
+		return assets[0], list(zip(files, assets, hashes))
+
+	def _makedirs(self, directory):
+		if directory not in self._created:
+			os.makedirs(directory, exist_ok=True)
+			self._created.add(directory)
+
+	def _store(self, source, sha256):
+		path = os.path.join(self._directory, "objects", sha256[:2], sha256)
+		if os.path.exists(path):
+			with self._lock:
+				self.present += 1
+			return path
+		self._makedirs(os.path.dirname(path))
+		tmpname = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		try:
+			if not _clone(source, tmpname, self._reflink):
+				self._reflink = False
+			# Objects are hard linked into assets, they are never written again
+			os.chmod(tmpname, 0o444)
+			os.replace(tmpname, path)
+		finally:
+			if os.path.exists(tmpname):
+				os.unlink(tmpname)
+		with self._lock:
+			self.copied += 1
+		return path
+
+	def _publish(self, objectFuture, asset):
+		obj = objectFuture.result()
+		path = os.path.join(self._directory, *asset.split('/'))
+		if os.path.exists(path) and os.path.samefile(obj, path):
+			return path
+		self._makedirs(os.path.dirname(path))
+		tmpname = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		_link(obj, tmpname)
+		os.replace(tmpname, path)
+		return path
+
+	def _schedule(self, tasks, pooled, function, *args):
+		"""Future of function, submitted to the pool if pooled or else added to tasks for _run()"""
+		if pooled and self._jobs > 1:
+			return self._submit(function, *args)
+		future = concurrent.futures.Future()
+		tasks.append((future, function, args))
+		return future
+
+	def prefetch(self, meshes):
+		"""Starts hashing meshes in the background, add() waits for them"""
+		meshes = [mesh for mesh in dict.fromkeys(meshes) if mesh not in self._meshes]
+		known = {mesh for mesh in meshes if self._isKnown(mesh)}
+		tasks = []
+		with self._lock:
+			for mesh in meshes:
+				if mesh not in self._meshes:
+					self._meshes[mesh] = self._schedule(tasks, mesh not in known, self._prepare, mesh)
+		# Outside of the lock, the tasks take it
+		_run(tasks)
+
+	def add(self, mesh):
+		self.prefetch([mesh])
+		asset, files = self._meshes[mesh].result()
+		tasks = []
+		with self._lock:
+			for source, path, sha256 in files:
+				if sha256 not in self._objects:
+					present = os.path.exists(os.path.join(self._directory, "objects", sha256[:2], sha256))
+					self._objects[sha256] = self._schedule(tasks, not present, self._store, source, sha256)
+				if path not in self._published:
+					# A link once the object is stored
+					stored = self._objects[sha256].done() or any(future is self._objects[sha256] for future, _, _ in tasks)
+					self._published[path] = self._schedule(tasks, not stored, self._publish, self._objects[sha256], path)
+					self._assets[path] = sha256
+			url = self._urls[mesh] = f"{self._uri}/{asset}"
+		_run(tasks)
+		return url
+
+	def getEntries(self):
+		"""Manifest entries of this exporter, see merge()"""
+		with self._lock:
+			return {'sources': dict(self._sources), 'assets': dict(self._assets), 'meshes': dict(self._urls),
+					'stats': {'hashed': self.hashed, 'copied': self.copied, 'present': self.present}}
+
+	def merge(self, entries):
+		"""Adds entries of an exporter of another process to the manifest"""
+		with self._lock:
+			self._sources.update(entries['sources'])
+			self._assets.update(entries['assets'])
+			self._urls.update(entries['meshes'])
+			self.hashed += entries['stats']['hashed']
+			self.copied += entries['stats']['copied']
+			self.present += entries['stats']['present']
+
+	def getStats(self):
+		with self._lock:
+			return {'assets': len(self._assets), 'hashed': self.hashed, 'copied': self.copied, 'present': self.present}
+
+	def clearStats(self):
+		with self._lock:
+			self.hashed = self.copied = self.present = 0
+
+	def finish(self, save=True):
+		"""Waits for pending copies, raises the first error, saves the manifest"""
+		with self._lock:
+			pending = list(self._published.values())
+		for future in pending:
+			future.result()
+		if save:
+			self.save()
+
+	def save(self):
+		manifest = {'format': MANIFEST_FORMAT, 'uri': self._uri, 'sources': {}, 'assets': {}, 'meshes': {}}
+		try: # merge with exports saved in between
+			with open(self._manifestPath()) as f:
+				previous = json.load(f)
+			if type(previous) == dict and previous.get('format') == MANIFEST_FORMAT:
+				for name in ('sources', 'assets', 'meshes'):
+					manifest[name].update(previous.get(name, {}))
+		except Exception:
+			pass
+		entries = self.getEntries()
+		for name in ('sources', 'assets', 'meshes'):
+			manifest[name].update(entries[name])
+		os.makedirs(self._directory, exist_ok=True)
+		tmpname = f"{self._manifestPath()}.{os.getpid()}.tmp"
+		with open(tmpname, "w") as f:
+			json.dump(manifest, f, indent=2, sort_keys=True)
+			f.write("\n")
+		os.replace(tmpname, self._manifestPath())
+
+# vim: ts=4 sw=4 noet
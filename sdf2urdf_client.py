@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+	Thin client of sdf2urdf_server.py, converts as sdf2urdf.py does without
+	starting the converter (imports, gazebo setup, material parsing).
+
+	./sdf2urdf_client.py [--socket PATH] input.sdf [output.urdf]
+	./sdf2urdf_client.py [--socket PATH] --stats
+"""
+import os
+import sys
+import json
+import socket
+
+
+def default_socket_path():
+	path = os.getenv('SDF2URDF_SOCKET')
+	if path:
+		return path
+	runtime = os.getenv('XDG_RUNTIME_DIR')
+	if runtime:
+		return os.path.join(runtime, 'sdf2urdf.sock')
+	return os.path.join('/tmp', f'sdf2urdf-{os.getuid()}.sock')
+
+
+class ConversionClient:
+	"""Line delimited JSON requests over the server's unix socket"""
+	def __init__(self, path=None):
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self._socket.connect(path or default_socket_path())
+		self._reader = self._socket.makefile("r", encoding="utf-8")
+		self._lastId = 0
+
+	def request(self, op, **kwargs):
+		self._lastId += 1
+		request = dict(kwargs, id=self._lastId, op=op)
+		self._socket.sendall((json.dumps(request) + "\n").encode("utf-8"))
+		line = self._reader.readline()
+		if not line:
+			raise Exception("Connection closed by the server")
+		return json.loads(line)
+
+	def close(self):
+		self._reader.close()
+		self._socket.close()
+
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Converts gazebo's sdf to urdf with a running sdf2urdf_server.py")
+	parser.add_argument('input', nargs='?', help="input.sdf")
+	parser.add_argument('output', nargs='?', help="output.urdf")
+	parser.add_argument('--socket', default=None, help=f"server socket (default: {default_socket_path()})")
+	parser.add_argument('--stream', action='store_true', help="convert link by link with bounded memory")
+	parser.add_argument('--tree-backend', choices=['minidom', 'etree'], default=None)
+	parser.add_argument('--stats', action='store_true', help="print server statistics and exit")
+	args = parser.parse_args()
+
+	client = ConversionClient(args.socket)
+	if args.stats:
+		response = client.request('stats')
+		json.dump(response.get('stats'), sys.stdout, indent=2)
+		sys.stdout.write("\n")
+		exit(0)
+	if args.input is None:
+		parser.error("the following arguments are required: input")
+	if args.output is not None and os.path.realpath(args.input) == os.path.realpath(args.output):
+		raise Exception("Input and output filenames is the same file")
+
+	response = client.request('convert', path=os.path.abspath(args.input),
+			stream=args.stream, tree_backend=args.tree_backend)
+	sys.stderr.write(response.get('warnings', ''))
+	if not response.get('ok'):
+		sys.stderr.write(f"{response.get('error')}\n")
+		exit(1)
+	output = sys.stdout
+	if args.output is not None:
+		output = open(args.output, "w")
+	output.write(response['urdf'])
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+	Pose resolution of sdf models before conversion: poses of links, joints,
+	visuals, collisions, inertials, <frame>s and nested models are composed
+	into the model frame following their frame / relative_to attributes,
+	then rewritten as urdf expects them:
+
+		joint      origin relative to the (urdf) frame of the parent link
+		visual,    origin relative to the frame of the link, which is the
+		collision, frame of the joint it is the child of (its own frame
+		inertial   for the root link)
+		axis       xyz in the joint frame
+
+	Link, nested model poses and <frame>s are folded into these and removed.
+	All frames are composed level by level of the frame tree in batch, with
+	NumPy when it is installed and in plain python otherwise.
+"""
+import sys
+import math
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+# Poses closer than that to the original are left as written
+_TOLERANCE = 1e-9
+_POSED = ('visual', 'collision', 'inertial')
+
+
+def _rpy_to_rotation(roll, pitch, yaw):
+	"""Rows of Rz(yaw) Ry(pitch) Rx(roll)"""
+	cr, sr = math.cos(roll), math.sin(roll)
+	cp, sp = math.cos(pitch), math.sin(pitch)
+	cy, sy = math.cos(yaw), math.sin(yaw)
+	return (cy*cp, cy*sp*sr - sy*cr, cy*sp*cr + sy*sr,
+			sy*cp, sy*sp*sr + cy*cr, sy*sp*cr - cy*sr,
+			-sp,   cp*sr,            cp*cr)
+
+def _rotation_to_rpy(r00, r01, r02, r10, r11, r12, r20, r21, r22):
+	if abs(r20) < 1.0 - 1e-12:
+		return math.atan2(r21, r22), math.asin(max(-1.0, min(1.0, -r20))), math.atan2(r10, r00)
+	# Gimbal lock, roll and yaw turn around the same axis
+	return math.atan2(-r12, r11), -math.copysign(math.pi / 2, r20), 0.0
+
+def _quaternion_to_rpy(x, y, z, w):
+	norm = math.sqrt(x*x + y*y + z*z + w*w) or 1.0
+	x, y, z, w = x/norm, y/norm, z/norm, w/norm
+	return _rotation_to_rpy(
+			1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w),
+			2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w),
+			2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y))
+
+
+class PythonMath:
+	"""Batches of rigid transforms as lists of (rotation rows, translation) 12-tuples"""
+	name = 'python'
+
+	def fromPoses(self, poses):
+		return [_rpy_to_rotation(*pose[3:]) + tuple(pose[:3]) for pose in poses]
+
+	def toPoses(self, transforms):
+		return [(t[9], t[10], t[11]) + _rotation_to_rpy(*t[:9]) for t in transforms]
+
+	@staticmethod
+	def _compose(a, b):
+		return (a[0]*b[0] + a[1]*b[3] + a[2]*b[6], a[0]*b[1] + a[1]*b[4] + a[2]*b[7], a[0]*b[2] + a[1]*b[5] + a[2]*b[8],
+				a[3]*b[0] + a[4]*b[3] + a[5]*b[6], a[3]*b[1] + a[4]*b[4] + a[5]*b[7], a[3]*b[2] + a[4]*b[5] + a[5]*b[8],
+				a[6]*b[0] + a[7]*b[3] + a[8]*b[6], a[6]*b[1] + a[7]*b[4] + a[8]*b[7], a[6]*b[2] + a[7]*b[5] + a[8]*b[8],
+				a[0]*b[9] + a[1]*b[10] + a[2]*b[11] + a[9],
+				a[3]*b[9] + a[4]*b[10] + a[5]*b[11] + a[10],
+				a[6]*b[9] + a[7]*b[10] + a[8]*b[11] + a[11])
+
+	@staticmethod
+	def _inverse(a):
+		return (a[0], a[3], a[6], a[1], a[4], a[7], a[2], a[5], a[8],
+				-(a[0]*a[9] + a[3]*a[10] + a[6]*a[11]),
+				-(a[1]*a[9] + a[4]*a[10] + a[7]*a[11]),
+				-(a[2]*a[9] + a[5]*a[10] + a[8]*a[11]))
+
+	def composeLevels(self, local, parents, levels):
+		"""Transforms in the root frame of local ones relative to parents, level by level"""
+		absolute = list(local)
+		for level in levels[1:]:
+			for i in level:
+				absolute[i] = self._compose(absolute[parents[i]], local[i])
+		return absolute
+
+	def relative(self, transforms, frames, targets):
+		"""transforms[frame]^-1 transforms[target] for each pair"""
+		return [self._compose(self._inverse(transforms[a]), transforms[b]) for a, b in zip(frames, targets)]
+
+	def rotate(self, transforms, vectors):
+		return [(t[0]*v[0] + t[1]*v[1] + t[2]*v[2], t[3]*v[0] + t[4]*v[1] + t[5]*v[2], t[6]*v[0] + t[7]*v[1] + t[8]*v[2])
+				for t, v in zip(transforms, vectors)]
+
+
+class NumpyMath:
+	"""Batches of rigid transforms as (N, 4, 4) arrays"""
+	name = 'numpy'
+
+	def fromPoses(self, poses):
+		poses = numpy.asarray(poses, dtype=float).reshape(-1, 6)
+		cr, sr = numpy.cos(poses[:, 3]), numpy.sin(poses[:, 3])
+		cp, sp = numpy.cos(poses[:, 4]), numpy.sin(poses[:, 4])
+		cy, sy = numpy.cos(poses[:, 5]), numpy.sin(poses[:, 5])
+		transforms = numpy.zeros((len(poses), 4, 4))
+		transforms[:, 0, 0], transforms[:, 0, 1], transforms[:, 0, 2] = cy*cp, cy*sp*sr - sy*cr, cy*sp*cr + sy*sr
+		transforms[:, 1, 0], transforms[:, 1, 1], transforms[:, 1, 2] = sy*cp, sy*sp*sr + cy*cr, sy*sp*cr - cy*sr
+		transforms[:, 2, 0], transforms[:, 2, 1], transforms[:, 2, 2] = -sp, cp*sr, cp*cr
+		transforms[:, :3, 3] = poses[:, :3]
+		transforms[:, 3, 3] = 1.0
+		return transforms
+
+	def toPoses(self, transforms):
+		r = transforms[:, :3, :3]
+		locked = numpy.abs(r[:, 2, 0]) >= 1.0 - 1e-12
+		roll = numpy.where(locked, numpy.arctan2(-r[:, 1, 2], r[:, 1, 1]), numpy.arctan2(r[:, 2, 1], r[:, 2, 2]))
+		pitch = numpy.where(locked, -numpy.copysign(numpy.pi / 2, r[:, 2, 0]), numpy.arcsin(numpy.clip(-r[:, 2, 0], -1.0, 1.0)))
+		yaw = numpy.where(locked, 0.0, numpy.arctan2(r[:, 1, 0], r[:, 0, 0]))
+		return numpy.column_stack((transforms[:, :3, 3], roll, pitch, yaw)).tolist()
+
+	@staticmethod
+	def _inverse(a):
+		inverse = numpy.zeros_like(a)
+		rt = numpy.swapaxes(a[:, :3, :3], 1, 2)
+		inverse[:, :3, :3] = rt
+		inverse[:, :3, 3] = -numpy.einsum('nij,nj->ni', rt, a[:, :3, 3])
+		inverse[:, 3, 3] = 1.0
+		return inverse
+
+	def composeLevels(self, local, parents, levels):
+		absolute = local.copy()
+		parents = numpy.asarray(parents)
+		for level in levels[1:]:
+			level = numpy.asarray(level)
+			absolute[level] = absolute[parents[level]] @ local[level]
+		return absolute
+
+	def relative(self, transforms, frames, targets):
+		if not len(frames):
+			return numpy.zeros((0, 4, 4))
+		return self._inverse(transforms[numpy.asarray(frames)]) @ transforms[numpy.asarray(targets)]
+
+	def rotate(self, transforms, vectors):
+		if not len(vectors):
+			return []
+		return numpy.einsum('nij,nj->ni', transforms[:, :3, :3], numpy.asarray(vectors, dtype=float)).tolist()
+
+
+def default_math():
+	return NumpyMath() if numpy is not None else PythonMath()
+
+
+class _DomTree:
+	"""minidom access for the resolver"""
+	def root(self, document):
+		return document.documentElement if document.nodeType == document.DOCUMENT_NODE else document
+
+	def children(self, elem):
+		return [c for c in elem.childNodes if c.nodeType == c.ELEMENT_NODE]
+
+	def tag(self, elem):
+		return elem.tagName
+
+	def get(self, elem, name):
+		return elem.getAttribute(name) if elem.hasAttribute(name) else None
+
+	def remove(self, elem, name):
+		if elem.hasAttribute(name):
+			elem.removeAttribute(name)
+
+	def text(self, elem):
+		return "".join(c.data for c in elem.childNodes if c.nodeType in (c.TEXT_NODE, c.CDATA_SECTION_NODE))
+
+	def setText(self, elem, text):
+		for c in elem.childNodes[:]:
+			elem.removeChild(c)
+		elem.appendChild(elem.ownerDocument.createTextNode(text))
+
+	def removeChild(self, parent, elem):
+		parent.removeChild(elem)
+
+	def insertFirst(self, parent, tag, elem=None):
+		if elem is None:
+			elem = parent.ownerDocument.createElement(tag)
+		else:
+			parent.removeChild(elem)
+		parent.insertBefore(elem, parent.firstChild)
+		return elem
+
+class _EtreeTree:
+	"""ElementTree and lxml.etree access for the resolver"""
+	def root(self, document):
+		return document.getroot() if hasattr(document, 'getroot') else document
+
+	def children(self, elem):
+		return [c for c in elem if isinstance(c.tag, str)]
+
+	def tag(self, elem):
+		return elem.tag
+
+	def get(self, elem, name):
+		return elem.get(name)
+
+	def remove(self, elem, name):
+		elem.attrib.pop(name, None)
+
+	def text(self, elem):
+		return elem.text or ''
+
+	def setText(self, elem, text):
+		elem.text = text
+
+	def removeChild(self, parent, elem):
+		parent.remove(elem)
+		# Whitespace left alone is dropped as minidom's whitespace nodes are
+		if not len(parent) and parent.text is not None and not parent.text.strip():
+			parent.text = None
+
+	def insertFirst(self, parent, tag, elem=None):
+		if elem is None:
+			elem = parent.makeelement(tag, {})
+		else:
+			parent.remove(elem)
+		parent.insert(0, elem)
+		return elem
+
+
+def _tree(document):
+	return _DomTree() if hasattr(document, 'nodeType') else _EtreeTree()
+
+def format_pose(pose):
+	return " ".join('0' if abs(v) < 1e-12 else f"{v:.12g}" for v in pose)
+
+
+class PoseResolver:
+	"""
+		Frames of one <model> (and its nested models), see the module
+		docstring. resolve() composes them with backend (PythonMath or
+		NumpyMath, default_math() when None) and rewrites the tree in place.
+	"""
+	def __init__(self, document, backend=None):
+		self._tree = _tree(document)
+		self._math = backend if backend is not None else default_math()
+		self._root = self._tree.root(document)
+		version = self._tree.get(self._root, 'version') or '1.6'
+		try:
+			self._version = tuple(int(v) for v in version.split('.')[:2])
+		except ValueError:
+			self._version = (1, 6)
+		# Frame i: local pose relative to parents[i], index 0 is the root model
+		self._poses = [(0.0,)*6]
+		self._parents = [-1]
+		self._targets = [None]   # relative_to name of not yet resolved parents
+		self._elements = [(None, None, None)] # (element, kind, pose element)
+		self._names = {'__model__': 0, 'world': 0} # world is the root model as its pose is dropped
+		self._links = {}    # scoped link name -> frame
+		self._joints = []   # (frame, scoped parent, scoped child, axis element, model frame)
+		self._owned = []    # (frame, link frame) of visuals, collisions and inertials
+		self._removed = []  # (parent, element) to remove
+
+	def _pose(self, poseElem):
+		if poseElem is None:
+			return (0.0,)*6
+		values = [float(v) for v in self._tree.text(poseElem).split()] or [0.0]*6
+		if (self._tree.get(poseElem, 'degrees') or '').strip() in ('true', '1'):
+			values = values[:3] + [math.radians(v) for v in values[3:]]
+		if len(values) == 7 and self._tree.get(poseElem, 'rotation_format') == 'quat_xyzw':
+			values = values[:3] + list(_quaternion_to_rpy(*values[3:]))
+		if len(values) != 6:
+			raise Exception(f"Invalid pose: {self._tree.text(poseElem)!r}")
+		return tuple(values)
+
+	def _add(self, elem, kind, scope, parent, name=None):
+		poseElem = None
+		for c in self._tree.children(elem):
+			if self._tree.tag(c) == 'pose':
+				poseElem = c
+				break
+		target = None
+		if poseElem is not None:
+			target = self._tree.get(poseElem, 'relative_to') or self._tree.get(poseElem, 'frame') or None
+		if target is not None:
+			target = (target, scope)
+		elif type(parent) == str:
+			target, parent = (parent, scope), None
+		index = len(self._poses)
+		self._poses.append(self._pose(poseElem))
+		self._parents.append(parent if target is None else None)
+		self._targets.append(target)
+		self._elements.append((elem, kind, poseElem))
+		if name is not None:
+			self._names[scope + name] = index
+		return index
+
+	def gather(self, model, scope='', frame=0):
+		tree = self._tree
+		self._names[scope + '__model__'] = frame
+		for c in tree.children(model):
+			tag, name = tree.tag(c), tree.get(c, 'name') or ''
+			if tag == 'link':
+				link = self._add(c, 'link', scope, frame, name)
+				self._links[scope + name] = link
+				for p in tree.children(c):
+					if tree.tag(p) in _POSED:
+						self._owned.append((self._add(p, tree.tag(p), scope, link), link))
+			elif tag == 'joint':
+				child = parent = axis = None
+				for p in tree.children(c):
+					if tree.tag(p) == 'child':
+						child = scope + tree.text(p).strip()
+					elif tree.tag(p) == 'parent':
+						parent = scope + tree.text(p).strip()
+					elif tree.tag(p) == 'axis':
+						axis = p
+				joint = self._add(c, 'joint', scope, child[len(scope):] if child else frame, name)
+				self._joints.append((joint, parent, child, axis, frame))
+			elif tag == 'frame':
+				attached = (tree.get(c, 'attached_to') or '').strip()
+				self._add(c, 'frame', scope, attached or frame, name)
+				self._removed.append((model, c))
+			elif tag == 'model':
+				nested = self._add(c, 'model', scope, frame, name)
+				self.gather(c, scope + name + '::', nested)
+
+	def _lookup(self, name, scope):
+		for key in (scope + name, name):
+			if key in self._names:
+				return self._names[key]
+		return None
+
+	def _levels(self):
+		"""Resolves relative_to names, returns frames grouped by depth"""
+		parents = self._parents
+		for i, target in enumerate(self._targets):
+			if target is not None:
+				parent = self._lookup(*target)
+				if parent is None:
+					sys.stderr.write(f"WARN: unknown pose frame {target[0]!r}, using the model frame\n")
+					parent = self._names[target[1] + '__model__']
+				parents[i] = parent
+		depths = [None] * len(parents)
+		depths[0] = 0
+		for i in range(len(parents)):
+			chain, seen = [], set()
+			while depths[i] is None:
+				if i in seen:
+					names = [self._tree.get(self._elements[c][0], 'name') for c in chain[chain.index(i):]]
+					raise Exception(f"Cycle in pose frames: {' -> '.join(str(n) for n in names)}")
+				chain.append(i)
+				seen.add(i)
+				i = parents[i]
+			depth = depths[i]
+			for c in reversed(chain):
+				depth += 1
+				depths[c] = depth
+		levels = [[] for _ in range(max(depths) + 1)]
+		for i, depth in enumerate(depths):
+			levels[depth].append(i)
+		return levels
+
+	def resolve(self):
+		model = None
+		for c in self._tree.children(self._root):
+			if self._tree.tag(c) == 'model':
+				model = c
+				break
+		if model is None:
+			return
+		self.gather(model)
+		mathlib = self._math
+		local = mathlib.fromPoses(self._poses)
+		absolute = mathlib.composeLevels(local, self._parents, self._levels())
+
+		# Urdf frame of a link is the frame of the joint it is the child of
+		frames = {link: link for link in self._links.values()}
+		for joint, parent, child, axis, model in self._joints:
+			if child in self._links:
+				frames[self._links[child]] = joint
+		pairs = [(frames.get(self._links.get(parent), 0), joint) for joint, parent, child, axis, model in self._joints]
+		pairs += [(frames[link], owned) for owned, link in self._owned]
+		resolved = mathlib.toPoses(mathlib.relative(absolute, [a for a, b in pairs], [b for a, b in pairs]))
+		original = mathlib.toPoses(mathlib.fromPoses([self._poses[b] for a, b in pairs]))
+		for (frame, target), pose, before in zip(pairs, resolved, original):
+			elem, kind, poseElem = self._elements[target]
+			self._writePose(elem, kind, poseElem, pose, before)
+
+		# Axes expressed in the model frame are rotated into the joint frame
+		rotated = [(joint, model, axis) for joint, parent, child, axis, model in self._joints if self._inModelFrame(axis)]
+		if rotated:
+			rotations = mathlib.relative(absolute, [joint for joint, model, axis in rotated], [model for joint, model, axis in rotated])
+			vectors = [self._axis(axis) for joint, model, axis in rotated]
+			for (joint, model, axis), vector in zip(rotated, mathlib.rotate(rotations, vectors)):
+				self._writeAxis(axis, vector)
+
+		for elem, kind, poseElem in self._elements[1:]:
+			if kind in ('link', 'model', 'frame') and poseElem is not None:
+				self._removed.append((elem, poseElem))
+		for parent, elem in self._removed:
+			self._tree.removeChild(parent, elem)
+
+	def _writePose(self, elem, kind, poseElem, pose, before):
+		tree = self._tree
+		if poseElem is not None:
+			for name in ('frame', 'relative_to', 'degrees', 'rotation_format'):
+				tree.remove(poseElem, name)
+			if any(abs(a - b) > _TOLERANCE for a, b in zip(pose, before)) or len(tree.text(poseElem).split()) != 6:
+				tree.setText(poseElem, format_pose(pose))
+		elif kind == 'joint' or any(abs(v) > _TOLERANCE for v in pose):
+			poseElem = tree.insertFirst(elem, 'pose')
+			tree.setText(poseElem, format_pose(pose))
+		# The converter expects a joint's origin before its axis
+		if kind == 'joint' and tree.children(elem)[0] is not poseElem:
+			tree.insertFirst(elem, 'pose', poseElem)
+
+	def _xyz(self, axis):
+		for c in self._tree.children(axis):
+			if self._tree.tag(c) == 'xyz':
+				return c
+		return None
+
+	def _inModelFrame(self, axis):
+		if axis is None or self._xyz(axis) is None:
+			return False
+		if self._version < (1, 5):
+			return True
+		for c in self._tree.children(axis):
+			if self._tree.tag(c) == 'use_parent_model_frame':
+				return self._tree.text(c).strip() in ('1', 'true')
+		return self._tree.get(self._xyz(axis), 'expressed_in') == '__model__'
+
+	def _axis(self, axis):
+		return tuple(float(v) for v in self._tree.text(self._xyz(axis)).split())
+
+	def _writeAxis(self, axis, vector):
+		tree = self._tree
+		xyz = self._xyz(axis)
+		tree.remove(xyz, 'expressed_in')
+		tree.setText(xyz, format_pose(vector))
+		for c in tree.children(axis):
+			if tree.tag(c) == 'use_parent_model_frame':
+				tree.removeChild(axis, c)
+
+
+def resolve_poses(document, backend=None):
+	"""Resolves the poses of the model of a parsed sdf (minidom or etree) in place"""
+	PoseResolver(document, backend).resolve()
+
+# vim: ts=4 sw=4 noet
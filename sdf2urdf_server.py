@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+	Conversion server: a pool of worker processes keeps imports, gazebo
+	setup, parsed material files and resolved uris warm between requests.
+
+	./sdf2urdf_server.py [--socket PATH | --stdio] [-j N]
+
+	Requests and responses are JSON objects, one per line:
+		{"id": 1, "op": "convert", "path": "model.sdf"}  or  "sdf": "<sdf>...</sdf>"
+			optional "stream": true, "tree_backend": "etree"
+		-> {"id": 1, "ok": true, "urdf": "...", "warnings": "...", "elapsed": 0.012}
+		{"id": 2, "op": "stats"} -> {"id": 2, "ok": true, "stats": {...}}
+		{"id": 3, "op": "reload"} restarts workers with empty caches
+	Requests of a connection are converted concurrently and answered in
+	the order they finish, "id" is copied into the response.
+"""
+import io
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import collections
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+import sdf2urdf
+from sdf2urdf_client import default_socket_path
+
+
+def _worker_convert(request):
+	stderr, sys.stderr = sys.stderr, io.StringIO()
+	urdf, error = None, None
+	try:
+		backend = request.get('tree_backend')
+		if request.get('sdf') is None and not os.path.isfile(request['path']):
+			raise FileNotFoundError(f"No such file: {request['path']}")
+		if request.get('sdf') is not None:
+			urdf = sdf2urdf.convert_string(request['sdf'], backend)
+		elif request.get('stream'):
+			output = io.StringIO()
+			sdf2urdf.stream_convert_file(request['path'], output, backend)
+			urdf = output.getvalue()
+		else:
+			urdf = sdf2urdf.convert_file(request['path'], backend)
+		sdf2urdf.default_session().getResourceIndex().save()
+	except Exception as e:
+		error = f"{e.__class__.__name__}: {e}"
+	finally:
+		warnings, sys.stderr = sys.stderr.getvalue(), stderr
+	return os.getpid(), urdf, error, warnings, sdf2urdf.default_session().getStats()
+
+def percentile(values, p):
+	"""Nearest rank percentile of sorted values"""
+	if not values:
+		return None
+	return values[min(len(values)-1, max(0, int(round(p/100.0*len(values)+0.5))-1))]
+
+
+class ConversionServer:
+	"""
+		Dispatches convert requests to the worker pool and keeps request
+		counters, latencies of the recent requests and cache counters
+		reported by the workers.
+	"""
+	def __init__(self, jobs=None, history=10000):
+		self._jobs = jobs or os.cpu_count() or 1
+		self._lock = threading.Lock()
+		self._latencies = collections.deque(maxlen=history)
+		self._counters = collections.Counter()
+		self._workerStats = {}
+		self._started = time.monotonic()
+		self._pool = self._startPool()
+
+	def _startPool(self):
+		from multiprocessing import Pool
+		return Pool(processes=self._jobs)
+
+	def reload(self):
+		with self._lock:
+			pool, self._pool = self._pool, self._startPool()
+			self._workerStats = {}
+		pool.close()
+
+	def close(self):
+		# Pending conversions are dropped
+		self._pool.terminate()
+		self._pool.join()
+
+	def stats(self):
+		with self._lock:
+			latencies = sorted(self._latencies)
+			cache = collections.Counter()
+			for counters in self._workerStats.values():
+				cache.update(counters)
+			counters = dict(self._counters)
+		return {
+			'uptime': round(time.monotonic() - self._started, 3),
+			'workers': self._jobs,
+			'requests': counters.get('requests', 0),
+			'converted': counters.get('converted', 0),
+			'failed': counters.get('failed', 0),
+			'pending': counters.get('requests', 0) - counters.get('converted', 0) - counters.get('failed', 0),
+			'cache': dict(cache),
+			'latency_ms': {name: None if value is None else round(value*1000, 3) for name, value in (
+				('p50', percentile(latencies, 50)),
+				('p90', percentile(latencies, 90)),
+				('p99', percentile(latencies, 99)),
+				('max', latencies[-1] if latencies else None))},
+		}
+
+	def handle(self, request, respond):
+		"""Answers request with respond(dict), convert requests asynchronously"""
+		if type(request) != dict:
+			respond({'ok': False, 'error': "Request is not a JSON object"})
+			return
+		rid, op = request.get('id'), request.get('op', 'convert')
+		if op == 'stats':
+			respond({'id': rid, 'ok': True, 'stats': self.stats()})
+		elif op == 'ping':
+			respond({'id': rid, 'ok': True})
+		elif op == 'reload':
+			self.reload()
+			respond({'id': rid, 'ok': True})
+		elif op != 'convert':
+			respond({'id': rid, 'ok': False, 'error': f"Unknown op: {op}"})
+		elif request.get('path') is None and request.get('sdf') is None:
+			respond({'id': rid, 'ok': False, 'error': "convert requires path or sdf"})
+		else:
+			if request.get('path') is not None:
+				request['path'] = os.path.abspath(request['path'])
+			self._convert(rid, request, respond)
+
+	def _convert(self, rid, request, respond):
+		started = time.monotonic()
+
+		def done(result):
+			pid, urdf, error, warnings, cache = result
+			elapsed = time.monotonic() - started
+			with self._lock:
+				self._counters['converted' if error is None else 'failed'] += 1
+				self._latencies.append(elapsed)
+				self._workerStats[pid] = cache
+			response = {'id': rid, 'ok': error is None, 'warnings': warnings, 'elapsed': round(elapsed, 6)}
+			if error is None:
+				response['urdf'] = urdf
+			else:
+				response['error'] = error
+			respond(response)
+
+		def failed(e):
+			with self._lock:
+				self._counters['failed'] += 1
+			respond({'id': rid, 'ok': False, 'error': f"{e.__class__.__name__}: {e}"})
+
+		with self._lock:
+			self._counters['requests'] += 1
+			pool = self._pool
+		pool.apply_async(_worker_convert, (request,), callback=done, error_callback=failed)
+
+	def serveLines(self, reader, write):
+		"""
+			Reads requests from reader until EOF, write(text) sends a line,
+			returns when all the requests are answered.
+		"""
+		lock, pending = threading.Condition(), [0]
+
+		def respond(response):
+			line = json.dumps(response) + "\n"
+			with lock:
+				try:
+					write(line)
+				except OSError:
+					pass # client has gone
+				pending[0] -= 1
+				lock.notify_all()
+
+		for line in reader:
+			if not line.strip():
+				continue
+			with lock:
+				pending[0] += 1
+			try:
+				request = json.loads(line)
+			except ValueError as e:
+				respond({'ok': False, 'error': f"Bad request: {e}"})
+				continue
+			self.handle(request, respond)
+		with lock:
+			lock.wait_for(lambda: pending[0] == 0)
+
+	def serveStdio(self):
+		def write(line):
+			sys.stdout.write(line)
+			sys.stdout.flush()
+		self.serveLines(sys.stdin, write)
+
+	def serveSocket(self, path):
+		import socket
+		import socketserver
+
+		server = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				reader = io.TextIOWrapper(self.rfile, encoding="utf-8")
+				server.serveLines(reader, lambda line: self.wfile.write(line.encode("utf-8")))
+
+		if os.path.exists(path):
+			probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				probe.connect(path)
+				raise Exception(f"Server is already running at {path}")
+			except (ConnectionRefusedError, FileNotFoundError):
+				os.unlink(path) # stale socket
+			finally:
+				probe.close()
+
+		with socketserver.ThreadingUnixStreamServer(path, Handler) as listener:
+			listener.daemon_threads = True
+			sys.stderr.write(f"Listening on {path} with {self._jobs} workers\n")
+			try:
+				listener.serve_forever()
+			except KeyboardInterrupt:
+				pass
+			finally:
+				os.unlink(path)
+
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Serves sdf to urdf conversions with warm caches.")
+	parser.add_argument('--socket', default=None, help=f"unix socket to listen on (default: {default_socket_path()})")
+	parser.add_argument('--stdio', action='store_true', help="serve line delimited JSON on stdin/stdout")
+	parser.add_argument('-j', '--jobs', type=int, default=None, help="number of workers (default: cpu count)")
+	args = parser.parse_args()
+
+	# Environment is inherited by workers
+	sdf2urdf.load_gazebo_setup()
+	# Clean up the socket on kill as on Ctrl-C
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	server = ConversionServer(args.jobs)
+	try:
+		if args.stdio:
+			server.serveStdio()
+		else:
+			server.serveSocket(args.socket or default_socket_path())
+	finally:
+		server.close()
+
+if __name__ == '__main__':
+	main()
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import sdf2urdf
+
+GREY = """
+material Gazebo/Grey
+{
+  technique
+  {
+    pass main
+    {
+      ambient .3 .3 .3  1.0
+      diffuse .7 .7 .7  1.0
+    }
+  }
+}
+material Gazebo/Gray : Gazebo/Grey
+{
+}
+"""
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+	"""Session without the material cache, file://media/materials/scripts/gazebo.material in tmp_path"""
+	scripts = tmp_path / 'gazebo' / 'media' / 'materials' / 'scripts'
+	scripts.mkdir(parents=True)
+	(scripts / 'gazebo.material').write_text(GREY)
+	monkeypatch.setenv('GAZEBO_RESOURCE_PATH', str(tmp_path / 'gazebo'))
+	monkeypatch.setenv('GAZEBO_MODEL_PATH', str(tmp_path / 'models'))
+	return sdf2urdf.ConversionSession(settings=sdf2urdf.ConversionSettings(noCache=True))
+
+# vim: ts=4 sw=4 noet
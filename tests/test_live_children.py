@@ -0,0 +1,52 @@
+"""
+	Rules removing children while iterating them skip every other one
+	(see _live_iter), the urdf of such inputs is pinned here.
+"""
+import pytest
+
+import sdf2urdf
+
+SDF = """<?xml version='1.0'?>
+<sdf version='1.6'><model name='q'><link name='a'>
+<inertial><mass><x/><y/><z/><w/></mass></inertial>
+<visual name='v'><material><script><name>Gazebo/Grey</name><uri>file://media/materials/scripts/gazebo.material</uri></script><script><name>Gazebo/Gray</name><uri>file://media/materials/scripts/gazebo.material</uri></script><lighting>0</lighting></material></visual>
+</link></model></sdf>
+"""
+
+URDF = """<?xml version="1.0" ?>
+<robot name="q">
+  <link name="a">
+    <inertial>
+      <mass value="&lt;x/&gt;">
+        <y/>
+        <w/>
+      </mass>
+    </inertial>
+    <visual>
+      <material name="Gazebo/Grey">
+        <script>
+          <name>Gazebo/Gray</name>
+          <uri>file://media/materials/scripts/gazebo.material</uri>
+        </script>
+        <lighting>0</lighting>
+      </material>
+    </visual>
+  </link>
+  <material name="Gazebo/Grey">
+    <color rgba=".3 .3 .3 1.0"/>
+  </material>
+</robot>
+"""
+
+
+def test_live_iter_skips_after_removal():
+	children = list(range(7))
+	for child in sdf2urdf._live_iter(children):
+		children.remove(child)
+	assert children == [1, 3, 5]
+
+@pytest.mark.parametrize('tree_backend', sdf2urdf.TREE_BACKENDS)
+def test_every_other_child_kept(session, tree_backend):
+	assert session.convertString(SDF, tree_backend) == URDF
+
+# vim: ts=4 sw=4 noet
@@ -0,0 +1,63 @@
+"""
+	Both material parser backends should build the same trees, see
+	gazebo_backends_test(): on the sample content, generated scripts,
+	the scripts of GAZEBO_RESOURCE_PATH when installed and malformed ones.
+	So should the first match grammar of pyparsing and the longest match
+	one it replaced.
+"""
+import glob
+import os
+
+import pytest
+
+import GazeboMaterial
+from GazeboMaterial.GazeboMaterialFile import BACKENDS, GazeboMaterialFile, _build_tokenizer
+from benchmarks.generators import material_file, inheritance_file
+
+MALFORMED = {
+	'unclosed_block': "material A\n{\n  technique\n  {\n    pass\n    {\n      ambient 1 0 0 1\n",
+	'stray_brace': "}\nmaterial A\n{\n  ambient 1 0 0 1\n}\n}\n",
+	'unterminated_comment': "material A\n{\n  /* ambient 1 0 0 1\n}\n",
+	'unterminated_string': "import * from \"grid.material\nmaterial A\n{\n}\n",
+	'missing_parent': "material B : A\n{\n}\n",
+	'inheritance_cycle': "material A : B\n{\n}\nmaterial B : A\n{\n}\n",
+	'option_without_newline': "material A { ambient 1 0 0 1 }",
+	'empty': "",
+}
+
+
+def sources():
+	yield 'sample', GazeboMaterial._getTestContent()
+	yield 'generated', material_file(20, 3)
+	yield 'inheritance', inheritance_file(4, 3, 2)
+	for path in os.getenv('GAZEBO_RESOURCE_PATH', '').split(':'):
+		for filename in sorted(glob.glob(os.path.join(path, 'media', 'materials', 'scripts', '*.material')) if path else []):
+			with open(filename) as f:
+				yield filename, f.read()
+	yield from MALFORMED.items()
+	yield from GazeboMaterial._mutatedContent(GazeboMaterial._getTestContent(), 20)
+
+SOURCES = dict(sources())
+
+
+@pytest.mark.parametrize('name', SOURCES)
+def test_backends_build_same_tree(name):
+	trees = GazeboMaterial._backend_trees(name, SOURCES[name])
+	for backend in BACKENDS:
+		assert trees[backend] == trees[BACKENDS[0]], backend
+
+@pytest.fixture(scope='module')
+def longest_match():
+	return _build_tokenizer(longest_match=True)
+
+@pytest.mark.parametrize('name', SOURCES)
+def test_first_match_grammar_builds_same_tree(name, longest_match):
+	trees = []
+	for tokenizer in (None, longest_match):
+		gzMaterial = GazeboMaterialFile(name, cache=False, backend='pyparsing', inherit=False)
+		gzMaterial._tokenizer = tokenizer
+		gzMaterial._parse(SOURCES[name])
+		trees.append(GazeboMaterial._tree_signature(gzMaterial._root))
+	assert trees[0] == trees[1]
+
+# vim: ts=4 sw=4 noet
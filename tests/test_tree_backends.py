@@ -0,0 +1,53 @@
+import io
+import os
+
+import pytest
+
+import sdf2urdf
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'examples', 'example001.sdf')
+MODEL = "<sdf version='1.6'><model name='m'><link name='a'/></model></sdf>\n"
+INPUTS = {
+	'example': open(EXAMPLE).read(),
+	'model': "<?xml version='1.0'?>\n" + MODEL,
+	'trailing_comment': "<?xml version='1.0'?>\n" + MODEL + "<!-- trailing -->\n",
+	'leading_comment': "<?xml version='1.0'?>\n<!-- leading -->\n" + MODEL,
+	'leading_pi': "<?xml version='1.0'?>\n<?target data?>\n" + MODEL,
+	'comment_first': "<!-- leading -->" + MODEL,
+	'not_sdf': "<?xml version='1.0'?>\n<robot name='r'/>\n",
+}
+
+
+def convert(session, inputfile, tree_backend, stream):
+	"""Urdf of inputfile, or the message of the exception raised"""
+	output = io.StringIO()
+	try:
+		if stream:
+			session.streamConvertFile(inputfile, output, tree_backend)
+		else:
+			session.convertFileTo(inputfile, output, tree_backend)
+	except Exception as e:
+		return f"{e.__class__.__name__}: {e}"
+	return output.getvalue()
+
+def outputs(session, inputfile):
+	return {(backend, stream): convert(session, inputfile, backend, stream)
+			for backend in sdf2urdf.TREE_BACKENDS for stream in (False, True)}
+
+
+@pytest.mark.parametrize('content', INPUTS.values(), ids=INPUTS.keys())
+def test_backends_agree(session, tmp_path, content):
+	inputfile = tmp_path / 'model.sdf'
+	inputfile.write_text(content)
+	results = outputs(session, str(inputfile))
+	assert len(set(results.values())) == 1, results
+
+def test_leading_comment_refused(session, tmp_path):
+	inputfile = tmp_path / 'model.sdf'
+	inputfile.write_text("<?xml version='1.0'?>\n<!-- leading -->\n" + MODEL)
+	for result in outputs(session, str(inputfile)).values():
+		assert result == "Exception: Unsupported file type: #comment"
+	with pytest.raises(Exception, match="#comment"):
+		session.convertString(inputfile.read_text(), 'etree')
+
+# vim: ts=4 sw=4 noet